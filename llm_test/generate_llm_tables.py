@@ -75,24 +75,8 @@ def _extract_llm_text(value) -> Optional[str]:
     return None
 
 
-def call_llm(
-    api_url: str,
-    session_id: str,
-    trial_id: int,
-    condition: int,
-    user_context: str,
-    prompt_path: str,
-    timeout: float,
-    retries: int,
-    sleep_s: float,
-) -> str:
-    payload = {
-        "session_id": session_id,
-        "trial_id": trial_id,
-        "prompt_path": prompt_path,
-        "condition": condition,
-        "user_context": user_context,
-    }
+def _post_llm(api_url: str, payload: Dict, timeout: float, retries: int, sleep_s: float):
+    """POST a payload with retries; return parsed JSON, or the raw text if it is not JSON."""
     body = json.dumps(payload).encode("utf-8")
     req = request.Request(
         api_url,
@@ -107,14 +91,9 @@ def call_llm(
             with request.urlopen(req, timeout=timeout) as resp:
                 raw = resp.read().decode("utf-8", errors="replace")
             try:
-                data = json.loads(raw)
+                return json.loads(raw)
             except json.JSONDecodeError:
                 return raw.strip()
-
-            extracted = _extract_llm_text(data)
-            if extracted is not None:
-                return extracted
-            return json.dumps(data, ensure_ascii=False)
         except error.HTTPError as e:
             try:
                 err_body = e.read().decode("utf-8", errors="replace").strip()
@@ -134,6 +113,65 @@ def call_llm(
     raise RuntimeError(f"LLM request failed after {retries} attempts: {last_err}")
 
 
+def call_llm(
+    api_url: str,
+    session_id: str,
+    trial_id: int,
+    condition: int,
+    user_context: str,
+    prompt_path: str,
+    timeout: float,
+    retries: int,
+    sleep_s: float,
+) -> str:
+    payload = {
+        "session_id": session_id,
+        "trial_id": trial_id,
+        "prompt_path": prompt_path,
+        "condition": condition,
+        "user_context": user_context,
+    }
+    data = _post_llm(api_url, payload, timeout, retries, sleep_s)
+    if isinstance(data, str):
+        return data
+    extracted = _extract_llm_text(data)
+    if extracted is not None:
+        return extracted
+    return json.dumps(data, ensure_ascii=False)
+
+
+def call_llm_fanout(
+    api_url: str,
+    session_id: str,
+    trial_id: int,
+    conditions: List[int],
+    user_context: str,
+    prompt_path: str,
+    timeout: float,
+    retries: int,
+    sleep_s: float,
+) -> Dict[int, str]:
+    """Request several conditions in one call (backend `conditions` mode)."""
+    payload = {
+        "session_id": session_id,
+        "trial_id": trial_id,
+        "prompt_path": prompt_path,
+        "conditions": conditions,
+        "user_context": user_context,
+    }
+    data = _post_llm(api_url, payload, timeout, retries, sleep_s)
+    results = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(results, dict):
+        raise RuntimeError(f"Backend did not return fan-out results: {str(data)[:200]}")
+    out: Dict[int, str] = {}
+    for cond in conditions:
+        extracted = _extract_llm_text(results.get(str(cond)))
+        if extracted is None:
+            raise RuntimeError(f"Missing condition {cond} in fan-out results")
+        out[cond] = extracted
+    return out
+
+
 def read_scenes(csv_path: Path) -> List[Dict[str, str]]:
     with csv_path.open("r", encoding="utf-8", newline="") as f:
         rows = list(csv.DictReader(f))
@@ -228,6 +266,11 @@ def main() -> int:
         action="store_true",
         help="Resume from existing output CSVs if present",
     )
+    parser.add_argument(
+        "--fanout",
+        action="store_true",
+        help="Request all missing conditions (1/2/3) for a scene in a single LLM call",
+    )
     parser.add_argument(
         "--skip-errors",
         action="store_true",
@@ -315,6 +358,35 @@ def main() -> int:
                     print(f"[warn] {out_path.name} trial {scene_trial} original_ans failed: {e}", file=sys.stderr)
                 time.sleep(args.sleep)
 
+            missing = [cond for cond in (1, 2, 3) if not row[f"llm_cond{cond}"]]
+            if args.fanout and missing:
+                prompt = build_followup_prompt(question, row["original_ans"])
+                print(f"[{out_path.name}] trial {scene_trial} ({i}/{len(scenes)}) -> llm_cond{missing}")
+                try:
+                    replies = call_llm_fanout(
+                        api_url=args.api_url,
+                        session_id=args.session_id,
+                        trial_id=args.trial_id,
+                        conditions=missing,
+                        user_context=prompt,
+                        prompt_path=normalized_prompt_path,
+                        timeout=args.timeout,
+                        retries=args.retries,
+                        sleep_s=args.sleep,
+                    )
+                    for cond, text in replies.items():
+                        row[f"llm_cond{cond}"] = text
+                except Exception as e:  # noqa: BLE001
+                    if not args.skip_errors:
+                        print(f"Failed request payload: conditions={missing}, trial={scene_trial}", file=sys.stderr)
+                        print(f"Question: {question}", file=sys.stderr)
+                        print(f"Original answer: {row['original_ans']}", file=sys.stderr)
+                        raise
+                    for cond in missing:
+                        row[f"llm_cond{cond}"] = f"__ERROR__: {e}"
+                    print(f"[warn] {out_path.name} trial {scene_trial} llm_cond{missing} failed: {e}", file=sys.stderr)
+                time.sleep(args.sleep)
+
             for cond in (1, 2, 3):
                 key = f"llm_cond{cond}"
                 if row[key]:
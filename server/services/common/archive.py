@@ -0,0 +1,386 @@
+"""
+Archival of old trials into one compressed archive per session.
+
+A trial directory under data/sessions whose files are all older than `after_days` is packed
+into data/archive/<session>_session.arc and removed. 16-bit WAVs are stored as FLAC (or Opus
+with `audio_codec: opus`), text, JSON and JSONL files as zstd (gzip without zstd) and
+everything else as is. <session>_session.index.json maps each member (`trial_001/user_1B_mic.wav`)
+to its offset, codec and original format. Reads decode back to the original file format, so
+/api/v1/download and /files/ serve archived files under their old paths.
+
+A trial is only packed while no pipeline run or spill holds its trial_lock (io_paths) and
+no file in it changed within `idle_sec`; it is removed only if nothing changed while packing.
+
+Run from the server directory:
+
+    python3 -m services.common.archive run --older-than-days 14
+    python3 -m services.common.archive list <session_id>
+    python3 -m services.common.archive extract sessions/<id>_session/trial_001/user_2B_tts.wav out.wav
+"""
+
+import contextlib, fcntl, gzip, json, logging, os, shutil, subprocess, tempfile, threading, time, wave
+from typing import Dict, Optional, Tuple
+
+from .io_paths import forget_trial, trial_lock
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+ARCHIVE_SUFFIX = '.arc'
+INDEX_SUFFIX = '.index.json'
+TEXT_EXTENSIONS = ('.txt', '.json', '.jsonl', '.csv', '.log', '.yml', '.yaml')
+_BITEXACT = ['-map_metadata', '-1', '-fflags', '+bitexact', '-flags:a', '+bitexact']
+_AUDIO_CODECS = {
+    'flac': {'ext': '.flac', 'args': ['-c:a', 'flac', '-compression_level', '8', '-f', 'flac']},
+    'opus': {'ext': '.ogg', 'args': ['-c:a', 'libopus', '-f', 'ogg']},
+}
+
+log = logging.getLogger('archive')
+
+
+# --- codecs ---
+
+def _zstd_cli() -> Optional[str]:
+    return shutil.which('zstd')
+
+
+def _compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    if _zstd_cli():
+        return 'zstd', subprocess.run([_zstd_cli(), '-q', '-10', '-c'], input=data, check=True,
+                                      stdout=subprocess.PIPE).stdout
+    return 'gzip', gzip.compress(data, 6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return subprocess.run([_zstd_cli() or 'zstd', '-q', '-d', '-c'], input=data, check=True,
+                          stdout=subprocess.PIPE).stdout
+
+
+def _ffmpeg(src: str, dest: str, args):
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', src] + _BITEXACT + list(args) + [dest]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _encode_audio(path: str, codec: str, opus_bitrate: str) -> Optional[Tuple[bytes, dict]]:
+    """Compressed bytes and the WAV parameters needed to restore it; None if not a 16-bit WAV."""
+    try:
+        with wave.open(path, 'rb') as wf:
+            params = {'rate': wf.getframerate(), 'channels': wf.getnchannels()}
+            if wf.getsampwidth() != 2:
+                return None
+    except (wave.Error, EOFError):
+        return None
+    spec = _AUDIO_CODECS[codec]
+    args = list(spec['args'])
+    if codec == 'opus':
+        args[2:2] = ['-b:a', opus_bitrate]
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'audio' + spec['ext'])
+        _ffmpeg(path, out, args)
+        with open(out, 'rb') as f:
+            return f.read(), params
+
+
+def _decode_audio(codec: str, data: bytes, member: dict) -> bytes:
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'audio' + _AUDIO_CODECS[codec]['ext'])
+        out = os.path.join(tmp, 'audio.wav')
+        with open(src, 'wb') as f:
+            f.write(data)
+        _ffmpeg(src, out, ['-c:a', 'pcm_s16le', '-ar', str(member['rate']), '-ac', str(member['channels']), '-f', 'wav'])
+        with open(out, 'rb') as f:
+            return f.read()
+
+
+# --- per-session archive ---
+
+_index_cache: Dict[str, Tuple[float, dict]] = {}
+_index_lock = threading.Lock()
+
+
+class SessionArchive:
+    """Append-only blob of compressed members plus a JSON index, for one session directory."""
+
+    def __init__(self, archive_dir: str, session_name: str):
+        self.session_name = session_name
+        self.blob_path = os.path.join(archive_dir, session_name + ARCHIVE_SUFFIX)
+        self.index_path = os.path.join(archive_dir, session_name + INDEX_SUFFIX)
+
+    def members(self) -> Dict[str, dict]:
+        """The index, cached until the index file changes."""
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+        except FileNotFoundError:
+            return {}
+        with _index_lock:
+            cached = _index_cache.get(self.index_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            members = json.load(f).get('members', {})
+        with _index_lock:
+            _index_cache[self.index_path] = (mtime, members)
+        return members
+
+    def read(self, key: str) -> Optional[bytes]:
+        """A member's original bytes, or None if it is not archived."""
+        member = self.members().get(key)
+        if member is None:
+            return None
+        with open(self.blob_path, 'rb') as f:
+            f.seek(member['offset'])
+            data = f.read(member['length'])
+        codec = member['codec']
+        if codec in _AUDIO_CODECS:
+            return _decode_audio(codec, data, member)
+        if codec in ('zstd', 'gzip'):
+            return _decompress(codec, data)
+        return data
+
+    def add_trial(self, trial_dir: str, audio_codec: str = 'flac', opus_bitrate: str = '48k') -> dict:
+        """Pack every file of trial_dir into the archive. The caller removes the directory afterwards.
+
+        Blob bytes are appended and fsynced before the index is replaced, so an interrupted run
+        leaves only unreferenced bytes behind and the trial directory untouched."""
+        os.makedirs(os.path.dirname(self.blob_path), exist_ok=True)
+        trial_name = os.path.basename(trial_dir.rstrip(os.sep))
+        use_ffmpeg = audio_codec in _AUDIO_CODECS and shutil.which('ffmpeg') is not None
+        stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0}
+        with open(self.blob_path, 'ab') as out:
+            fcntl.flock(out.fileno(), fcntl.LOCK_EX)
+            try:
+                members = dict(self.members())
+                for dirpath, _dirs, files in os.walk(trial_dir):
+                    for name in sorted(files):
+                        if name.startswith('.') and '.tmp' in name:
+                            continue
+                        path = os.path.join(dirpath, name)
+                        key = os.path.join(trial_name, os.path.relpath(path, trial_dir))
+                        st = os.stat(path)
+                        member = {'size': st.st_size, 'mtime': st.st_mtime}
+                        ext = os.path.splitext(name)[1].lower()
+                        encoded = _encode_audio(path, audio_codec, opus_bitrate) if use_ffmpeg and ext == '.wav' else None
+                        if encoded is not None:
+                            payload, params = encoded
+                            member.update(codec=audio_codec, **params)
+                        else:
+                            with open(path, 'rb') as f:
+                                payload = f.read()
+                            if ext in TEXT_EXTENSIONS or ext == '.wav':
+                                codec, payload = _compress(payload)
+                                member['codec'] = codec
+                            else:
+                                member['codec'] = 'store'
+                        member['offset'] = out.seek(0, os.SEEK_END)
+                        member['length'] = len(payload)
+                        out.write(payload)
+                        members[key] = member
+                        stats['files'] += 1
+                        stats['bytes_in'] += st.st_size
+                        stats['bytes_out'] += len(payload)
+                out.flush()
+                os.fsync(out.fileno())
+                tmp = self.index_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({'session': self.session_name, 'members': members}, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.index_path)
+            finally:
+                fcntl.flock(out.fileno(), fcntl.LOCK_UN)
+        return stats
+
+
+def _split(rel_path: str) -> Optional[Tuple[str, str]]:
+    """'sessions/<id>_session/trial_001/x.wav' -> ('<id>_session', 'trial_001/x.wav')."""
+    parts = os.path.normpath(rel_path).split(os.sep)
+    if len(parts) < 4 or parts[0] != 'sessions' or '..' in parts:
+        return None
+    return parts[1], os.path.join(*parts[2:])
+
+
+def read_archived(rel_path: str, data_root: str = 'data', archive_dir: str = None) -> Optional[bytes]:
+    """Original bytes of an archived file named by its path relative to data_root."""
+    split = _split(rel_path)
+    if split is None:
+        return None
+    archive = SessionArchive(archive_dir or os.path.join(data_root, 'archive'), split[0])
+    return archive.read(split[1])
+
+
+def archived_response(rel_path: str, data_root: str = 'data'):
+    """Flask attachment response for an archived file, or None when it is not archived."""
+    from flask import send_file
+    import io
+
+    data = read_archived(rel_path, data_root)
+    if data is None:
+        return None
+    return send_file(io.BytesIO(data), as_attachment=True, download_name=os.path.basename(rel_path))
+
+
+# --- background worker ---
+
+def _newest_mtime(path: str) -> float:
+    newest = os.stat(path).st_mtime
+    for dirpath, _dirs, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(FileNotFoundError):
+                newest = max(newest, os.stat(os.path.join(dirpath, name)).st_mtime)
+    return newest
+
+
+class Archiver:
+    """Packs trials older than `after_days` into their session archive, a few per pass."""
+
+    def __init__(self, data_root: str = 'data', archive_dir: str = None, after_days: float = 14.0,
+                 audio_codec: str = 'flac', opus_bitrate: str = '48k', interval: float = 3600.0,
+                 max_trials_per_pass: int = 50, pause_sec: float = 0.5, idle_sec: float = 10.0):
+        self.data_root = data_root
+        self.archive_dir = archive_dir or os.path.join(data_root, 'archive')
+        self.after_days = after_days
+        self.audio_codec = audio_codec
+        self.opus_bitrate = opus_bitrate
+        self.interval = interval
+        self.max_trials_per_pass = max_trials_per_pass
+        self.pause_sec = pause_sec
+        self.idle_sec = idle_sec
+        self._stop = threading.Event()
+        self._thread = None
+        self.archived_trials = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.skipped_busy = 0
+        self.last_run = None
+        self.last_error = None
+
+    def _cutoff(self, older_than_days: float = None) -> float:
+        """Newest allowed file mtime: older than the threshold and idle for at least idle_sec."""
+        now = time.time()
+        return min(now - 86400.0 * (self.after_days if older_than_days is None else older_than_days), now - self.idle_sec)
+
+    def candidates(self, older_than_days: float = None):
+        cutoff = self._cutoff(older_than_days)
+        sessions = os.path.join(self.data_root, 'sessions')
+        with contextlib.suppress(FileNotFoundError):
+            for session in sorted(os.scandir(sessions), key=lambda e: e.name):
+                if not session.is_dir() or not session.name.endswith('_session'):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    for trial in sorted(os.scandir(session.path), key=lambda e: e.name):
+                        if trial.is_dir() and trial.name.startswith('trial_') and _newest_mtime(trial.path) < cutoff:
+                            yield session.name, trial.path
+
+    def run_once(self, older_than_days: float = None, dry_run: bool = False) -> list:
+        done = []
+        for session_name, trial_dir in self.candidates(older_than_days):
+            if len(done) >= self.max_trials_per_pass or self._stop.is_set():
+                break
+            if dry_run:
+                done.append({'trial': trial_dir})
+                continue
+            with trial_lock(trial_dir, exclusive=True, blocking=False) as locked:
+                # Re-check under the lock: a run may have started since the scan
+                newest = _newest_mtime(trial_dir) if locked else None
+                if newest is None or newest >= self._cutoff(older_than_days):
+                    self.skipped_busy += 1
+                    log.info(f"Skipped {trial_dir}: in use")
+                    continue
+                stats = SessionArchive(self.archive_dir, session_name).add_trial(trial_dir, self.audio_codec, self.opus_bitrate)
+                if _newest_mtime(trial_dir) != newest:
+                    # Written by something that does not take the lock; packed again next pass
+                    self.skipped_busy += 1
+                    log.warning(f"Kept {trial_dir}: changed while it was archived")
+                    continue
+                shutil.rmtree(trial_dir)
+            with contextlib.suppress(ValueError):
+                forget_trial(session_name[: -len('_session')], int(os.path.basename(trial_dir)[len('trial_'):]))
+            self.archived_trials += 1
+            self.bytes_in += stats['bytes_in']
+            self.bytes_out += stats['bytes_out']
+            done.append({'trial': trial_dir, **stats})
+            log.info(f"Archived {trial_dir}: {stats['files']} files, {stats['bytes_in']} -> {stats['bytes_out']} bytes")
+            # Yield disk and CPU to interactive trials between trials
+            time.sleep(self.pause_sec)
+        self.last_run = time.time()
+        return done
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='archiver', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(min(60.0, self.interval) if self.last_run is None else self.interval):
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                log.warning(f"Archive pass failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            'archive_dir': self.archive_dir,
+            'after_days': self.after_days,
+            'archived_trials': self.archived_trials,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'skipped_busy': self.skipped_busy,
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+        }
+
+
+def archiver_from_config(storage: dict, data_root: str = 'data') -> Optional[Archiver]:
+    """The archiver for `storage.archive`, or None when archival is off."""
+    cfg = storage.get('archive', {}) or {}
+    if not cfg.get('enabled', False):
+        return None
+    return Archiver(data_root, cfg.get('dir'), float(cfg.get('after_days', 14)), cfg.get('audio_codec', 'flac'),
+                    str(cfg.get('opus_bitrate', '48k')), float(cfg.get('interval_min', 60)) * 60.0,
+                    int(cfg.get('max_trials_per_pass', 50)), idle_sec=float(storage.get('idle_sec', 10.0)))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Session archive")
+    parser.add_argument('--data', default=os.environ.get('DATA_ROOT', '/workspace/data'))
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    run = sub.add_parser('run', help='archive trials older than a threshold')
+    run.add_argument('--older-than-days', type=float, default=14.0)
+    run.add_argument('--audio-codec', choices=sorted(_AUDIO_CODECS), default='flac')
+    run.add_argument('--max-trials', type=int, default=10 ** 9)
+    run.add_argument('--dry-run', action='store_true')
+    lst = sub.add_parser('list', help='list the members of a session archive')
+    lst.add_argument('session_id')
+    ext = sub.add_parser('extract', help='restore one archived file')
+    ext.add_argument('rel_path', help='path relative to the data root, e.g. sessions/<id>_session/trial_001/x.wav')
+    ext.add_argument('out')
+    args = parser.parse_args()
+
+    if args.cmd == 'run':
+        archiver = Archiver(args.data, audio_codec=args.audio_codec, max_trials_per_pass=args.max_trials, pause_sec=0.0)
+        print(json.dumps(archiver.run_once(args.older_than_days, dry_run=args.dry_run), indent=2))
+    elif args.cmd == 'list':
+        members = SessionArchive(os.path.join(args.data, 'archive'), f'{args.session_id}_session').members()
+        print(json.dumps(members, indent=2, sort_keys=True))
+    else:
+        data = read_archived(args.rel_path, args.data)
+        if data is None:
+            raise SystemExit(f"not archived: {args.rel_path}")
+        with open(args.out, 'wb') as f:
+            f.write(data)
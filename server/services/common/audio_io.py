@@ -0,0 +1,132 @@
+import os, queue, shutil, struct, subprocess, threading
+from typing import Iterator, List, Optional
+
+from .io_paths import atomic_output
+
+# Placeholder size used when the total length is unknown (streaming); most players read until EOF
+_STREAM_SIZE = 0xFFFFFFFF
+
+
+def wav_header(sample_rate: int, channels: int = 1, sampwidth: int = 2, data_size: Optional[int] = None) -> bytes:
+    """RIFF/WAVE header for PCM data. Pass data_size=None when streaming."""
+    byte_rate = sample_rate * channels * sampwidth
+    block_align = channels * sampwidth
+    if data_size is None:
+        riff_size = data_size = _STREAM_SIZE
+    else:
+        riff_size = 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, sampwidth * 8)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+# Output encodings: ffmpeg muxer/codec arguments, file extension and MIME type
+AUDIO_FORMATS = {
+    'wav': {'ext': '.wav', 'mimetype': 'audio/wav', 'args': ['-f', 'wav', '-acodec', 'pcm_s16le']},
+    'pcm': {'ext': '.pcm', 'mimetype': 'audio/L16', 'args': ['-f', 's16le', '-acodec', 'pcm_s16le']},
+    'flac': {'ext': '.flac', 'mimetype': 'audio/flac', 'args': ['-f', 'flac', '-acodec', 'flac']},
+    'opus': {'ext': '.ogg', 'mimetype': 'audio/ogg', 'args': ['-f', 'ogg', '-acodec', 'libopus', '-b:a', '32k', '-page_duration', '20000']},
+}
+# Ogg Vorbis: decodable by Unity's AudioType.OGGVORBIS
+AUDIO_FORMATS['vorbis'] = {'ext': '.ogg', 'mimetype': 'audio/ogg', 'args': ['-f', 'ogg', '-acodec', 'libvorbis', '-q:a', '4']}
+AUDIO_FORMATS['ogg'] = AUDIO_FORMATS['opus']
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+
+def _encode_args(fmt: str, out_rate: Optional[int], bitrate: Optional[str] = None) -> List[str]:
+    spec = AUDIO_FORMATS[fmt]
+    args = list(spec['args'])
+    if bitrate and '-b:a' in args:
+        args[args.index('-b:a') + 1] = bitrate
+    if out_rate:
+        args = ['-ar', str(int(out_rate))] + args
+    return args
+
+
+def transcode_file(src: str, dest: str, fmt: str, out_rate: Optional[int] = None, bitrate: Optional[str] = None):
+    """Encode/resample an audio file with ffmpeg, writing dest atomically (no partial file on failure)."""
+    with atomic_output(dest) as tmp:
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', src] + _encode_args(fmt, out_rate, bitrate) + [tmp]
+        subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+class StreamEncoder:
+    """Incremental ffmpeg encoder for raw 16-bit PCM.
+
+    `write()` queues PCM and returns immediately; a feeder thread pipes it into
+    ffmpeg and a reader thread collects encoded bytes, so encoding never runs on
+    the caller's thread. `drain()` returns whatever is ready; `finish()` closes
+    the input and yields the remainder.
+    """
+
+    def __init__(self, fmt: str, in_rate: int, channels: int = 1, out_rate: Optional[int] = None,
+                 bitrate: Optional[str] = None, read_size: int = 4096):
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 's16le', '-ar', str(int(in_rate)),
+               '-ac', str(int(channels)), '-i', 'pipe:0'] + _encode_args(fmt, out_rate, bitrate) + ['pipe:1']
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.read_size = read_size
+        self._in: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._out: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        threading.Thread(target=self._feed, name='encoder-feed', daemon=True).start()
+        threading.Thread(target=self._read, name='encoder-read', daemon=True).start()
+
+    def _feed(self):
+        try:
+            while True:
+                chunk = self._in.get()
+                if chunk is None:
+                    break
+                self.proc.stdin.write(chunk)
+                self.proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                self.proc.stdin.close()
+            except Exception:
+                pass
+
+    def _read(self):
+        try:
+            while True:
+                data = self.proc.stdout.read1(self.read_size) if hasattr(self.proc.stdout, 'read1') else self.proc.stdout.read(self.read_size)
+                if not data:
+                    break
+                self._out.put(data)
+        finally:
+            self._out.put(None)
+
+    def write(self, pcm: bytes):
+        self._in.put(pcm)
+
+    def drain(self) -> Iterator[bytes]:
+        while True:
+            try:
+                data = self._out.get_nowait()
+            except queue.Empty:
+                return
+            if data is None:
+                self._out.put(None)
+                return
+            yield data
+
+    def finish(self) -> Iterator[bytes]:
+        self._in.put(None)
+        while True:
+            data = self._out.get()
+            if data is None:
+                break
+            yield data
+        self.proc.wait()
+
+    def abort(self):
+        self._in.put(None)
+        try:
+            self.proc.kill()
+        except Exception:
+            pass
@@ -1,22 +1,267 @@
-import fcntl, os, contextlib, time
+import fcntl, os, contextlib, heapq, itertools, threading, time
+from typing import Dict, Optional
 
-@contextlib.contextmanager
-def gpu_lock(path: str, timeout: float = 60.0, poll: float = 0.2):
-    fd = os.open(path, os.O_CREAT | os.O_RDWR)
-    start = time.time()
-    acquired = False
-    try:
-        while time.time() - start < timeout:
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# Waits shorter than this are counted as uncontended in the metrics
+_CONTENDED_SEC = 0.005
+
+
+class _ClassStats:
+    __slots__ = ('acquired', 'contended', 'timeouts', 'aged', 'wait_total', 'wait_max', 'hold_total', 'hold_max')
+
+    def __init__(self):
+        self.acquired = self.contended = self.timeouts = self.aged = 0
+        self.wait_total = self.wait_max = self.hold_total = self.hold_max = 0.0
+
+    def as_dict(self):
+        n = self.acquired
+        return {
+            'acquired': n,
+            'contended': self.contended,
+            'timeouts': self.timeouts,
+            'aged': self.aged,
+            'wait_total_sec': round(self.wait_total, 3),
+            'wait_avg_sec': round(self.wait_total / n, 4) if n else None,
+            'wait_max_sec': round(self.wait_max, 4),
+            'hold_total_sec': round(self.hold_total, 3),
+            'hold_avg_sec': round(self.hold_total / n, 4) if n else None,
+            'hold_max_sec': round(self.hold_max, 4),
+        }
+
+
+class GpuArbiter:
+    """Shares one GPU between the threads of this process and the other services.
+
+    In-process, waiters queue by (priority class, arrival): interactive trial stages go
+    before batch work and each class is served FIFO. Only the head of that queue waits
+    on the flock at `path`, which serializes GPU sections across processes.
+
+    Across processes, interactive waiters hold a shared flock on `<path>.interactive`
+    while queued or running. A batch waiter must take that file exclusively before it
+    joins the queue, so no service starts batch work while an interactive stage is
+    waiting anywhere.
+
+    Batch waiters age: after `batch_max_wait` seconds a batch waiter stops waiting for
+    the interactive barrier and is queued as interactive with its original arrival, so
+    steady interactive traffic delays batch work by a bounded time instead of starving
+    it (None waits indefinitely). The barrier wait blocks in flock on one helper
+    thread per arbiter, which wakes every waiter when it passes; waiters give up at
+    their aging deadline. All waits block in the kernel or on a condition variable.
+    `timeout` bounds the in-process queue wait; the flock wait is bounded by the
+    other services' hold times.
+
+    Work handed to a single worker thread should pass the barrier with admit() on the
+    submitting thread and give the result to acquire(admission=...), so the worker is
+    never stuck at the barrier while interactive jobs queue behind it.
+    """
+
+    def __init__(self, path: str, batch_max_wait: Optional[float] = 10.0):
+        self.path = path
+        self.batch_max_wait = batch_max_wait
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_CREAT | os.O_RDWR)
+        self._intent_path = path + '.interactive'
+        self._intent_fd = os.open(self._intent_path, os.O_CREAT | os.O_RDWR)
+        self._intent_lock = threading.Lock()
+        self._intent_count = 0
+        self._cv = threading.Condition()
+        self._waiting = []
+        self._holder = None
+        self._seq = itertools.count()
+        self._barrier_cv = threading.Condition()
+        self._barrier_thread = None
+        self._barrier_pending = 0
+        self._barrier_passes = 0
+        self._stats: Dict[str, _ClassStats] = {name: _ClassStats() for name in PRIORITIES}
+
+    def _age_at(self, start: float) -> Optional[float]:
+        return None if self.batch_max_wait is None else start + self.batch_max_wait
+
+    def _barrier_loop(self):
+        fd = os.open(self._intent_path, os.O_CREAT | os.O_RDWR)
+        try:
+            while True:
+                with self._barrier_cv:
+                    if not self._barrier_pending:
+                        self._barrier_thread = None
+                        return
+                # Granted once no service holds the shared interactive flock
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                with self._barrier_cv:
+                    self._barrier_passes += 1
+                    self._barrier_pending = 0
+                    self._barrier_cv.notify_all()
+        finally:
+            os.close(fd)
+
+    def _pass_barrier(self, age_at: Optional[float]) -> bool:
+        """Wait until no interactive stage is queued or running in any service.
+        Returns False when age_at passed first."""
+        if age_at is None:
+            fd = os.open(self._intent_path, os.O_CREAT | os.O_RDWR)
             try:
-                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                acquired = True
-                break
-            except BlockingIOError:
-                time.sleep(poll)
-        if not acquired:
-            raise TimeoutError("GPU lock timeout")
-        yield
-    finally:
-        if acquired:
-            fcntl.flock(fd, fcntl.LOCK_UN)
-        os.close(fd)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+            return True
+        with self._barrier_cv:
+            generation = self._barrier_passes
+            self._barrier_pending += 1
+            if self._barrier_thread is None:
+                self._barrier_thread = threading.Thread(target=self._barrier_loop, name='gpu-barrier', daemon=True)
+                self._barrier_thread.start()
+            passed = self._barrier_cv.wait_for(lambda: self._barrier_passes != generation,
+                                               max(0.0, age_at - time.monotonic()))
+            if not passed:
+                self._barrier_pending -= 1
+            return passed
+
+    def _announce(self, priority: str, start: float) -> bool:
+        """Register an interactive waiter, or pass the barrier as a batch waiter.
+        Returns True when a batch waiter gave up on the barrier after aging."""
+        if priority == INTERACTIVE:
+            with self._intent_lock:
+                if self._intent_count == 0:
+                    fcntl.flock(self._intent_fd, fcntl.LOCK_SH)
+                self._intent_count += 1
+            return False
+        return not self._pass_barrier(self._age_at(start))
+
+    def admit(self, priority: str = BATCH) -> dict:
+        """Pass the cross-process interactive barrier now, on the calling thread, for an
+        acquire(priority, admission=...) that a worker thread makes later. Aging counts
+        from this call. Only batch work waits here."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown GPU priority '{priority}'")
+        start = time.monotonic()
+        aged = priority != INTERACTIVE and self._announce(priority, start)
+        return {'priority': priority, 'start': start, 'aged': aged}
+
+    def _retire(self, priority: str):
+        if priority != INTERACTIVE:
+            return
+        with self._intent_lock:
+            self._intent_count -= 1
+            if self._intent_count == 0:
+                fcntl.flock(self._intent_fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def acquire(self, priority: str = INTERACTIVE, timeout: Optional[float] = None, admission: Optional[dict] = None):
+        """Hold the GPU for the duration of the block. Yields a lease dict with `wait_sec`.
+        With `admission` from admit(), the barrier was already passed and wait_sec counts from it."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown GPU priority '{priority}'")
+        stats = self._stats[priority]
+        if admission is not None and priority != INTERACTIVE:
+            start, aged = admission['start'], admission['aged']
+        else:
+            start = time.monotonic()
+            aged = self._announce(priority, start)
+        ticket = (PRIORITIES[priority], next(self._seq))
+        urgent = PRIORITIES[INTERACTIVE]
+        try:
+            with self._cv:
+                stats.aged += aged
+                heapq.heappush(self._waiting, ticket)
+                deadline = None if timeout is None else start + timeout
+                age_at = self._age_at(start) if ticket[0] != urgent else None
+                while self._holder is not None or self._waiting[0] != ticket:
+                    now = time.monotonic()
+                    if age_at is not None and now >= age_at:
+                        # Waited long enough: queue with interactive work, keeping its arrival order
+                        self._waiting.remove(ticket)
+                        ticket = (urgent, ticket[1])
+                        heapq.heapify(self._waiting)
+                        heapq.heappush(self._waiting, ticket)
+                        stats.aged += not aged
+                        aged, age_at = True, None
+                        continue
+                    remaining = None if deadline is None else deadline - now
+                    if remaining is not None and remaining <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        self._cv.notify_all()
+                        stats.timeouts += 1
+                        raise TimeoutError("GPU lock timeout")
+                    waits = [t - now for t in (deadline, age_at) if t is not None]
+                    self._cv.wait(min(waits) if waits else None)
+                heapq.heappop(self._waiting)
+                self._holder = ticket
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._hand_over()
+                raise
+        except BaseException:
+            self._retire(priority)
+            raise
+
+        acquired = time.monotonic()
+        lease = {'priority': priority, 'wait_sec': round(acquired - start, 4)}
+        try:
+            yield lease
+        finally:
+            released = time.monotonic()
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._hand_over()
+            self._retire(priority)
+            wait, hold = acquired - start, released - acquired
+            lease['hold_sec'] = round(hold, 4)
+            with self._cv:
+                stats.acquired += 1
+                stats.contended += wait >= _CONTENDED_SEC
+                stats.wait_total += wait
+                stats.wait_max = max(stats.wait_max, wait)
+                stats.hold_total += hold
+                stats.hold_max = max(stats.hold_max, hold)
+
+    def _hand_over(self):
+        with self._cv:
+            self._holder = None
+            self._cv.notify_all()
+
+    def stats(self):
+        with self._cv:
+            waiting = {name: 0 for name in PRIORITIES}
+            for prio, _ in self._waiting:
+                waiting[next(n for n, p in PRIORITIES.items() if p == prio)] += 1
+            return {
+                'path': self.path,
+                'held': self._holder is not None,
+                'waiting': waiting,
+                **{name: s.as_dict() for name, s in self._stats.items()},
+            }
+
+
+_arbiters: Dict[str, GpuArbiter] = {}
+_arbiters_lock = threading.Lock()
+
+
+def get_arbiter(path: str, batch_max_wait: Optional[float] = 10.0) -> GpuArbiter:
+    """One arbiter per lock file per process (flock state is tied to the open file)."""
+    key = os.path.abspath(path)
+    with _arbiters_lock:
+        if key not in _arbiters:
+            _arbiters[key] = GpuArbiter(key, batch_max_wait)
+        return _arbiters[key]
+
+
+def arbiter_from_config(cfg: dict) -> Optional[GpuArbiter]:
+    """The arbiter configured under `locks`, or None when `enable_gpu_lock` is off."""
+    locks = cfg.get('locks', {}) or {}
+    if not locks.get('enable_gpu_lock', False):
+        return None
+    max_wait = locks.get('batch_max_wait_sec', 10.0)
+    return get_arbiter(locks.get('lock_path', '/workspace/data/.gpu.lock'),
+                       None if max_wait is None else float(max_wait))
+
+
+@contextlib.contextmanager
+def gpu_lock(path: str, timeout: Optional[float] = 60.0, priority: str = INTERACTIVE):
+    with get_arbiter(path).acquire(priority, timeout) as lease:
+        yield lease
@@ -0,0 +1,68 @@
+import heapq, itertools, threading, time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+
+class _Job:
+    __slots__ = ('item', 'priority', 'future', 'enqueued')
+
+    def __init__(self, item: Any, priority: int = 0):
+        self.item = item
+        self.priority = priority
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class InferenceQueue:
+    """Single worker that owns a model and runs jobs from many request threads, one at a time.
+
+    Jobs run in priority order (lower value first), FIFO within a priority. This serializes
+    access to the model instead of letting request threads contend for it; it does not batch:
+    each job is its own `run_job(item)` call. An exception raised by `run_job` fails only
+    that job.
+    """
+
+    def __init__(self, run_job: Callable[[Any], Any], name: str = 'inference-queue'):
+        self.run_job = run_job
+        self._queue: List[Tuple[int, int, _Job]] = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self.jobs = 0
+        self.wait_total = 0.0
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, priority: int = 0) -> Future:
+        job = _Job(item, priority)
+        with self._cv:
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+            self._cv.notify()
+        return job.future
+
+    def run(self, item: Any, timeout: float = None, priority: int = 0):
+        return self.submit(item, priority).result(timeout=timeout)
+
+    def _take(self) -> _Job:
+        with self._cv:
+            while not self._queue:
+                self._cv.wait()
+            return heapq.heappop(self._queue)[2]
+
+    def _loop(self):
+        while True:
+            job = self._take()
+            self.jobs += 1
+            self.wait_total += time.monotonic() - job.enqueued
+            try:
+                job.future.set_result(self.run_job(job.item))
+            except BaseException as e:
+                job.future.set_exception(e)
+
+    def stats(self):
+        with self._cv:
+            depth = len(self._queue)
+        return {
+            'queue_depth': depth,
+            'jobs': self.jobs,
+            'avg_wait_sec': round(self.wait_total / self.jobs, 4) if self.jobs else None,
+        }
@@ -1,15 +1,257 @@
-import os
-from typing import Dict
+import contextlib, fcntl, os, threading, time, uuid
+from typing import Dict, List, Optional
 
-def ensure_trial_paths(session_id: str, trial_id: int) -> Dict[str, str]:
+import yaml
+
+# Seconds a trial manifest trusts its last directory scan before a miss rescans
+# (picks up artifacts written by other services)
+MANIFEST_RESCAN_SEC = float(os.environ.get('MANIFEST_RESCAN_SEC', 1.0))
+
+_created = set()
+_created_lock = threading.Lock()
+
+# Hot trial storage: with `storage.hot_trials` on, trial directories live under data/.hot, a
+# symlink to `storage.hot_root` on tmpfs, and common/trial_spill.py moves them to data/sessions
+# once idle. Session-level data (meta/, prerender) always stays on durable storage.
+# STORAGE_HOT_ROOT overrides the config for every service.
+HOT_DIR = os.path.join('data', '.hot')
+
+
+def _load_storage_config(path: str = 'config/app.yml') -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            storage = dict((yaml.safe_load(f) or {}).get('storage', {}) or {})
+    except OSError:
+        storage = {}
+    if os.environ.get('STORAGE_HOT_ROOT'):
+        storage.update(hot_trials=True, hot_root=os.environ['STORAGE_HOT_ROOT'])
+    return storage
+
+
+STORAGE = _load_storage_config()
+HOT_TRIALS = bool(STORAGE.get('hot_trials'))
+
+
+def _ensure_hot_dir():
+    """Point data/.hot at the tmpfs root (a tmpfs mounted at data/.hot directly also works)."""
+    if os.path.isdir(HOT_DIR):
+        return
+    root = STORAGE.get('hot_root') or '/dev/shm/hri_trials'
+    os.makedirs(root, exist_ok=True)
+    os.makedirs(os.path.dirname(HOT_DIR), exist_ok=True)
+    with contextlib.suppress(FileExistsError):
+        os.symlink(os.path.abspath(root), HOT_DIR)
+
+
+def trial_paths(session_id: str, trial_id: int, durable: bool = False) -> Dict[str, str]:
+    """Paths of a trial without touching the filesystem (read-only callers).
+    `durable=True` gives the data/sessions location even when active trials are kept hot."""
     base = os.path.join('data', 'sessions', f'{session_id}_session')
-    trial_dir = os.path.join(base, f'trial_{trial_id:03d}')
+    trial_root = base if durable or not HOT_TRIALS else os.path.join(HOT_DIR, 'sessions', f'{session_id}_session')
+    trial_dir = os.path.join(trial_root, f'trial_{trial_id:03d}')
     meta_dir = os.path.join(base, 'meta')
-    os.makedirs(trial_dir, exist_ok=True)
-    os.makedirs(meta_dir, exist_ok=True)
-    return {
-        'base': base,
-        'trial_dir': trial_dir,
-        'timeline_path': os.path.join(trial_dir, 'timeline.jsonl'),
-        'meta_dir': meta_dir,
-    }
+    return {'base': base, 'trial_dir': trial_dir, 'timeline_path': os.path.join(trial_dir, 'timeline.jsonl'), 'meta_dir': meta_dir}
+
+
+def trial_locations(session_id: str, trial_id: int) -> List[Dict[str, str]]:
+    """Every place a trial's files can be: the hot directory first, then data/sessions."""
+    paths = [trial_paths(session_id, trial_id)]
+    if HOT_TRIALS:
+        paths.append(trial_paths(session_id, trial_id, durable=True))
+    return paths
+
+
+def trial_dirs(paths: Dict[str, str]) -> List[str]:
+    """The trial directory of a trial_paths() result, followed by its data/sessions location
+    when it is hot, so inputs of a trial that was already moved are still found."""
+    trial_dir = paths['trial_dir']
+    dirs = [trial_dir]
+    if trial_dir.startswith(HOT_DIR + os.sep):
+        dirs.append(os.path.join(os.path.dirname(HOT_DIR), os.path.relpath(trial_dir, HOT_DIR)))
+    return dirs
+
+
+def ensure_trial_paths(session_id: str, trial_id: int) -> Dict[str, str]:
+    """trial_paths, creating the directories the first time this process asks for them, and
+    again if the trial directory was removed since (moved to durable storage, archived, or
+    cleaned up by hand; one stat per call)."""
+    paths = trial_paths(session_id, trial_id)
+    key = paths['trial_dir']
+    if key not in _created or not os.path.isdir(key):
+        if key in _created:
+            # Recreated empty: drop the listing of the directory that went away
+            with _manifests_lock:
+                _manifests.pop(os.path.abspath(key), None)
+        if HOT_TRIALS:
+            _ensure_hot_dir()
+        os.makedirs(paths['trial_dir'], exist_ok=True)
+        os.makedirs(paths['meta_dir'], exist_ok=True)
+        with _created_lock:
+            _created.add(key)
+    return paths
+
+
+@contextlib.contextmanager
+def trial_lock(trial_dir: str, exclusive: bool = False, blocking: bool = True):
+    """flock on a durable trial directory, shared between processes (`.trial_NNN.lock` next
+    to it, so it is never archived or moved). Pipeline runs and the spiller hold it shared;
+    the archiver takes it exclusively without blocking and skips the trial when it is taken.
+    Yields whether the lock was acquired; it is released when the block ends."""
+    path = os.path.join(os.path.dirname(trial_dir), f'.{os.path.basename(trial_dir)}.lock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)
+    try:
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+            locked = True
+        except BlockingIOError:
+            locked = False
+        yield locked
+    finally:
+        os.close(fd)
+
+
+def resolve_data_path(rel_path: str, root: str = 'data') -> str:
+    """Path of a file named relative to `root`; a hot trial file that was already moved to
+    data/sessions resolves to its durable copy."""
+    path = os.path.join(root, rel_path)
+    hot_prefix = os.path.basename(HOT_DIR) + '/'
+    if rel_path.startswith(hot_prefix) and not os.path.exists(path):
+        return os.path.join(root, rel_path[len(hot_prefix):])
+    return path
+
+
+def forget_trial(session_id: str, trial_id: int):
+    """Drop cached state for a trial whose directory was moved or removed."""
+    paths = trial_paths(session_id, trial_id)
+    with _created_lock:
+        _created.discard(paths['trial_dir'])
+    with _manifests_lock:
+        for p in trial_locations(session_id, trial_id):
+            _manifests.pop(os.path.abspath(p['trial_dir']), None)
+
+
+# --- Atomic artifact writes ---
+# Artifacts are written to a hidden temp file in the destination directory and renamed
+# into place, so readers see either the previous file or the complete new one.
+
+def _temp_name(path: str) -> str:
+    # Keeps the extension so format-sniffing writers (wave, ffmpeg, torchaudio) still work
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f'.{stem}.{uuid.uuid4().hex[:8]}.tmp{ext}')
+
+
+@contextlib.contextmanager
+def atomic_output(path: str):
+    """Yield a temp path to write to; it replaces `path` when the block succeeds."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = _temp_name(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+    record_artifact(path)
+
+
+def atomic_write(path: str, data, encoding: str = 'utf-8') -> str:
+    """Write str or bytes to `path` atomically and record it in the trial manifest."""
+    with atomic_output(path) as tmp:
+        if isinstance(data, str):
+            with open(tmp, 'w', encoding=encoding) as f:
+                f.write(data)
+        else:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+    return path
+
+
+# --- Trial manifests ---
+
+class TrialManifest:
+    """In-memory listing of the artifacts in one trial directory (name -> size, mtime).
+
+    Seeded by one scandir on first use and updated by atomic writes in this process. A
+    lookup that misses rescans at most every MANIFEST_RESCAN_SEC, so files written by other
+    services appear without a stat per question."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._entries: Dict[str, Dict[str, float]] = {}
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        entries = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    entries[entry.name] = {'size': st.st_size, 'mtime': st.st_mtime}
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._entries = entries
+            self._scanned_at = time.monotonic()
+
+    def _fresh(self, force: bool = False):
+        scanned = self._scanned_at
+        if scanned is None or (force and time.monotonic() - scanned >= MANIFEST_RESCAN_SEC):
+            self._scan()
+
+    def record(self, name: str, size: Optional[int] = None, mtime: Optional[float] = None):
+        with self._lock:
+            self._entries[name] = {'size': size, 'mtime': mtime if mtime is not None else time.time()}
+
+    def get(self, name: str) -> Optional[Dict[str, float]]:
+        self._fresh()
+        entry = self._entries.get(name)
+        if entry is None:
+            self._fresh(force=True)
+            entry = self._entries.get(name)
+        return entry
+
+    def has(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def artifacts(self) -> Dict[str, Dict[str, float]]:
+        self._fresh()
+        with self._lock:
+            return dict(self._entries)
+
+
+_manifests: Dict[str, TrialManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def _manifest_for(directory: str) -> TrialManifest:
+    key = os.path.abspath(directory)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = _manifests[key] = TrialManifest(key)
+        return manifest
+
+
+def trial_manifest(session_id: str, trial_id: int, durable: bool = False) -> TrialManifest:
+    return _manifest_for(trial_paths(session_id, trial_id, durable)['trial_dir'])
+
+
+def trial_has(session_id: str, trial_id: int, name: str) -> bool:
+    """Whether a trial artifact exists in the hot or the durable trial directory."""
+    return any(_manifest_for(p['trial_dir']).has(name) for p in trial_locations(session_id, trial_id))
+
+
+def record_artifact(path: str, size: Optional[int] = None):
+    """Note a finished artifact (written here, or reported by another service) in its directory's manifest."""
+    if size is None:
+        with contextlib.suppress(OSError):
+            size = os.path.getsize(path)
+    _manifest_for(os.path.dirname(path) or '.').record(os.path.basename(path), size)
@@ -1,12 +1,157 @@
-import logging, os
+import atexit, contextlib, contextvars, copy, datetime, json, logging, logging.handlers, os, queue, sys, threading, time
+from typing import Any, Dict
+
+# Logging never blocks a request thread: records go onto a bounded in-memory queue and a
+# listener thread formats and writes them. LOG_FORMAT=json (default) writes one JSON object
+# per line, LOG_FORMAT=text the classic "[time] LEVEL name: message" form.
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+# Records waiting beyond this are dropped (and counted) rather than waited on
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Identical messages from one logger within this many seconds are collapsed into a count
+LOG_DEDUP_SEC = float(os.environ.get('LOG_DEDUP_SEC', 10.0))
+
+_TEXT_FORMAT = "[%(asctime)s] %(levelname)s %(name)s: %(message)s"
+
+# Per-request fields (session, trial, trace) attached to every record logged in that context
+_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default={})
+
+
+def bind_context(**fields):
+    """Add fields to the current request's log context; None values are skipped."""
+    _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def clear_context(*_args):
+    """Reset the log context; register as a Flask teardown_request handler."""
+    _context.set({})
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _DedupFilter(logging.Filter):
+    """Passes the first of identical (logger, level, message) records per window; the next
+    one after the window carries `suppressed`, the number that were dropped in between."""
+
+    def __init__(self, window: float = LOG_DEDUP_SEC, max_keys: int = 2048):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self._seen: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            if entry is not None and entry[1]:
+                record.suppressed = entry[1]
+            if len(self._seen) >= self.max_keys:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            self._seen[key] = [now, 0]
+        return True
+
+
+class _AsyncQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that captures the request context and never blocks or raises on a full queue."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Render in the caller (args may be mutated later) but leave formatting to the listener
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = (record.exc_text + '\n' if record.exc_text else '') + record.stack_info
+            record.stack_info = None
+        record.ctx = _context.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        out.update(getattr(record, 'ctx', None) or {})
+        if getattr(record, 'suppressed', 0):
+            out['suppressed'] = record.suppressed
+        if record.exc_text:
+            out['exc'] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = dict(getattr(record, 'ctx', None) or {})
+        if getattr(record, 'suppressed', 0):
+            extra['suppressed'] = record.suppressed
+        if extra:
+            head, sep, tail = line.partition('\n')
+            line = head + ' ' + ' '.join(f'{k}={v}' for k, v in extra.items()) + sep + tail
+        return line
+
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def _queue_handler() -> _AsyncQueueHandler:
+    """The process-wide queue handler, attached to the root logger so library loggers
+    (werkzeug access lines, timeline, session_store) share the pipeline."""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is None:
+            q = queue.Queue(LOG_QUEUE_SIZE)
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(_TEXT_FORMAT))
+            _listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_listener.stop)
+            _handler = _AsyncQueueHandler(q)
+            _handler.addFilter(_DedupFilter())
+            logging.getLogger().addHandler(_handler)
+        return _handler
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
 
 def setup_logging(name: str):
     logger = logging.getLogger(name)
     level = os.environ.get("LOG_LEVEL", "INFO").upper()
     logger.setLevel(getattr(logging, level, logging.INFO))
-    if not logger.handlers:
-        ch = logging.StreamHandler()
-        fmt = logging.Formatter("[%(asctime)s] %(levelname)s %(name)s: %(message)s")
-        ch.setFormatter(fmt)
-        logger.addHandler(ch)
+    _queue_handler()
     return logger
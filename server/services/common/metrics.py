@@ -0,0 +1,313 @@
+import bisect, threading, time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds; spans STT decode on CPU through long TTS inference
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' '))
+             for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+
+    def snapshot(self):
+        with self._lock:
+            return [{**dict(zip(self.labelnames, k)), 'value': v} for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """Settable value; `set_function` samples a callback at scrape time (queue depth, pool state)."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def _sample(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+
+    def render(self):
+        self._sample()
+        return super().render()
+
+    def snapshot(self):
+        self._sample()
+        return super().snapshot()
+
+
+class _HistogramValue:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, n: int):
+        self.counts = [0] * (n + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            hv = self._values.get(key)
+            if hv is None:
+                hv = self._values[key] = _HistogramValue(len(self.buckets))
+            hv.counts[idx] += 1
+            hv.sum += value
+            hv.count += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate from the buckets the way PromQL's histogram_quantile does."""
+        with self._lock:
+            hv = self._values.get(self._key(labels))
+            if hv is None or not hv.count:
+                return None
+            counts = list(hv.counts)
+            total = hv.count
+        return self._quantile_from(counts, total, q)
+
+    def _quantile_from(self, counts: List[int], total: int, q: float) -> float:
+        rank = q * total
+        cumulative = 0
+        for i, c in enumerate(counts):
+            if cumulative + c >= rank and c:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return self.buckets[-1]
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(v.counts), v.sum, v.count) for k, v in self._values.items()]
+        lines = []
+        for key, counts, total_sum, count in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _fmt_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total_sum}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            items = [(k, list(v.counts), v.sum, v.count) for k, v in self._values.items()]
+        out = []
+        for key, counts, total_sum, count in items:
+            row = dict(zip(self.labelnames, key))
+            row.update(count=count, sum=round(total_sum, 4))
+            for q in (0.5, 0.95, 0.99):
+                row[f'p{int(q * 100)}'] = round(self._quantile_from(counts, count, q), 4) if count else None
+            out.append(row)
+        return out
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict[str, str]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kw):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kw)
+            return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.header())
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests handled', ('service', 'endpoint', 'method', 'status'))
+IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests being handled', ('service',))
+REQUEST_LATENCY = REGISTRY.histogram('http_request_duration_seconds', 'HTTP request latency, until the body is sent',
+                                     ('service', 'endpoint'))
+STAGE_LATENCY = REGISTRY.histogram('stage_duration_seconds', 'Pipeline stage latency (timeline span paths)',
+                                   ('service', 'stage'))
+QUEUE_DEPTH = REGISTRY.gauge('queue_depth', 'Work waiting in an internal queue', ('service', 'queue'))
+LOG_DROPPED = REGISTRY.gauge('log_records_dropped', 'Log records dropped because the log queue was full', ('service',))
+
+
+def observe_span(service: str, path: str, dur_ms: float):
+    STAGE_LATENCY.observe(dur_ms / 1000.0, service=service, stage=path)
+
+
+class _MetricsMiddleware:
+    """WSGI wrapper counting requests per Flask endpoint; latency covers streamed bodies too."""
+
+    def __init__(self, flask_app, wsgi_app, service: str):
+        self.flask_app = flask_app
+        self.wsgi_app = wsgi_app
+        self.service = service
+
+    def _endpoint(self, environ) -> str:
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except Exception:
+            return 'unmatched'
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        endpoint = self._endpoint(environ)
+        method = environ.get('REQUEST_METHOD', '')
+        status = {'code': '500'}
+
+        def _start_response(code, headers, exc_info=None):
+            status['code'] = code.split(' ', 1)[0]
+            return start_response(code, headers, exc_info)
+
+        IN_FLIGHT.inc(service=self.service)
+        try:
+            body = self.wsgi_app(environ, _start_response)
+        except BaseException:
+            self._done(start, endpoint, method, '500')
+            raise
+        return _ClosingIterator(body, lambda: self._done(start, endpoint, method, status['code']))
+
+    def _done(self, start, endpoint, method, code):
+        IN_FLIGHT.dec(service=self.service)
+        REQUESTS.inc(service=self.service, endpoint=endpoint, method=method, status=code)
+        REQUEST_LATENCY.observe(time.perf_counter() - start, service=self.service, endpoint=endpoint)
+
+
+class _ClosingIterator:
+    def __init__(self, body, on_close):
+        self._body = body
+        self._iter = iter(body)
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+def install(app, service: str):
+    """Count requests, time timeline spans per stage and serve GET /metrics on a Flask app.
+    `/metrics?format=json` returns the same data with p50/p95/p99 estimates."""
+    from flask import Response, jsonify, request
+    from .logging_conf import dropped_records
+    from .timeline import add_span_observer
+
+    app.wsgi_app = _MetricsMiddleware(app, app.wsgi_app, service)
+    add_span_observer(observe_span)
+    LOG_DROPPED.set_function(dropped_records, service=service)
+
+    def metrics():
+        if request.args.get('format') == 'json':
+            return jsonify(REGISTRY.snapshot())
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
@@ -0,0 +1,191 @@
+import asyncio, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Deque, List, Optional, Sequence
+
+
+def normalize_host(raw: str) -> str:
+    raw = (raw or '').strip()
+    if not (raw.startswith('http://') or raw.startswith('https://')):
+        raw = 'http://' + raw
+    return raw.rstrip('/')
+
+
+class _Endpoint:
+    def __init__(self, url: str, window: int):
+        self.url = url
+        self.outstanding = 0
+        self.dispatched = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        data = sorted(self.latencies)
+        idx = min(len(data) - 1, int(round(q * (len(data) - 1))))
+        return data[idx]
+
+
+class OllamaPool:
+    """Route Ollama calls across several hosts.
+
+    Picks the healthy host with the fewest outstanding requests, ejects a host
+    for `eject_seconds` after `eject_after` consecutive failures, and optionally
+    hedges: if the first attempt runs past that host's latency quantile, a
+    duplicate is sent to another host and whichever finishes first wins.
+    """
+
+    def __init__(self, hosts: Sequence[str], eject_after: int = 3, eject_seconds: float = 30.0,
+                 hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_samples: int = 20,
+                 latency_window: int = 200, max_workers: int = 32):
+        urls = [normalize_host(h) for h in hosts if h and str(h).strip()]
+        if not urls:
+            raise ValueError("OllamaPool needs at least one host")
+        self.endpoints: List[_Endpoint] = [_Endpoint(u, latency_window) for u in dict.fromkeys(urls)]
+        self.eject_after = max(1, int(eject_after))
+        self.eject_seconds = float(eject_seconds)
+        self.hedge = bool(hedge) and len(self.endpoints) > 1
+        self.hedge_quantile = float(hedge_quantile)
+        self.hedge_min_samples = int(hedge_min_samples)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ollama') if self.hedge else None
+
+    @property
+    def urls(self) -> List[str]:
+        return [ep.url for ep in self.endpoints]
+
+    def _acquire(self, exclude: Sequence[_Endpoint] = ()) -> Optional[_Endpoint]:
+        now = time.time()
+        with self._lock:
+            pool = [ep for ep in self.endpoints if ep not in exclude]
+            if not pool:
+                return None
+            healthy = [ep for ep in pool if ep.healthy(now)]
+            # All hosts ejected: probe the one whose ejection expires first
+            candidates = healthy or [min(pool, key=lambda ep: ep.ejected_until)]
+            # Ties go to the host used least overall so idle traffic still spreads
+            ep = min(candidates, key=lambda e: (e.outstanding, e.dispatched))
+            ep.outstanding += 1
+            ep.dispatched += 1
+            return ep
+
+    def _release(self, ep: _Endpoint, elapsed: float, ok: Optional[bool]):
+        with self._lock:
+            ep.outstanding -= 1
+            if ok is None:
+                # Cancelled hedge loser: neither a success sample nor a failure
+                return
+            if ok:
+                ep.failures = 0
+                ep.ejected_until = 0.0
+                ep.latencies.append(elapsed)
+            else:
+                ep.failures += 1
+                if ep.failures >= self.eject_after:
+                    ep.ejected_until = time.time() + self.eject_seconds
+
+    def _run(self, ep: _Endpoint, fn: Callable[[str], object]):
+        t0 = time.monotonic()
+        ok = False
+        try:
+            result = fn(ep.url)
+            ok = True
+            return result
+        finally:
+            self._release(ep, time.monotonic() - t0, ok)
+
+    def _hedge_delay(self, ep: _Endpoint) -> Optional[float]:
+        with self._lock:
+            if len(ep.latencies) < self.hedge_min_samples:
+                return None
+            return ep.quantile(self.hedge_quantile)
+
+    def call(self, fn: Callable[[str], object]):
+        """Run `fn(base_url)` against the pool and return its result.
+
+        Exceptions from the last attempted host are re-raised.
+        """
+        first = self._acquire()
+        if not self.hedge:
+            return self._run(first, fn)
+
+        delay = self._hedge_delay(first)
+        primary = self._executor.submit(self._run, first, fn)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        second = self._acquire(exclude=[first])
+        if second is None:
+            return primary.result()
+        backup = self._executor.submit(self._run, second, fn)
+        pending = {primary, backup}
+        last_exc: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                exc = fut.exception()
+                if exc is None:
+                    # The loser keeps running to completion; its slot is released when it returns
+                    return fut.result()
+                last_exc = exc
+        raise last_exc
+
+    async def _arun(self, ep: _Endpoint, afn):
+        t0 = time.monotonic()
+        ok = False
+        try:
+            result = await afn(ep.url)
+            ok = True
+            return result
+        except asyncio.CancelledError:
+            ok = None
+            raise
+        finally:
+            self._release(ep, time.monotonic() - t0, ok)
+
+    async def acall(self, afn):
+        """Async variant of `call`: awaits `afn(base_url)`; the hedge loser is cancelled."""
+        first = self._acquire()
+        primary = asyncio.ensure_future(self._arun(first, afn))
+        delay = self._hedge_delay(first) if self.hedge else None
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        second = self._acquire(exclude=[first])
+        if second is None:
+            return await primary
+        backup = asyncio.ensure_future(self._arun(second, afn))
+        pending = {primary, backup}
+        last_exc: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                exc = fut.exception()
+                if exc is None:
+                    for other in pending:
+                        other.cancel()
+                    return fut.result()
+                last_exc = exc
+        raise last_exc
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return [{
+                'url': ep.url,
+                'outstanding': ep.outstanding,
+                'healthy': ep.healthy(now),
+                'failures': ep.failures,
+                'p95': ep.quantile(0.95),
+            } for ep in self.endpoints]
@@ -0,0 +1,111 @@
+import hashlib, json, os, shutil, threading, time
+from typing import Dict, Optional, Tuple
+
+
+def cache_key(**parts) -> str:
+    """Stable sha256 over JSON-serializable parts (text, reference digest, parameters, ...)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src: str, dest: str):
+    """Place src at dest via hard link (same filesystem) or copy, replacing dest atomically."""
+    tmp = f"{dest}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class DiskLRUCache:
+    """Content-addressed file cache under `root`, evicting least recently used entries
+    once the total size exceeds `max_bytes`. Recency is the file mtime, refreshed on hit,
+    so the order survives restarts."""
+
+    def __init__(self, root: str, max_bytes: int, suffix: str = '.wav'):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, float]] = {}  # key -> (size, last_used)
+        os.makedirs(root, exist_ok=True)
+        for name in os.listdir(root):
+            if not name.endswith(suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            self._index[name[:-len(suffix)]] = (st.st_size, st.st_mtime)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + self.suffix)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for size, _ in self._index.values())
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._index.get(key)
+            path = self._path(key)
+            if entry is None or not os.path.isfile(path):
+                self._index.pop(key, None)
+                self.misses += 1
+                return None
+            now = time.time()
+            self._index[key] = (entry[0], now)
+            self.hits += 1
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def materialize(self, key: str, dest: str) -> bool:
+        """Place the cached file for key at dest. Returns False on a miss."""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dest)
+            return True
+        except OSError:
+            return False
+
+    def store(self, key: str, src: str):
+        if not os.path.isfile(src):
+            return
+        path = self._path(key)
+        link_or_copy(src, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._index[key] = (size, time.time())
+            self._evict_locked()
+
+    def _evict_locked(self):
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            del self._index[key]
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,114 @@
+import math, threading
+from typing import Dict, List, Optional, Tuple
+
+ELLIPSIS = "\n[...]\n"
+
+
+class TokenEstimator:
+    """Approximate token counts for the active model.
+
+    Starts from a chars-per-token ratio and calibrates it from the
+    `prompt_eval_count` Ollama reports, so the estimate converges on the
+    tokenizer actually serving the model. The calibrated ratio is an EWMA
+    seeded with the configured one and is only used once `min_samples`
+    prompts have been observed, so one odd prompt cannot set the estimate.
+
+    `prompt_eval_count` leaves out a prefix Ollama found in its cache, which
+    makes a prompt look like far more characters per token than it is. Samples
+    more than `max_deviation` times off the configured ratio are ignored (and
+    counted in `rejected`); the rest are clamped to `ratio_band`.
+    """
+
+    def __init__(self, chars_per_token: float = 3.5, smoothing: float = 0.2, min_samples: int = 5,
+                 ratio_band: Tuple[float, float] = (1.5, 6.0), max_deviation: float = 2.0):
+        self.default_chars_per_token = float(chars_per_token)
+        self.smoothing = float(smoothing)
+        self.min_samples = max(1, int(min_samples))
+        self.ratio_band = (float(ratio_band[0]), float(ratio_band[1]))
+        self.max_deviation = float(max_deviation)
+        self.samples = 0
+        self.rejected = 0
+        self._calibrated = self.default_chars_per_token
+        self._lock = threading.Lock()
+
+    @property
+    def chars_per_token(self) -> float:
+        if self.samples < self.min_samples:
+            return self.default_chars_per_token
+        return self._calibrated
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return int(math.ceil(len(text) / self.chars_per_token))
+
+    def chars_for(self, tokens: int) -> int:
+        return max(0, int(tokens * self.chars_per_token))
+
+    def observe(self, text: str, actual_tokens: Optional[int]):
+        if not text or not actual_tokens or actual_tokens <= 0:
+            return
+        ratio = len(text) / float(actual_tokens)
+        deviation = max(ratio, self.default_chars_per_token) / min(ratio, self.default_chars_per_token)
+        with self._lock:
+            if deviation > self.max_deviation:
+                self.rejected += 1
+                return
+            ratio = min(max(ratio, self.ratio_band[0]), self.ratio_band[1])
+            self._calibrated += self.smoothing * (ratio - self._calibrated)
+            self.samples += 1
+
+
+def truncate_middle(text: str, max_chars: int, head_share: float = 0.66) -> str:
+    """Keep the head and tail of `text` within max_chars, cutting on whitespace."""
+    if len(text) <= max_chars:
+        return text
+    room = max_chars - len(ELLIPSIS)
+    if room <= 0:
+        return ''
+    head_len = int(room * head_share)
+    tail_len = room - head_len
+    head = text[:head_len]
+    if ' ' in head:
+        head = head[:head.rfind(' ')]
+    tail = text[len(text) - tail_len:] if tail_len else ''
+    if ' ' in tail:
+        tail = tail[tail.find(' ') + 1:]
+    return (head.rstrip() + ELLIPSIS + tail.lstrip()).strip()
+
+
+def build_prompt(estimator: TokenEstimator, tmpl: str, scene_text: str, asr_text: str,
+                 budget: int = 0, shared_first: bool = False) -> Tuple[str, Dict]:
+    """Join template, scene and ASR text, trimming to `budget` tokens (0 = unlimited).
+
+    The template is kept intact; the scene/context is trimmed first and the
+    ASR text only when the template and ASR alone exceed the budget.
+    Returns (prompt, info) where info is suitable for the timeline.
+    """
+    sep_tokens = estimator.count("\n\n")
+    counts = {
+        'template': estimator.count(tmpl),
+        'scene': estimator.count(scene_text),
+        'asr': estimator.count(asr_text),
+    }
+    truncated: List[str] = []
+    if budget and budget > 0 and sum(counts.values()) + 2 * sep_tokens > budget:
+        room = budget - counts['template'] - 2 * sep_tokens
+        asr_room = min(counts['asr'], max(0, room))
+        if asr_room < counts['asr']:
+            asr_text = truncate_middle(asr_text, estimator.chars_for(asr_room))
+            truncated.append('asr')
+        scene_room = max(0, room - estimator.count(asr_text))
+        if scene_room < counts['scene']:
+            scene_text = truncate_middle(scene_text, estimator.chars_for(scene_room))
+            truncated.append('scene')
+
+    parts = [scene_text, asr_text, tmpl] if shared_first else [tmpl, scene_text, asr_text]
+    prompt = "\n\n".join(part for part in parts if part).strip()
+    info = {
+        'prompt_tokens_est': estimator.count(prompt),
+        'budget': budget or None,
+        'truncated': truncated,
+        'input_tokens_est': counts,
+    }
+    return prompt, info
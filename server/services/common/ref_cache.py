@@ -0,0 +1,61 @@
+import hashlib, os, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+_digest_lock = threading.Lock()
+# (abs path) -> ((mtime_ns, size), digest); avoids re-hashing an unchanged file on every trial
+_digest_memo: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file's content, memoized by (mtime, size)."""
+    abs_path = os.path.abspath(path)
+    st = os.stat(abs_path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _digest_lock:
+        hit = _digest_memo.get(abs_path)
+        if hit and hit[0] == key:
+            return hit[1]
+    h = hashlib.sha256()
+    with open(abs_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_memo[abs_path] = (key, digest)
+    return digest
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with hit/miss counters."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max(1, int(max_entries))
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
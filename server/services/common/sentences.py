@@ -0,0 +1,48 @@
+import re
+
+# A sentence ends at ., ! or ? (plus closing quotes/brackets) followed by whitespace
+_SENTENCE_END = re.compile(r'[.!?]+["\'\)\]]*(?=\s)')
+# Words whose trailing period does not end a sentence ("Dr. Smith", "e.g. this")
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'vs', 'approx', 'dept', 'fig',
+    'e.g', 'i.e', 'cf', 'a.m', 'p.m', 'u.s', 'u.k',
+}
+
+
+def _period_ends_sentence(text: str, m):
+    """Whether a lone '.' match ends a sentence; None while the next word has not arrived."""
+    rest = text[m.end():].lstrip()
+    if not rest:
+        return None
+    if rest[0].islower():
+        # "e.g. this", "3. item"
+        return False
+    before = text[:m.start()].split()
+    word = before[-1].lstrip('"\'([').lower() if before else ''
+    return not (word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()))
+
+
+def sentence_cut(text: str, max_sentences: int, start: int = 0, count: int = 0):
+    """Scan text from `start` for sentence ends; return (cut_index or None, next_start, count).
+
+    Meant for streamed text: feed the growing text back with the returned next_start and
+    count. A period is only counted once the following word is known, so abbreviations,
+    initials and numbered items ("Dr. Smith", "J. Doe", "3. item") do not end a sentence."""
+    last = start
+    for m in _SENTENCE_END.finditer(text, start):
+        # Skip list markers like "1. " that carry no words
+        if not re.search(r'[A-Za-z]', text[last:m.start()]):
+            last = m.end()
+            continue
+        if m.group().rstrip('"\')]') == '.':
+            ends = _period_ends_sentence(text, m)
+            if ends is None:
+                # Decide once the next word streams in; rescan from the sentence start
+                break
+            if not ends:
+                continue
+        count += 1
+        last = m.end()
+        if count >= max_sentences:
+            return m.end(), last, count
+    return None, last, count
@@ -0,0 +1,255 @@
+"""
+Indexed store for pipeline call records (the data in per-trial call_log.jsonl files).
+
+SQLite in WAL mode: the orchestrator enqueues records and a writer thread commits them
+in batches, while readers query concurrently. Import existing logs with:
+
+    python3 services/common/session_store.py import /workspace/data/sessions
+    python3 services/common/session_store.py stats tts --since 2025-01-01
+"""
+
+import atexit, datetime, hashlib, json, logging, math, os, queue, sqlite3, threading, time
+from typing import Any, Dict, Iterable, List, Optional
+
+STAGES = ('stt', 'llm', 'tts', 'total')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL UNIQUE,
+    ts REAL NOT NULL,
+    session_id TEXT,
+    trial_id INTEGER,
+    status TEXT,
+    trace_id TEXT,
+    condition TEXT,
+    voice_id TEXT,
+    stt_sec REAL,
+    llm_sec REAL,
+    tts_sec REAL,
+    total_sec REAL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_calls_session ON calls (session_id, trial_id);
+CREATE INDEX IF NOT EXISTS idx_calls_status ON calls (status, ts);
+CREATE INDEX IF NOT EXISTS idx_calls_ts ON calls (ts);
+CREATE INDEX IF NOT EXISTS idx_calls_stt ON calls (stt_sec);
+CREATE INDEX IF NOT EXISTS idx_calls_llm ON calls (llm_sec);
+CREATE INDEX IF NOT EXISTS idx_calls_tts ON calls (tts_sec);
+CREATE INDEX IF NOT EXISTS idx_calls_total ON calls (total_sec);
+"""
+
+_COLUMNS = ('uid', 'ts', 'session_id', 'trial_id', 'status', 'trace_id', 'condition', 'voice_id',
+            'stt_sec', 'llm_sec', 'tts_sec', 'total_sec', 'record')
+
+
+def parse_time(value) -> Optional[float]:
+    """Epoch seconds from a number or an ISO date/datetime string (local time)."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.datetime.fromisoformat(str(value)).timestamp()
+
+
+def record_uid(record: Dict[str, Any]) -> str:
+    """Dedup key of a call record: its trace id, else a hash of its canonical JSON. Derived
+    from the parsed record, so a live record and the same line re-imported from
+    call_log.jsonl get the same uid."""
+    if record.get('trace_id'):
+        return record['trace_id']
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _row(record: Dict[str, Any], raw: str = None) -> tuple:
+    timing = record.get('timing') or {}
+    req = record.get('request') or {}
+    blob = raw if raw is not None else json.dumps(record, ensure_ascii=False, sort_keys=True)
+    uid = record_uid(record)
+
+    def num(v):
+        try:
+            return float(v) if v is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    try:
+        trial_id = int(record.get('trial_id')) if record.get('trial_id') is not None else None
+    except (TypeError, ValueError):
+        trial_id = None
+    return (uid, float(record.get('ts') or 0.0), record.get('session_id'), trial_id, record.get('status'),
+            record.get('trace_id'), req.get('condition'), req.get('voice_id'),
+            num(timing.get('stt')), num(timing.get('llm')), num(timing.get('tts')), num(timing.get('total')), blob)
+
+
+class SessionStore:
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._writer = threading.Thread(target=self._loop, name='session-store', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- writes ---
+    def record(self, record: Dict[str, Any]):
+        """Queue one call record; returns immediately."""
+        self._queue.put(_row(record))
+
+    def flush(self, timeout: float = 10.0):
+        """Block until everything queued so far is committed."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _insert(self, conn: sqlite3.Connection, rows: List[tuple]):
+        placeholders = ','.join('?' * len(_COLUMNS))
+        with conn:
+            conn.executemany(f"INSERT OR IGNORE INTO calls ({','.join(_COLUMNS)}) VALUES ({placeholders})", rows)
+
+    def _loop(self):
+        conn = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._insert(conn, rows)
+            except sqlite3.Error as e:
+                logging.getLogger('session_store').warning(f"Failed to write {len(rows)} call records: {e}")
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def import_jsonl(self, paths: Iterable[str]) -> Dict[str, int]:
+        """Insert records from call_log.jsonl files; records already present are skipped."""
+        conn = self._connect()
+        files = lines = before = 0
+        try:
+            before = conn.execute('SELECT COUNT(*) FROM calls').fetchone()[0]
+            rows = []
+            for path in paths:
+                files += 1
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            rows.append(_row(json.loads(line), line))
+                        except ValueError:
+                            continue
+                        lines += 1
+                        if len(rows) >= 5000:
+                            self._insert(conn, rows)
+                            rows = []
+            if rows:
+                self._insert(conn, rows)
+            after = conn.execute('SELECT COUNT(*) FROM calls').fetchone()[0]
+        finally:
+            conn.close()
+        return {'files': files, 'records': lines, 'inserted': after - before}
+
+    # --- reads ---
+    @staticmethod
+    def _where(session_id=None, trial_id=None, status=None, since=None, until=None):
+        clauses, args = [], []
+        for column, value in (('session_id', session_id), ('trial_id', trial_id), ('status', status)):
+            if value is not None and value != '':
+                clauses.append(f'{column} = ?')
+                args.append(value)
+        if since is not None:
+            clauses.append('ts >= ?')
+            args.append(since)
+        if until is not None:
+            clauses.append('ts < ?')
+            args.append(until)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', args
+
+    def query(self, session_id=None, trial_id=None, status=None, since=None, until=None,
+              limit: int = 1000) -> List[Dict[str, Any]]:
+        where, args = self._where(session_id, trial_id, status, since, until)
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'SELECT * FROM calls{where} ORDER BY ts DESC LIMIT ?', args + [int(limit)]).fetchall()
+        finally:
+            conn.close()
+        out = []
+        for r in rows:
+            item = {k: r[k] for k in r.keys() if k not in ('record', 'id', 'uid')}
+            item['record'] = json.loads(r['record'])
+            out.append(item)
+        return out
+
+    def stage_stats(self, stage: str, session_id=None, status='success', since=None, until=None,
+                    quantiles=(0.5, 0.95, 0.99)) -> Dict[str, Any]:
+        """Count, mean and quantiles (nearest rank, read through the stage index) of one stage."""
+        if stage not in STAGES:
+            raise ValueError(f"unknown stage '{stage}', expected one of {STAGES}")
+        column = f'{stage}_sec'
+        where, args = self._where(session_id, None, status, since, until)
+        where = (where + ' AND ' if where else ' WHERE ') + f'{column} IS NOT NULL'
+        conn = self._connect()
+        try:
+            count, mean, lo, hi = conn.execute(
+                f'SELECT COUNT(*), AVG({column}), MIN({column}), MAX({column}) FROM calls{where}', args).fetchone()
+            result = {'stage': stage, 'count': count, 'mean': mean, 'min': lo, 'max': hi}
+            for q in quantiles:
+                value = None
+                if count:
+                    offset = min(count - 1, max(0, math.ceil(q * count) - 1))
+                    value = conn.execute(f'SELECT {column} FROM calls{where} ORDER BY {column} LIMIT 1 OFFSET ?',
+                                         args + [offset]).fetchone()[0]
+                result[f'p{int(q * 100)}'] = value
+        finally:
+            conn.close()
+        return result
+
+
+def find_call_logs(root: str, filename: str = 'call_log.jsonl'):
+    for dirpath, _dirs, files in os.walk(root):
+        if filename in files:
+            yield os.path.join(dirpath, filename)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Session call-log store")
+    parser.add_argument('--db', default=os.environ.get('SESSION_DB', '/workspace/data/sessions.db'))
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    imp = sub.add_parser('import', help='import call_log.jsonl files below a directory')
+    imp.add_argument('root')
+    st = sub.add_parser('stats', help='latency statistics for one stage')
+    st.add_argument('stage', choices=STAGES)
+    st.add_argument('--since')
+    st.add_argument('--until')
+    st.add_argument('--session')
+    args = parser.parse_args()
+
+    store = SessionStore(args.db)
+    if args.cmd == 'import':
+        print(json.dumps(store.import_jsonl(find_call_logs(args.root))))
+    else:
+        print(json.dumps(store.stage_stats(args.stage, session_id=args.session,
+                                           since=parse_time(args.since), until=parse_time(args.until)), indent=2))
@@ -1,16 +1,333 @@
-import json, time
-from typing import Any, Dict, List
+import atexit, contextlib, json, logging, os, signal, sys, threading, time, uuid
+from typing import Any, Dict, List, Optional
+
+# Seconds between background flushes; a request end or shutdown flushes immediately
+FLUSH_INTERVAL = float(os.environ.get('TIMELINE_FLUSH_SEC', 0.25))
+# Pending lines that trigger an early flush
+FLUSH_MAX_PENDING = 512
+# Longest the exit-time flush may hold up process shutdown (slow or hung disk)
+SHUTDOWN_FLUSH_TIMEOUT = float(os.environ.get('TIMELINE_SHUTDOWN_FLUSH_SEC', 2.0))
+
+# Callables (service, span path, dur_ms) run when a span ends; metrics.install registers one
+_span_observers = []
+
+
+def add_span_observer(fn):
+    if fn not in _span_observers:
+        _span_observers.append(fn)
+
+
+# Trace propagation between the orchestrator and the services
+TRACE_HEADER = 'X-Trace-Id'
+PARENT_SPAN_HEADER = 'X-Parent-Span-Id'
+
+
+class TimelineSink:
+    """Buffers timeline lines per file and appends them in batches from a background thread,
+    one open/write/close per file per flush instead of per event."""
+
+    def __init__(self, interval: float = FLUSH_INTERVAL, max_pending: int = FLUSH_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, List[str]] = {}
+        self._count = 0
+        self._cv = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def write(self, path: str, line: str):
+        with self._cv:
+            self._pending.setdefault(path, []).append(line)
+            self._count += 1
+            closed = self._closed
+            if not closed:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name='timeline-sink', daemon=True)
+                    self._thread.start()
+                elif self._count >= self.max_pending:
+                    self._cv.notify()
+        if closed:
+            # Late events after shutdown began are written through
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far before returning."""
+        with self._io_lock:
+            with self._cv:
+                batch, self._pending, self._count = self._pending, {}, 0
+            for path, lines in batch.items():
+                try:
+                    try:
+                        f = open(path, 'a', encoding='utf-8')
+                    except FileNotFoundError:
+                        # The trial directory was moved away (hot trial storage); recreate it
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        f = open(path, 'a', encoding='utf-8')
+                    with f:
+                        f.write(''.join(lines))
+                except OSError as e:
+                    logging.getLogger('timeline').warning(f"Dropped {len(lines)} timeline events for {path}: {e}")
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Stop the background thread and flush what is queued. With `timeout`, give up
+        waiting after that many seconds; returns False if the flush did not finish."""
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        if timeout is None:
+            self.flush()
+            return True
+        t = threading.Thread(target=self.flush, name='timeline-final-flush', daemon=True)
+        t.start()
+        t.join(timeout)
+        if t.is_alive():
+            logging.getLogger('timeline').warning(f"Timeline flush still running after {timeout}s at shutdown; giving up")
+            return False
+        return True
+
+
+_sink = TimelineSink()
+atexit.register(_sink.close, SHUTDOWN_FLUSH_TIMEOUT)
+
+
+def flush_timelines(*_args):
+    """Flush all buffered events; register as a Flask teardown_request handler."""
+    _sink.flush()
+
+
+def _on_sigterm(signum, frame):
+    # Exit through atexit so buffered events land
+    sys.exit(0)
+
+
+def install_signal_flush():
+    """Turn SIGTERM (how supervisord stops services) into a normal exit that flushes buffered
+    timeline events. Call from a service's entry point; a handler already installed is kept."""
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+class Span:
+    """One timed stage. Created by Timeline.begin/span; written to the timeline when it ends."""
+
+    def __init__(self, tl: 'Timeline', name: str, parent: Optional['Span'], payload: Dict[str, Any]):
+        self.tl = tl
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.parent = parent
+        self.path = f"{parent.path}/{name}" if parent else name
+        self.payload = payload
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        self.dur_ms: Optional[float] = None
+        self._stack: Optional[List['Span']] = None
+
+    def end(self, **payload):
+        if self.dur_ms is not None:
+            return
+        self.dur_ms = round((time.perf_counter() - self.start) * 1000.0, 3)
+        self.payload.update(payload)
+        self.tl._close_span(self)
+
 
 class Timeline:
-    def __init__(self, path: str):
+    """Per-request event log. `add` records instants; `span`/`begin` record stages timed on a
+    monotonic clock, nested per thread. Every record carries `t`, seconds since the timeline
+    was created, from the same clock.
+
+    With `trace_id` every record is tagged with the trace and `service`, and top-level spans
+    name `parent_id` (the caller's span, see incoming_trace) as their parent."""
+
+    def __init__(self, path: str, service: str = None, trace_id: str = None, parent_id: str = None):
         self.path = path
+        self.service = service
+        self.trace_id = trace_id
+        self.parent_id = parent_id
         self.buf: List[Dict[str, Any]] = []
+        self.ts0 = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _offset(self, at: float = None) -> float:
+        return round((time.perf_counter() if at is None else at) - self.t0, 6)
+
+    def _emit(self, rec: Dict[str, Any]):
+        if self.trace_id:
+            rec["trace"] = self.trace_id
+            rec["svc"] = self.service
+        with self._lock:
+            self.buf.append(rec)
+        _sink.write(self.path, json.dumps(rec, ensure_ascii=False) + "\n")
 
     def add(self, event: str, **payload):
-        rec = {"ts": time.time(), "event": event, "payload": payload}
-        self.buf.append(rec)
-        with open(self.path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._emit({"ts": time.time(), "t": self._offset(), "event": event, "payload": payload})
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def begin(self, name: str, parent: Optional[Span] = None, **payload) -> Span:
+        """Open a span; nested under the calling thread's innermost open span unless `parent` is given."""
+        stack = self._stack()
+        span = Span(self, name, parent or (stack[-1] if stack else None), payload)
+        span._stack = stack
+        stack.append(span)
+        return span
+
+    def _close_span(self, span: Span):
+        # Spans may end on another thread than they began on (thread pools, to_thread)
+        if span in span._stack:
+            span._stack.remove(span)
+        with self._lock:
+            self.spans.append(span)
+        if self.service:
+            for fn in _span_observers:
+                fn(self.service, span.path, span.dur_ms)
+        self._emit({
+            "ts": span.ts,
+            "t": self._offset(span.start),
+            "event": span.name,
+            "payload": span.payload,
+            "span": {"id": span.id, "parent": span.parent.id if span.parent else self.parent_id,
+                     "path": span.path, "dur_ms": span.dur_ms},
+        })
+
+    @contextlib.contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **payload):
+        sp = self.begin(name, parent, **payload)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.end(error=type(e).__name__)
+            raise
+        sp.end()
+
+    def durations(self) -> Dict[str, float]:
+        """Total milliseconds per span path ('llm', 'llm/generate', ...)."""
+        out: Dict[str, float] = {}
+        with self._lock:
+            for sp in self.spans:
+                out[sp.path] = round(out.get(sp.path, 0.0) + sp.dur_ms, 3)
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact form for responses: stage durations plus instant events as [name, ms offset]."""
+        with self._lock:
+            marks = [[rec['event'], round(rec['t'] * 1000.0, 1)] for rec in self.buf if 'span' not in rec]
+        return {
+            "start_ts": self.ts0,
+            "elapsed_ms": round(self._offset() * 1000.0, 3),
+            "stages_ms": self.durations(),
+            "marks": marks,
+        }
+
+    def trace_headers(self, span: Optional[Span] = None) -> Dict[str, str]:
+        """Headers that make a downstream service's events children of `span` in this trace."""
+        if not self.trace_id:
+            return {}
+        headers = {TRACE_HEADER: self.trace_id}
+        if span is not None:
+            headers[PARENT_SPAN_HEADER] = span.id
+        return headers
+
+    def flush(self):
+        _sink.flush()
 
     def snapshot(self):
         return self.buf
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def incoming_trace(headers) -> Dict[str, Optional[str]]:
+    """Timeline kwargs from request headers: Timeline(path, service, **incoming_trace(request.headers))."""
+    return {'trace_id': headers.get(TRACE_HEADER) or None, 'parent_id': headers.get(PARENT_SPAN_HEADER) or None}
+
+
+def read_timeline(path: str) -> List[Dict[str, Any]]:
+    _sink.flush()
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def build_waterfall(records: List[Dict[str, Any]], trace_id: str = None) -> Dict[str, Any]:
+    """Merge one trace's records from all services into a waterfall.
+
+    Times are wall-clock milliseconds from the first record of the trace (services share a
+    host clock). For every span whose children run in another service, `network` reports the
+    time between the caller starting the call and the callee's first record (`before_ms`), and
+    between the callee's last record and the call returning (`after_ms`): transport,
+    serialization and request parsing that no service timed."""
+    traced = [r for r in records if r.get('trace')]
+    if trace_id is None and traced:
+        trace_id = max(traced, key=lambda r: r['ts'])['trace']
+    recs = [r for r in traced if r['trace'] == trace_id]
+    if not recs:
+        return {'trace_id': trace_id, 'spans': [], 'events': [], 'network': []}
+
+    def end_ts(r):
+        return r['ts'] + r['span']['dur_ms'] / 1000.0 if 'span' in r else r['ts']
+
+    start = min(r['ts'] for r in recs)
+    finish = max(end_ts(r) for r in recs)
+    ms = lambda ts: round((ts - start) * 1000.0, 3)
+    spans, events = [], []
+    for r in sorted(recs, key=lambda r: r['ts']):
+        if 'span' in r:
+            spans.append({'service': r.get('svc'), 'name': r['event'], 'path': r['span'].get('path'),
+                          'id': r['span']['id'], 'parent': r['span'].get('parent'),
+                          'start_ms': ms(r['ts']), 'dur_ms': r['span']['dur_ms'], 'payload': r.get('payload', {})})
+        else:
+            events.append({'service': r.get('svc'), 'event': r['event'], 'at_ms': ms(r['ts'])})
+
+    network = []
+    for caller in spans:
+        callee = [r for r in recs if r.get('svc') != caller['service']
+                  and 'span' in r and r['span'].get('parent') == caller['id']]
+        if not callee:
+            continue
+        svc = callee[0].get('svc')
+        # The callee's window covers all of its records in this trace, not only its top-level spans;
+        # with clock skew or a partly flushed timeline only the child spans themselves may be left
+        own = [r for r in recs if r.get('svc') == svc and caller['start_ms'] <= ms(r['ts'])
+               <= caller['start_ms'] + caller['dur_ms']] or callee
+        first = min(ms(r['ts']) for r in own)
+        last = max(ms(end_ts(r)) for r in own)
+        caller_end = caller['start_ms'] + caller['dur_ms']
+        network.append({
+            'caller': f"{caller['service']}:{caller['path']}",
+            'callee': svc,
+            'call_ms': caller['dur_ms'],
+            'server_ms': round(last - first, 3),
+            'before_ms': round(first - caller['start_ms'], 3),
+            'after_ms': round(caller_end - last, 3),
+        })
+    return {
+        'trace_id': trace_id,
+        'start_ts': start,
+        'total_ms': ms(finish),
+        'spans': spans,
+        'events': events,
+        'network': network,
+    }
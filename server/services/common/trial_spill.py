@@ -0,0 +1,266 @@
+"""
+Moves hot trial directories (data/.hot, see io_paths) to durable storage under data/.
+
+A trial is moved once no file in it has changed for `idle_sec` and no pipeline run holds
+it, or at the latest `max_lag_sec` after its oldest file was written. The move is:
+
+  1. rename the trial directory into data/.hot/.spill/<id>/ (same tmpfs, atomic); later
+     writers recreate an empty hot directory and are moved in a later pass
+  2. copy each file to data/sessions/... (temp + fsync + rename), or append it for
+     .jsonl logs, then delete the hot copy
+  3. remove the staging directory
+
+Before appending, the durable file's size is journaled in the staging directory; a pass
+interrupted by a crash truncates back to it and appends again, so logs are never
+duplicated. Staging directories left by a crash are finished first on the next start.
+Step 2 holds the durable trial's trial_lock (io_paths) so the archiver leaves it alone.
+"""
+
+import contextlib, fcntl, json, logging, os, shutil, threading, time, uuid
+from typing import Dict, Optional, Tuple
+
+from .io_paths import HOT_DIR, forget_trial, trial_lock
+
+_APPEND_SUFFIXES = ('.jsonl',)
+_JOURNAL = '.spill.json'
+# Hidden atomic-write temp files older than this are treated as abandoned
+_STALE_TMP_SEC = 600.0
+
+log = logging.getLogger('trial_spill')
+
+
+def _fsync_dir(path: str):
+    with contextlib.suppress(OSError):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class TrialSpiller:
+    def __init__(self, hot_dir: str = HOT_DIR, durable_dir: str = 'data', idle_sec: float = 10.0,
+                 max_lag_sec: float = 120.0, interval: float = 2.0):
+        self.hot_dir = hot_dir
+        self.durable_dir = durable_dir
+        self.idle_sec = idle_sec
+        self.max_lag_sec = max_lag_sec
+        self.interval = interval
+        self.staging_dir = os.path.join(hot_dir, '.spill')
+        self._held: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.spilled_trials = 0
+        self.spilled_bytes = 0
+        self.last_lag_sec = None
+        self.max_seen_lag_sec = 0.0
+        self.last_error = None
+
+    # --- holds ---
+    @staticmethod
+    def _trial_key(session_id: str, trial_id: int) -> str:
+        return os.path.join('sessions', f'{session_id}_session', f'trial_{trial_id:03d}')
+
+    def hold(self, session_id: str, trial_id: int):
+        """Keep a trial hot while a pipeline run uses it; pair with release()."""
+        key = self._trial_key(session_id, trial_id)
+        with self._lock:
+            self._held[key] = self._held.get(key, 0) + 1
+
+    def release(self, session_id: str, trial_id: int):
+        key = self._trial_key(session_id, trial_id)
+        with self._lock:
+            n = self._held.get(key, 0) - 1
+            if n > 0:
+                self._held[key] = n
+            else:
+                self._held.pop(key, None)
+
+    # --- scanning ---
+    def _hot_trials(self):
+        sessions = os.path.join(self.hot_dir, 'sessions')
+        try:
+            session_dirs = [e for e in os.scandir(sessions) if e.is_dir()]
+        except FileNotFoundError:
+            return
+        for session in session_dirs:
+            with contextlib.suppress(FileNotFoundError):
+                for trial in os.scandir(session.path):
+                    if trial.is_dir() and trial.name.startswith('trial_'):
+                        yield os.path.join('sessions', session.name, trial.name), trial.path
+
+    @staticmethod
+    def _activity(path: str) -> Tuple[Optional[float], Optional[float], bool]:
+        """(oldest mtime, newest mtime, write in progress) over the files of a trial directory."""
+        oldest = newest = None
+        busy = False
+        now = time.time()
+        for dirpath, _dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    mtime = os.stat(os.path.join(dirpath, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+                if name.startswith('.') and '.tmp' in name:
+                    busy = busy or now - mtime < _STALE_TMP_SEC
+                    continue
+                oldest = mtime if oldest is None else min(oldest, mtime)
+                newest = mtime if newest is None else max(newest, mtime)
+        return oldest, newest, busy
+
+    def pending(self) -> int:
+        return sum(1 for _ in self._hot_trials())
+
+    # --- moving ---
+    def run_once(self, force: bool = False) -> int:
+        """One pass: finish interrupted moves, then move idle trials. Returns trials moved."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        lock_fd = os.open(os.path.join(self.hot_dir, '.spill.lock'), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            for name in sorted(os.listdir(self.staging_dir)):
+                self._drain_staged(os.path.join(self.staging_dir, name))
+            moved = 0
+            now = time.time()
+            for key, path in list(self._hot_trials()):
+                with self._lock:
+                    held = key in self._held
+                oldest, newest, busy = self._activity(path)
+                if held or busy:
+                    continue
+                if newest is None:
+                    # Empty directory (recreated by a late writer or just created); drop it once idle
+                    with contextlib.suppress(OSError):
+                        if now - os.stat(path).st_mtime >= self.idle_sec:
+                            os.rmdir(path)
+                    continue
+                if not force and now - newest < self.idle_sec and now - oldest < self.max_lag_sec:
+                    continue
+                staged = os.path.join(self.staging_dir, uuid.uuid4().hex[:12])
+                os.makedirs(os.path.dirname(os.path.join(staged, key)), exist_ok=True)
+                os.rename(path, os.path.join(staged, key))
+                self._forget(key)
+                self._drain_staged(staged)
+                moved += 1
+                self.last_lag_sec = round(time.time() - oldest, 3)
+                self.max_seen_lag_sec = max(self.max_seen_lag_sec, self.last_lag_sec)
+            return moved
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    @staticmethod
+    def _forget(key: str):
+        _, session, trial = key.split(os.sep)
+        with contextlib.suppress(ValueError):
+            forget_trial(session[: -len('_session')], int(trial[len('trial_'):]))
+
+    def _drain_staged(self, staged: str):
+        # Shared trial locks keep the archiver off the durable directories being written
+        with contextlib.ExitStack() as locks:
+            for key in self._staged_trials(staged):
+                locks.enter_context(trial_lock(os.path.join(self.durable_dir, key)))
+            self._copy_staged(staged)
+
+    @staticmethod
+    def _staged_trials(staged: str):
+        sessions = os.path.join(staged, 'sessions')
+        with contextlib.suppress(FileNotFoundError):
+            for session in sorted(os.listdir(sessions)):
+                with contextlib.suppress(NotADirectoryError):
+                    for trial in sorted(os.listdir(os.path.join(sessions, session))):
+                        yield os.path.join('sessions', session, trial)
+
+    def _copy_staged(self, staged: str):
+        journal_path = os.path.join(staged, _JOURNAL)
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            journal = {}
+        for dirpath, _dirs, files in os.walk(staged):
+            for name in sorted(files):
+                src = os.path.join(dirpath, name)
+                if src == journal_path or (name.startswith('.') and '.tmp' in name):
+                    continue
+                rel = os.path.relpath(src, staged)
+                dest = os.path.join(self.durable_dir, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                if name.endswith(_APPEND_SUFFIXES):
+                    self._append(src, dest, rel, journal, journal_path)
+                else:
+                    self.spilled_bytes += self._copy(src, dest)
+                os.unlink(src)
+        shutil.rmtree(staged, ignore_errors=True)
+        self.spilled_trials += 1
+
+    @staticmethod
+    def _copy(src: str, dest: str) -> int:
+        tmp = os.path.join(os.path.dirname(dest), f'.{os.path.basename(dest)}.{uuid.uuid4().hex[:8]}.tmp')
+        shutil.copyfile(src, tmp)
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+        _fsync_dir(os.path.dirname(dest))
+        return os.path.getsize(dest)
+
+    def _append(self, src: str, dest: str, rel: str, journal: dict, journal_path: str):
+        if rel in journal:
+            # A previous attempt may have appended part of src already
+            with contextlib.suppress(FileNotFoundError):
+                if os.path.getsize(dest) > journal[rel]:
+                    os.truncate(dest, journal[rel])
+        else:
+            journal[rel] = os.path.getsize(dest) if os.path.exists(dest) else 0
+            tmp = journal_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(journal, f)
+            os.replace(tmp, journal_path)
+        with open(src, 'rb') as fin, open(dest, 'ab') as fout:
+            shutil.copyfileobj(fin, fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+            self.spilled_bytes += fout.tell() - journal[rel]
+
+    # --- background thread ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='trial-spill', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                log.warning(f"Trial spill pass failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            held = len(self._held)
+        return {
+            'hot_dir': self.hot_dir,
+            'pending_trials': self.pending(),
+            'held_trials': held,
+            'spilled_trials': self.spilled_trials,
+            'spilled_bytes': self.spilled_bytes,
+            'last_lag_sec': self.last_lag_sec,
+            'max_lag_sec': self.max_seen_lag_sec,
+            'last_error': self.last_error,
+        }
+
+
+def spiller_from_config(storage: dict) -> Optional[TrialSpiller]:
+    """The spiller for the `storage` config section, or None when hot trials are off."""
+    if not storage.get('hot_trials'):
+        return None
+    return TrialSpiller(idle_sec=float(storage.get('idle_sec', 10.0)),
+                        max_lag_sec=float(storage.get('max_lag_sec', 120.0)),
+                        interval=float(storage.get('spill_interval_sec', 2.0)))
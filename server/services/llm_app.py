@@ -1,14 +1,23 @@
 from flask import Flask, request, jsonify
-import os, json, yaml, time
-from common.io_paths import ensure_trial_paths
-from common.timeline import Timeline
-from common.logging_conf import setup_logging
+import os, re, json, yaml, time
+from common.io_paths import atomic_write, ensure_trial_paths, resolve_data_path, trial_dirs
+from common.timeline import Timeline, flush_timelines, incoming_trace, install_signal_flush
+from common.logging_conf import bind_context, clear_context, setup_logging
+from common.ollama_pool import OllamaPool, normalize_host
+from common.prompt_budget import TokenEstimator, build_prompt
+from common.sentences import sentence_cut
+from common.metrics import QUEUE_DEPTH, STAGE_LATENCY, install as install_metrics
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 CFG_PATH = "config/app.yml"
 cfg = yaml.safe_load(open(CFG_PATH, "r", encoding="utf-8"))
 
 app = Flask(__name__)
+# Timeline events are buffered; make sure a request's events are on disk when it ends
+app.teardown_request(flush_timelines)
+app.teardown_request(clear_context)
+install_metrics(app, 'llm')
 log = setup_logging("llm")
 
 WORKSPACE_ROOT = os.environ.get('WORKSPACE', '/workspace')
@@ -31,7 +40,8 @@ def _resolve_user_context(raw_value, paths):
         _add_candidate(value)
     else:
         _add_candidate(value)
-        _add_candidate(os.path.join(paths['trial_dir'], value))
+        for trial_dir in trial_dirs(paths):
+            _add_candidate(os.path.join(trial_dir, value))
         _add_candidate(os.path.join(paths['meta_dir'], value))
         _add_candidate(os.path.join(paths['base'], value))
         _add_candidate(os.path.join('data', value))
@@ -58,10 +68,10 @@ def _resolve_user_context(raw_value, paths):
 
 # --- Ollama client (preload model once) ---
 # Normalize host: ensure scheme present
-_raw_host = os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')
-if not (_raw_host.startswith('http://') or _raw_host.startswith('https://')):
-    _raw_host = 'http://' + _raw_host
-OLLAMA_HOST = _raw_host
+OLLAMA_HOST = normalize_host(os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434'))
+# Optional pool of hosts: OLLAMA_HOSTS (comma-separated) or llm.ollama_hosts; defaults to OLLAMA_HOST
+_env_hosts = [h for h in os.environ.get('OLLAMA_HOSTS', '').split(',') if h.strip()]
+OLLAMA_HOSTS = _env_hosts or cfg.get('llm', {}).get('ollama_hosts') or [OLLAMA_HOST]
 # Prefer explicit user request model, fallback to config, then a sane default
 MODEL_NAME = os.environ.get('OLLAMA_MODEL') or cfg.get('llm', {}).get('model_name') or 'llama3.1:8b-instruct-q8_0'
 
@@ -84,33 +94,112 @@ THINK_ENABLED = _as_bool(
     default=False,
 )
 
+_llm_cfg = cfg.get('llm', {})
+_pool = OllamaPool(
+    OLLAMA_HOSTS,
+    eject_after=_llm_cfg.get('eject_after_failures', 3),
+    eject_seconds=_llm_cfg.get('eject_seconds', 30),
+    hedge=_as_bool(os.environ.get('OLLAMA_HEDGE', _llm_cfg.get('hedge_requests', False))),
+    hedge_quantile=_llm_cfg.get('hedge_quantile', 0.95),
+)
 _http = requests.Session()
+# Generations in flight across all Ollama hosts
+QUEUE_DEPTH.set_function(lambda: sum(ep['outstanding'] for ep in _pool.stats()), service='llm', queue='ollama')
 
-def _ollama_generate(prompt: str, keep_alive: str = '24h', timeout: float = 120.0) -> str:
-    try:
-        url = f"{OLLAMA_HOST.rstrip('/')}/api/generate"
-        data = {
-            'model': MODEL_NAME,
-            'prompt': prompt,
-            'stream': False,
-            'keep_alive': keep_alive,
-            'think': THINK_ENABLED,
-        }
-        resp = _http.post(url, json=data, timeout=timeout)
+# Per-condition generation budget (llm.generation in app.yml). Keys are 'default' or a condition number.
+_GEN_CFG = _llm_cfg.get('generation', {}) or {}
+
+def _generation_budget(cond_num) -> dict:
+    budget = dict(_GEN_CFG.get('default') or {})
+    for key in (cond_num, str(cond_num)):
+        override = _GEN_CFG.get(key)
+        if isinstance(override, dict):
+            budget.update(override)
+            break
+    return budget
+
+
+def _record_usage(stats, chunk: dict):
+    if stats is None:
+        return
+    for key in ('prompt_eval_count', 'eval_count'):
+        if key in chunk:
+            stats[key] = chunk[key]
+
+
+def _generate_on(base_url: str, data: dict, timeout: float, max_sentences: int = 0, stats: dict = None) -> str:
+    if not data.get('stream'):
+        resp = _http.post(f"{base_url}/api/generate", json=data, timeout=timeout)
         resp.raise_for_status()
-        j = resp.json()
         # Ollama returns {'response': '...'}
+        j = resp.json()
+        _record_usage(stats, j)
         return j.get('response', '').strip()
+
+    # Streaming: stop reading (and let Ollama cancel) once enough sentences arrived
+    text = ''
+    scan, count = 0, 0
+    resp = _http.post(f"{base_url}/api/generate", json=data, timeout=timeout, stream=True)
+    try:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            text += chunk.get('response', '')
+            if max_sentences:
+                cut, scan, count = sentence_cut(text, max_sentences, scan, count)
+                if cut is not None:
+                    # Closing the stream stops Ollama decoding; prompt_eval_count only comes in
+                    # the final chunk, so the estimator learns from uncapped replies
+                    return text[:cut].strip()
+            if chunk.get('done'):
+                _record_usage(stats, chunk)
+                break
+    finally:
+        resp.close()
+    return text.strip()
+
+def _generate_request(prompt: str, keep_alive: str = '24h', budget: dict = None):
+    """Build the Ollama /api/generate body for a prompt; returns (data, max_sentences)."""
+    budget = budget or {}
+    max_sentences = int(budget.get('max_sentences') or 0)
+    data = {
+        'model': MODEL_NAME,
+        'prompt': prompt,
+        'stream': bool(max_sentences),
+        'keep_alive': keep_alive,
+        'think': THINK_ENABLED,
+    }
+    options = {}
+    if budget.get('num_predict'):
+        options['num_predict'] = int(budget['num_predict'])
+    if budget.get('stop'):
+        options['stop'] = list(budget['stop'])
+    if options:
+        data['options'] = options
+    return data, max_sentences
+
+def _ollama_generate(prompt: str, keep_alive: str = '24h', timeout: float = 120.0, budget: dict = None,
+                     stats: dict = None) -> str:
+    data, max_sentences = _generate_request(prompt, keep_alive, budget)
+    try:
+        with STAGE_LATENCY.time(service='llm', stage='ollama_call'):
+            return _pool.call(lambda base_url: _generate_on(base_url, data, timeout, max_sentences, stats))
     except Exception as e:
         log.warning(f"Ollama call failed: {e}", exc_info=False)
         return ''
 
 def _warmup_model():
-    # Trigger a lightweight load to avoid first-call latency
-    test_prompt = "You are loaded."
-    _ = _ollama_generate(test_prompt, keep_alive='24h', timeout=10.0)
+    # Trigger a lightweight load on every host to avoid first-call latency
+    data = {'model': MODEL_NAME, 'prompt': "You are loaded.", 'stream': False, 'keep_alive': '24h', 'think': THINK_ENABLED}
+    for base_url in _pool.urls:
+        try:
+            _generate_on(base_url, data, timeout=10.0)
+        except Exception as e:
+            log.warning(f"Ollama warmup failed at {base_url}: {e}")
     log.info(
-        f"Ollama warmup attempted for model '{MODEL_NAME}' at {OLLAMA_HOST} (think={THINK_ENABLED})"
+        f"Ollama warmup attempted for model '{MODEL_NAME}' at {', '.join(_pool.urls)} (think={THINK_ENABLED})"
     )
 
 # Warm up on import
@@ -120,33 +209,18 @@ except Exception as _:
     # Non-fatal; service continues and will try again during requests
     pass
 
-@app.post('/api/v1/llm')
-def llm():
-    payload = request.get_json()
-    session_id = payload['session_id']
-    trial_id = int(payload['trial_id'])
-    prompt_path = payload['prompt_path']
-    condition = str(payload.get('condition', '')).strip()  # Optional, 1 - repeat, 2 - enhance, 3 - oppose
-    cond_num = None
+def _parse_condition(value):
+    """Return 1/2/3/-1 for a recognized condition (1 - repeat, 2 - enhance, 3 - oppose), else None."""
     try:
-        parsed = int(condition)
+        parsed = int(str(value).strip())
         if parsed in (1, 2, 3, -1):
-            cond_num = parsed
+            return parsed
     except Exception:
-        cond_num = None
-    user_context_raw = payload.get('user_context', '')
-    if not prompt_path.startswith('data/'):
-        prompt_path = os.path.join('data', prompt_path)
-
-    paths = ensure_trial_paths(session_id, trial_id)
-    # Output file name as requested
-    out_path = os.path.join(paths['trial_dir'], 'user_2B_llm.txt')
-    print(out_path)
+        pass
+    return None
 
-    tl = Timeline(paths['timeline_path'])
-    tl.add('llm_start', user_context=bool(str(user_context_raw).strip()))
 
-    # Build prompt: template (prompt_llm.txt) + scene + ASR text
+def _resolve_prompt_root():
     prompt_root = cfg.get('paths', {}).get('prompt_root')
     # Fallback to local path if configured root doesn't exist
     if not prompt_root or not os.path.isdir(prompt_root):
@@ -158,26 +232,29 @@ def llm():
             # As a last resort, try relative to this file location
             here = os.path.dirname(os.path.dirname(__file__))  # services/
             prompt_root = os.path.join(here, 'material', 'prompts')
+    return prompt_root
 
-    tmpl = ''
-    prompt_tmpl_path = None
+
+def _load_template(prompt_root, cond_num) -> str:
     if cond_num == -1:
         log.info("Condition -1 received: skipping prompt template load")
-    else:
-        prompt_tmpl_path = os.path.join(prompt_root, 'prompt_llm.txt')
-        if cond_num in (1, 2, 3):
-            prompt_tmpl_name = f'prompt_llm_cond{cond_num}.txt'
-            prompt_tmpl_path_candidate = os.path.join(prompt_root, prompt_tmpl_name)
-            if os.path.isfile(prompt_tmpl_path_candidate):
-                prompt_tmpl_path = prompt_tmpl_path_candidate
-        try:
-            with open(prompt_tmpl_path, 'r', encoding='utf-8') as f:
-                tmpl = f.read().strip()
-        except Exception as e:
-            tmpl = ''
-            log.warning(f"Prompt template not found or unreadable at {prompt_tmpl_path}: {e}")
+        return ''
+    prompt_tmpl_path = os.path.join(prompt_root, 'prompt_llm.txt')
+    if cond_num in (1, 2, 3):
+        prompt_tmpl_name = f'prompt_llm_cond{cond_num}.txt'
+        prompt_tmpl_path_candidate = os.path.join(prompt_root, prompt_tmpl_name)
+        if os.path.isfile(prompt_tmpl_path_candidate):
+            prompt_tmpl_path = prompt_tmpl_path_candidate
+    try:
+        with open(prompt_tmpl_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except Exception as e:
+        log.warning(f"Prompt template not found or unreadable at {prompt_tmpl_path}: {e}")
+        return ''
+
 
-    # Resolve user-provided context first; fallback to the on-disk scene file
+def _load_scene(user_context_raw, paths):
+    """Resolve user-provided context first; fallback to the on-disk scene file. Returns (text, source)."""
     scene_text = ''
     context_source = ''
     if user_context_raw:
@@ -187,7 +264,9 @@ def llm():
         if not scene_text:
             log.warning("User context provided but empty after processing. Falling back to scene.txt")
     if not scene_text:
-        scene_path = os.path.join(paths['trial_dir'], 'scene.txt')
+        # The trial may already have been moved off hot storage between two requests
+        scene_path = next((p for p in (os.path.join(d, 'scene.txt') for d in trial_dirs(paths)) if os.path.isfile(p)),
+                          os.path.join(paths['trial_dir'], 'scene.txt'))
         try:
             with open(scene_path, 'r', encoding='utf-8') as f:
                 scene_text = f.read().strip()
@@ -196,27 +275,21 @@ def llm():
             scene_text = ''
             context_source = ''
             log.warning(f"Scene not found or unreadable at {scene_path}: {e}")
+    return scene_text, context_source
+
 
+def _load_asr(prompt_path) -> str:
     try:
         with open(prompt_path, 'r', encoding='utf-8') as f:
-            asr_text = f.read().strip()
+            return f.read().strip()
     except Exception as e:
-        asr_text = ''
         log.warning(f"ASR prompt not found or unreadable at {prompt_path}: {e}")
+        return ''
 
-    # Build: template + scene + ASR text
-    tl.add('llm_context', context_source=context_source or ('scene_file' if scene_text else 'none'))
-
-    combined_prompt = "\n\n".join(part for part in [tmpl, scene_text, asr_text] if part).strip()
-
-    # Call Ollama; fallback to echoing prompt if unavailable
-    reply = _ollama_generate(combined_prompt)
-    if not reply:
-        reply = combined_prompt if combined_prompt else 'No prompt content available.'
 
+def _clean_reply(reply: str) -> str:
     # Final cleanup for output format consistency
     try:
-        import re
         cleaned = (reply or '').strip()
         cleaned = re.sub(r'\*+', '', cleaned)
         cleaned = re.sub(r'(?i)\bargument\b[:\s-]*', '', cleaned)
@@ -227,27 +300,174 @@ def llm():
         cleaned = re.sub(r'\s+', ' ', cleaned).strip()
         if cleaned:
             reply = cleaned
-
     except Exception:
         # fast-fail: keep original reply
         pass
+    return reply
+
 
+# Fan-out mode, opt-in: put the shared scene + ASR text ahead of the condition template so
+# Ollama can reuse the cached prefix across conditions. The first condition then runs alone
+# to fill the cache before the others start. Single-condition calls keep the template-first
+# layout, so with this on a condition's prompt depends on how it was requested.
+FANOUT_SHARED_PREFIX_FIRST = _as_bool(_llm_cfg.get('fanout_shared_prefix_first', False))
+FANOUT_MAX_WORKERS = int(_llm_cfg.get('fanout_max_workers', 3))
 
-    with open(out_path, 'w', encoding='utf-8') as f:
-        f.write(reply)
+
+# Prompt token budget (0 = unlimited). Scene/context is trimmed first, then ASR text.
+PROMPT_BUDGET_TOKENS = int(os.environ.get('LLM_PROMPT_BUDGET', _llm_cfg.get('prompt_budget_tokens', 0)) or 0)
+_token_estimator = TokenEstimator(chars_per_token=float(_llm_cfg.get('chars_per_token', 3.5)),
+                                  min_samples=int(_llm_cfg.get('chars_per_token_min_samples', 5)))
+
+
+def _prepare_prompt(tmpl: str, scene_text: str, asr_text: str, shared_first: bool = False):
+    combined_prompt, prompt_info = build_prompt(
+        _token_estimator, tmpl, scene_text, asr_text, budget=PROMPT_BUDGET_TOKENS, shared_first=shared_first,
+    )
+    if prompt_info['truncated']:
+        log.info(f"Prompt trimmed to budget {PROMPT_BUDGET_TOKENS} tokens: {prompt_info['truncated']}")
+    return combined_prompt, prompt_info
+
+
+def _finish_reply(combined_prompt: str, prompt_info: dict, reply: str, usage: dict, cond_num,
+                  tl: Timeline = None) -> str:
+    _token_estimator.observe(combined_prompt, usage.get('prompt_eval_count'))
+    if tl is not None:
+        tl.add('llm_prompt', condition=cond_num, prompt_tokens=usage.get('prompt_eval_count'),
+               completion_tokens=usage.get('eval_count'), **prompt_info)
+    # Fallback to echoing prompt if Ollama was unavailable
+    if not reply:
+        reply = combined_prompt if combined_prompt else 'No prompt content available.'
+    return _clean_reply(reply)
+
+
+def _generate_reply(tmpl: str, scene_text: str, asr_text: str, cond_num, shared_first: bool = False,
+                    tl: Timeline = None, parent=None) -> str:
+    combined_prompt, prompt_info = _prepare_prompt(tmpl, scene_text, asr_text, shared_first)
+    usage = {}
+    span = tl.begin(f'generate_cond{cond_num}', parent) if tl is not None else None
+    reply = _ollama_generate(combined_prompt, budget=_generation_budget(cond_num), stats=usage)
+    if span is not None:
+        span.end(completion_tokens=usage.get('eval_count'))
+    return _finish_reply(combined_prompt, prompt_info, reply, usage, cond_num, tl)
+
+
+def _prepare_request(payload: dict, trace: dict = None) -> dict:
+    """Parse an /api/v1/llm payload and load everything the prompt needs.
+
+    Shared by the Flask app and the async app (llm_asgi.py). `trace` is incoming_trace() of the
+    request headers. Raises ValueError for a bad request.
+    """
+    session_id = payload['session_id']
+    trial_id = int(payload['trial_id'])
+    prompt_path = payload['prompt_path']
+    cond_num = _parse_condition(payload.get('condition', ''))  # Optional, 1 - repeat, 2 - enhance, 3 - oppose
+    # Optional fan-out: list of conditions answered from one shared context, e.g. [1, 2, 3]
+    raw_conditions = payload.get('conditions')
+    if isinstance(raw_conditions, str):
+        raw_conditions = [c for c in raw_conditions.split(',') if c.strip()]
+    fanout = None
+    if raw_conditions:
+        fanout = [c for c in dict.fromkeys(_parse_condition(c) for c in raw_conditions) if c is not None]
+        if not fanout:
+            raise ValueError(f"no valid conditions in {raw_conditions!r}")
+    user_context_raw = payload.get('user_context', '')
+    if not prompt_path.startswith('data/'):
+        prompt_path = resolve_data_path(prompt_path)
+
+    paths = ensure_trial_paths(session_id, trial_id)
+    # Output file name as requested
+    out_path = os.path.join(paths['trial_dir'], 'user_2B_llm.txt')
+
+    tl = Timeline(paths['timeline_path'], 'llm', **(trace or {}))
+    bind_context(session=session_id, trial=trial_id, trace=tl.trace_id)
+    tl.add('llm_start', user_context=bool(str(user_context_raw).strip()), conditions=fanout)
+
+    # Build prompt: template (prompt_llm.txt) + scene + ASR text
+    prompt_root = _resolve_prompt_root()
+    scene_text, context_source = _load_scene(user_context_raw, paths)
+    asr_text = _load_asr(prompt_path)
+    tl.add('llm_context', context_source=context_source or ('scene_file' if scene_text else 'none'))
+
+    conditions = fanout or [cond_num]
+    return {
+        'paths': paths,
+        'out_path': out_path,
+        'tl': tl,
+        'fanout': fanout,
+        'conditions': conditions,
+        'templates': {c: _load_template(prompt_root, c) for c in conditions},
+        'scene_text': scene_text,
+        'asr_text': asr_text,
+        'shared_first': FANOUT_SHARED_PREFIX_FIRST if fanout else False,
+        'span': tl.begin('llm', conditions=len(conditions)),
+    }
+
+
+def _write_replies(ctx: dict, replies: dict) -> dict:
+    """Persist replies and build the response body."""
+    tl = ctx['tl']
+    if ctx['fanout']:
+        results = {}
+        for c, reply in replies.items():
+            cond_path = os.path.join(ctx['paths']['trial_dir'], f'user_2B_llm_cond{c}.txt')
+            atomic_write(cond_path, reply)
+            results[str(c)] = {
+                'llm_text_path': os.path.relpath(cond_path, start='data'),
+                'llm_text': reply,
+            }
+        tl.add('llm_end', conditions=ctx['fanout'])
+        ctx['span'].end()
+        return {
+            'results': results,
+            'timeline': tl.summary()
+        }
+
+    reply = replies[ctx['conditions'][0]]
+    atomic_write(ctx['out_path'], reply)
 
     tl.add('llm_end')
+    ctx['span'].end()
 
-    return jsonify({
-        'llm_text_path': os.path.relpath(out_path, start='data'),
+    return {
+        'llm_text_path': os.path.relpath(ctx['out_path'], start='data'),
         'llm_text': reply,
-        'timeline': tl.snapshot()
-    })
+        'timeline': tl.summary()
+    }
+
+
+@app.post('/api/v1/llm')
+def llm():
+    payload = request.get_json()
+    try:
+        ctx = _prepare_request(payload, incoming_trace(request.headers))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conditions = ctx['conditions']
+
+    def args(c):
+        return ctx['templates'][c], ctx['scene_text'], ctx['asr_text'], c, ctx['shared_first'], ctx['tl'], ctx['span']
+
+    replies = {}
+    if ctx['shared_first']:
+        # Prefill the shared prefix once so the remaining conditions hit Ollama's cache
+        replies[conditions[0]] = _generate_reply(*args(conditions[0]))
+    rest = [c for c in conditions if c not in replies]
+    if len(rest) > 1:
+        with ThreadPoolExecutor(max_workers=max(1, min(FANOUT_MAX_WORKERS, len(rest)))) as ex:
+            futures = {c: ex.submit(_generate_reply, *args(c)) for c in rest}
+            replies.update({c: fut.result() for c, fut in futures.items()})
+    else:
+        replies.update({c: _generate_reply(*args(c)) for c in rest})
+
+    return jsonify(_write_replies(ctx, replies))
 
 @app.get('/healthz')
 def healthz():
-    return jsonify({"service":"llm","ts":time.time()})
+    return jsonify({"service":"llm","ts":time.time(),"ollama":_pool.stats()})
 
 if __name__ == '__main__':
+    install_signal_flush()
     port = cfg.get("http", {}).get("llm_port", 7002)
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,172 @@
+"""
+Async (ASGI) serving mode for the LLM service.
+
+Same API as llm_app.py, but requests are served by an event loop and the Ollama
+call is a non-blocking HTTP request, so hundreds of generations can wait on
+Ollama at once without holding a thread each. Prompt assembly, budgets and the
+host pool are shared with llm_app.
+
+Run instead of llm_app.py (same port):
+    python3 services/llm_asgi.py
+"""
+
+import asyncio, json, os, time
+import httpx
+from quart import Quart, Response, g, request, jsonify
+
+import llm_app as core
+from common.logging_conf import bind_context
+from common.sentences import sentence_cut
+from common.timeline import flush_timelines, incoming_trace
+from common import metrics
+
+log = core.log
+app = Quart(__name__)
+app.teardown_request(flush_timelines)
+
+# Upper bound on generations in flight from this process (Ollama queues the rest itself)
+MAX_INFLIGHT = int(core._llm_cfg.get('async_max_inflight', 256))
+_inflight: asyncio.Semaphore = None
+_client: httpx.AsyncClient = None
+
+
+@app.before_serving
+async def _startup():
+    global _client, _inflight
+    _inflight = asyncio.Semaphore(MAX_INFLIGHT)
+    _client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=MAX_INFLIGHT, max_keepalive_connections=64),
+        timeout=None,
+    )
+    log.info(f"Async LLM service ready (max_inflight={MAX_INFLIGHT}, hosts={', '.join(core._pool.urls)})")
+
+
+@app.after_serving
+async def _shutdown():
+    if _client is not None:
+        await _client.aclose()
+
+
+async def _agenerate_on(base_url: str, data: dict, timeout: float, max_sentences: int = 0, stats: dict = None) -> str:
+    url = f"{base_url}/api/generate"
+    if not data.get('stream'):
+        resp = await _client.post(url, json=data, timeout=timeout)
+        resp.raise_for_status()
+        j = resp.json()
+        core._record_usage(stats, j)
+        return j.get('response', '').strip()
+
+    # Streaming: closing the response makes Ollama stop decoding
+    text = ''
+    scan, count = 0, 0
+    resp = await _client.send(_client.build_request('POST', url, json=data, timeout=timeout), stream=True)
+    try:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            text += chunk.get('response', '')
+            if max_sentences:
+                cut, scan, count = sentence_cut(text, max_sentences, scan, count)
+                if cut is not None:
+                    return text[:cut].strip()
+            if chunk.get('done'):
+                core._record_usage(stats, chunk)
+                break
+    finally:
+        await resp.aclose()
+    return text.strip()
+
+
+async def _aollama_generate(prompt: str, timeout: float = 120.0, budget: dict = None, stats: dict = None) -> str:
+    data, max_sentences = core._generate_request(prompt, budget=budget)
+    try:
+        async with _inflight:
+            with metrics.STAGE_LATENCY.time(service='llm', stage='ollama_call'):
+                return await core._pool.acall(lambda base_url: _agenerate_on(base_url, data, timeout, max_sentences, stats))
+    except Exception as e:
+        log.warning(f"Ollama call failed: {e}", exc_info=False)
+        return ''
+
+
+async def _agenerate_reply(tmpl: str, scene_text: str, asr_text: str, cond_num, shared_first: bool = False,
+                           tl=None, parent=None) -> str:
+    combined_prompt, prompt_info = core._prepare_prompt(tmpl, scene_text, asr_text, shared_first)
+    usage = {}
+    span = tl.begin(f'generate_cond{cond_num}', parent) if tl is not None else None
+    reply = await _aollama_generate(combined_prompt, budget=core._generation_budget(cond_num), stats=usage)
+    if span is not None:
+        span.end(completion_tokens=usage.get('eval_count'))
+    return core._finish_reply(combined_prompt, prompt_info, reply, usage, cond_num, tl)
+
+
+@app.post('/api/v1/llm')
+async def llm():
+    payload = await request.get_json()
+    trace = incoming_trace(request.headers)
+    # Each request runs in its own task, so the log context needs no reset
+    if isinstance(payload, dict):
+        bind_context(session=payload.get('session_id'), trial=payload.get('trial_id'), trace=trace['trace_id'])
+    try:
+        # File reads for template/scene/ASR are small but blocking; keep them off the loop
+        ctx = await asyncio.to_thread(core._prepare_request, payload, trace)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conditions = ctx['conditions']
+
+    def reply(c):
+        return _agenerate_reply(ctx['templates'][c], ctx['scene_text'], ctx['asr_text'], c, ctx['shared_first'],
+                                ctx['tl'], ctx['span'])
+
+    replies = {}
+    if ctx['shared_first']:
+        # Same as llm_app: the first condition fills Ollama's prefix cache for the rest
+        replies[conditions[0]] = await reply(conditions[0])
+    rest = [c for c in conditions if c not in replies]
+    replies.update(zip(rest, await asyncio.gather(*[reply(c) for c in rest])))
+    body = await asyncio.to_thread(core._write_replies, ctx, {c: replies[c] for c in conditions})
+    return jsonify(body)
+
+
+@app.before_request
+async def _metrics_start():
+    g.metrics_start = time.perf_counter()
+    metrics.IN_FLIGHT.inc(service='llm')
+
+
+@app.after_request
+async def _metrics_count(response):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.REQUESTS.inc(service='llm', endpoint=endpoint, method=request.method, status=str(response.status_code))
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_start, service='llm', endpoint=endpoint)
+    return response
+
+
+@app.teardown_request
+async def _metrics_done(exc):
+    metrics.IN_FLIGHT.dec(service='llm')
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.REGISTRY.snapshot())
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.get('/healthz')
+async def healthz():
+    return jsonify({"service": "llm", "mode": "async", "ts": time.time(), "ollama": core._pool.stats()})
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    port = core.cfg.get("http", {}).get("llm_port", 7002)
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    config.keep_alive_timeout = float(os.environ.get('LLM_KEEP_ALIVE', 75))
+    asyncio.run(serve(app, config))
@@ -3,12 +3,14 @@ Orchestra App - Main orchestrator for STT -> LLM -> TTS pipeline
 This service coordinates the full audio processing pipeline for Unity client.
 """
 
+import contextlib
 import os
 import sys
 import requests
 import json
 import time
-from flask import Flask, request, jsonify, send_file
+import threading
+from flask import Flask, g, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 import logging
 
@@ -17,12 +19,22 @@ workspace_path = '/workspace'
 if workspace_path not in sys.path:
     sys.path.insert(0, workspace_path)
 
-from services.common.logging_conf import setup_logging
-from services.common.io_paths import ensure_trial_paths
-from services.common.timeline import Timeline
+from services.common.logging_conf import bind_context, clear_context, setup_logging
+from services.common.io_paths import (STORAGE, atomic_output, ensure_trial_paths, record_artifact, resolve_data_path,
+                                      trial_dirs, trial_has, trial_locations, trial_lock, trial_manifest, trial_paths)
+from services.common.metrics import STAGE_LATENCY, install as install_metrics
+from services.common.session_store import STAGES, SessionStore, parse_time
+from services.common.timeline import (Timeline, build_waterfall, flush_timelines, install_signal_flush,
+                                      new_trace_id, read_timeline)
+from services.common.trial_spill import spiller_from_config
+from services.common.archive import archived_response, archiver_from_config, read_archived
 
 # Initialize Flask app
 app = Flask(__name__)
+# Timeline events are buffered; make sure a request's events are on disk when it ends
+app.teardown_request(flush_timelines)
+app.teardown_request(clear_context)
+install_metrics(app, 'orchestra')
 
 # Setup logging - remove the level parameter
 log = setup_logging("orchestra")
@@ -46,6 +58,50 @@ DEFAULT_REF_CANDIDATES = [
 ]
 
 CALL_LOG_FILENAME = 'call_log.jsonl'
+# Indexed copy of every call record (see services/common/session_store.py)
+SESSION_DB_PATH = os.environ.get('SESSION_DB', '/workspace/data/sessions.db')
+try:
+    _session_store = SessionStore(SESSION_DB_PATH)
+except Exception as e:
+    _session_store = None
+    log.warning("Session store unavailable at %s: %s", SESSION_DB_PATH, e)
+REF_AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg')
+
+# Hot trial storage (storage.hot_trials): this service moves idle trials from tmpfs to data/sessions
+try:
+    _spiller = spiller_from_config(STORAGE)
+    if _spiller is not None:
+        _spiller.start()
+except Exception as e:
+    _spiller = None
+    log.warning("Trial spill worker unavailable: %s", e)
+
+
+# Archival of old trials (storage.archive)
+try:
+    _archiver = archiver_from_config(STORAGE)
+    if _archiver is not None:
+        _archiver.start()
+except Exception as e:
+    _archiver = None
+    log.warning("Archive worker unavailable: %s", e)
+
+
+def _hold_trial(session_id: str, trial_id: int):
+    """Keep the trial on hot storage, and away from the archiver, until this request ends."""
+    held = contextlib.ExitStack()
+    held.enter_context(trial_lock(trial_paths(session_id, trial_id, durable=True)['trial_dir']))
+    if _spiller is not None:
+        _spiller.hold(session_id, trial_id)
+        held.callback(_spiller.release, session_id, trial_id)
+    g.held_trial = held
+
+
+@app.teardown_request
+def _release_trial(_exc=None):
+    held = g.pop('held_trial', None)
+    if held is not None:
+        held.close()
 
 
 def _resolve_audio_path(path_value, paths=None):
@@ -60,7 +116,7 @@ def _resolve_audio_path(path_value, paths=None):
     else:
         candidates.append(path_value)
         if paths:
-            candidates.append(os.path.join(paths['trial_dir'], path_value))
+            candidates.extend(os.path.join(d, path_value) for d in trial_dirs(paths))
             candidates.append(os.path.join(paths['base'], path_value))
         if not path_value.startswith('data' + os.sep):
             candidates.append(os.path.join('data', path_value))
@@ -141,7 +197,12 @@ def _determine_voice_and_ref(raw_voice_id, raw_ref_path, session_ref_path, paths
 
 
 def _append_call_log(paths: dict, record: dict):
-    """Append a structured call log line to the trial directory."""
+    """Append a structured call log line to the trial directory and queue it for the session store."""
+    if _session_store is not None:
+        try:
+            _session_store.record(record)
+        except Exception as e:
+            log.warning("Failed to queue call record: %s", e)
     try:
         log_path = os.path.join(paths['trial_dir'], CALL_LOG_FILENAME)
         with open(log_path, 'a', encoding='utf-8') as f:
@@ -149,10 +210,40 @@ def _append_call_log(paths: dict, record: dict):
     except Exception as e:
         log.warning("Failed to write call log: %s", e)
 
+
+def _note_artifacts(*rel_paths: str):
+    """Record artifacts a service reported (paths relative to data/) in their trial manifests."""
+    for rel_path in rel_paths:
+        if not rel_path:
+            continue
+        path = rel_path if rel_path.startswith('data' + os.sep) else os.path.join('data', rel_path)
+        try:
+            record_artifact(path, os.path.getsize(path))
+        except OSError:
+            pass
+
+def _prime_tts_reference(session_id: str, ref_path: str):
+    """Ask the TTS service to pre-compute conditioning for a freshly uploaded voice sample.
+    Runs in a background thread so the upload response is not delayed."""
+    def _run():
+        try:
+            resp = requests.post(
+                f"{TTS_URL}/api/v1/tts/ref",
+                json={'session_id': session_id, 'ref_path': ref_path},
+                timeout=120,
+            )
+            log.info("TTS reference primed: session=%s path=%s status=%s", session_id, ref_path, resp.status_code)
+        except Exception as e:
+            log.warning("TTS reference priming failed for %s: %s", ref_path, e)
+
+    threading.Thread(target=_run, name='tts-ref-prime', daemon=True).start()
+
 @app.route('/healthz', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "orchestra"}), 200
+    return jsonify({"status": "healthy", "service": "orchestra",
+                    "storage": _spiller.stats() if _spiller is not None else None,
+                    "archive": _archiver.stats() if _archiver is not None else None}), 200
 
 @app.route('/api/v1/process', methods=['POST'])
 def process_audio_pipeline():
@@ -168,6 +259,9 @@ def process_audio_pipeline():
     - ref_path: reference audio path (required when voice_id='clone')
     - user_context: additional context for LLM (optional, inline text or path to .txt file)
     - condition: LLM response condition (optional, 1 - repeat, 2 - enhance, 3 - oppose)
+    - tts_profile: TTS inference profile (optional, e.g. realtime / balanced / quality)
+    - audio_format: TTS delivery encoding (optional, wav / flac / opus / vorbis)
+    - audio_sample_rate: TTS delivery sample rate (optional, e.g. 16000)
     """
 
     start_time = time.time()
@@ -197,6 +291,9 @@ def process_audio_pipeline():
         user_context = request.form.get('user_context', '')
         condition = request.form.get('condition', '1')  # Optional, 1 - repeat, 2 - enhance, 3 - oppose
         scene = request.form.get('scene', 'default')
+        tts_profile = request.form.get('tts_profile', '').strip()
+        audio_format = request.form.get('audio_format', '').strip()
+        audio_sample_rate = request.form.get('audio_sample_rate', '').strip()
 
         call_log_record.update({
             "session_id": session_id,
@@ -207,7 +304,10 @@ def process_audio_pipeline():
                 "ref_path": raw_ref_path,
                 "user_context_len": len(user_context),
                 "condition": condition,
-                "scene": scene
+                "scene": scene,
+                "tts_profile": tts_profile,
+                "audio_format": audio_format,
+                "audio_sample_rate": audio_sample_rate
             }
         })
 
@@ -228,12 +328,17 @@ def process_audio_pipeline():
         log.info(f"Starting pipeline for session={session_id}, trial={trial_id}")
 
         # Ensure directory structure
+        _hold_trial(session_id, trial_id)
         paths = ensure_trial_paths(session_id, trial_id)
         session_ref_candidate = os.path.join('sessions', f"{session_id}_session", 'meta', 'sample_voice.wav')
         voice_id, ref_path = _determine_voice_and_ref(raw_voice_id, raw_ref_path, session_ref_candidate, paths)
 
         # Initialize timeline now that we have a path to write to
-        tl = Timeline(paths['timeline_path'])
+        # One trace id per pipeline run; services tag their events with it (see /api/v1/trace)
+        trace_id = new_trace_id()
+        call_log_record["trace_id"] = trace_id
+        tl = Timeline(paths['timeline_path'], 'orchestra', trace_id=trace_id)
+        bind_context(session=session_id, trial=trial_id, trace=trace_id)
         tl.add('pipeline_start', session_id=session_id, trial_id=trial_id)
 
         # Step 1: STT (Speech-to-Text)
@@ -241,6 +346,7 @@ def process_audio_pipeline():
         log.info("Step 1: Calling STT service...")
 
         stt_t0 = time.time()
+        stt_span = tl.begin('stt')
         stt_files = {'audio': (audio_file.filename, audio_file.stream, audio_file.content_type)}
         stt_data = {
             'session_id': session_id,
@@ -253,7 +359,8 @@ def process_audio_pipeline():
                 f"{STT_URL}/api/v1/stt",
                 files=stt_files,
                 data=stt_data,
-                timeout=60
+                timeout=60,
+                headers=tl.trace_headers(stt_span),
             )
 
             if stt_response.status_code != 200:
@@ -267,10 +374,13 @@ def process_audio_pipeline():
             log.info(f"STT completed: '{stt_text[:100]}...'")
             # record asr path and a short snippet of text in timeline
             tl.add('stt_end', asr_text_path=asr_text_path, asr_text_snippet=stt_text[:200])
+            _note_artifacts(asr_text_path)
+            stt_span.end()
             timing['stt'] = time.time() - stt_t0
 
         except Exception as e:
             log.error(f"STT service error: {e}")
+            stt_span.end(error=str(e)[:200])
             call_log_record["status"] = "error"
             call_log_record["timing"] = {k: v for k, v in timing.items() if v is not None}
             call_log_record["response"] = {"error": f"STT processing failed: {str(e)}"}
@@ -278,7 +388,7 @@ def process_audio_pipeline():
             return jsonify({
                 "status": "error",
                 "error": f"STT processing failed: {str(e)}",
-                "timeline": tl.snapshot() if tl else []
+                "timeline": tl.summary() if tl else {}
             }), 500
 
         # Step 2: LLM (Language Model)
@@ -299,11 +409,13 @@ def process_audio_pipeline():
         log.info("Step 2: Calling LLM service...")
 
         llm_t0 = time.time()
+        llm_span = tl.begin('llm')
         try:
             llm_response = requests.post(
                 f"{LLM_URL}/api/v1/llm",
                 json=llm_payload,
-                timeout=60
+                timeout=60,
+                headers=tl.trace_headers(llm_span),
             )
 
             if llm_response.status_code != 200:
@@ -317,7 +429,7 @@ def process_audio_pipeline():
             if llm_text_path:
                 fp = llm_text_path
                 if not fp.startswith('data' + os.sep) and not fp.startswith('data/'):
-                    fp = os.path.join('data', fp)
+                    fp = resolve_data_path(fp)
                 try:
                     with open(fp, 'r', encoding='utf-8') as f:
                         llm_text = f.read().strip()
@@ -327,10 +439,13 @@ def process_audio_pipeline():
             log.info(f"LLM completed: '{(llm_text[:100] if llm_text else llm_text_path) }...'")
             # record a small snippet of the LLM output and the path
             tl.add('llm_end', llm_text_snippet=(llm_text[:300] if llm_text else ''), llm_text_path=llm_text_path)
+            _note_artifacts(llm_text_path)
+            llm_span.end()
             timing['llm'] = time.time() - llm_t0
 
         except Exception as e:
             log.error(f"LLM service error: {e}")
+            llm_span.end(error=str(e)[:200])
             call_log_record["status"] = "error"
             call_log_record["timing"] = {k: v for k, v in timing.items() if v is not None}
             call_log_record["response"] = {
@@ -342,7 +457,7 @@ def process_audio_pipeline():
                 "status": "error",
                 "error": f"LLM processing failed: {str(e)}",
                 "stt_text": stt_text,
-                "timeline": tl.snapshot() if tl else []
+                "timeline": tl.summary() if tl else {}
             }), 500
 
         # Step 3: TTS (Text-to-Speech)
@@ -352,16 +467,25 @@ def process_audio_pipeline():
             'trial_id': trial_id,
             'ref_path': ref_path,  # reference audio for voice style, relative to data/, sample / robotic voice
             'text_path': llm_text_path,
+            'voice_id': voice_id,
         }
+        if tts_profile:
+            tts_payload['profile'] = tts_profile
+        if audio_format:
+            tts_payload['format'] = audio_format
+        if audio_sample_rate:
+            tts_payload['sample_rate'] = audio_sample_rate
         tl.add('tts_start', voice_id=voice_id, ref_path=ref_path, text_path=llm_text_path)
         log.info("Step 3: Calling TTS service...")
 
         tts_t0 = time.time()
+        tts_span = tl.begin('tts')
         try:
             tts_response = requests.post(
                 f"{TTS_URL}/api/v1/tts",
                 json=tts_payload,
-                timeout=180
+                timeout=180,
+                headers=tl.trace_headers(tts_span),
             )
 
             if tts_response.status_code != 200:
@@ -374,10 +498,13 @@ def process_audio_pipeline():
 
             log.info(f"TTS completed: {tts_audio_path}")
             tl.add('tts_end', tts_audio_path=tts_audio_path)
+            _note_artifacts(tts_audio_path, tts_result.get('wav_path'))
+            tts_span.end()
             timing['tts'] = time.time() - tts_t0
 
         except Exception as e:
             log.error(f"TTS service error: {e}")
+            tts_span.end(error=str(e)[:200])
             call_log_record["status"] = "error"
             call_log_record["timing"] = {k: v for k, v in timing.items() if v is not None}
             call_log_record["response"] = {
@@ -391,12 +518,13 @@ def process_audio_pipeline():
                 "error": f"TTS processing failed: {str(e)}",
                 "stt_text": stt_text,
                 "llm_response": llm_text,
-                "timeline": tl.snapshot() if tl else []
+                "timeline": tl.summary() if tl else {}
             }), 500
 
         # Calculate processing time
         total_time = time.time() - start_time
         tl.add('pipeline_end', processing_time=round(total_time, 2))
+        STAGE_LATENCY.observe(total_time, service='orchestra', stage='total')
 
         log.info(f"Pipeline completed in {total_time:.2f}s for session={session_id}")
 
@@ -431,7 +559,8 @@ def process_audio_pipeline():
             "user_context": user_context,
             "condition": condition,
             "scene": scene,
-            "timeline": tl.snapshot() if tl else []
+            "trace_id": trace_id,
+            "timeline": tl.summary() if tl else {}
         }), 200
 
     except Exception as e:
@@ -451,9 +580,9 @@ def process_audio_pipeline():
                 tl.add('pipeline_error', error=str(e)[:1000])
             except Exception:
                 pass
-            timeline_snapshot = tl.snapshot()
+            timeline_snapshot = tl.summary()
         else:
-            timeline_snapshot = []
+            timeline_snapshot = {}
         # Include traceback in response for local debugging
         return jsonify({
             "status": "error",
@@ -463,6 +592,174 @@ def process_audio_pipeline():
             "timeline": timeline_snapshot
         }), 500
 
+@app.route('/api/v1/filler', methods=['POST'])
+def get_filler_audio():
+    """
+    Return a short pre-synthesized filler ("hmm", "let me think") in the session voice.
+    Unity calls this when it sends /api/v1/process and plays the clip while STT/LLM run.
+
+    Form fields (same meaning as /api/v1/process): session_id, trial_id, voice_id, ref_path.
+    - stream: optional, '1' returns the audio file itself instead of JSON
+
+    Returns 204 when no filler is ready yet for the voice (generation is started in the background).
+    """
+    try:
+        session_id = request.form.get('session_id', '').strip()
+        if not session_id:
+            return jsonify({"error": "session_id is required"}), 400
+        trial_id = int(request.form.get('trial_id', '1'))
+        paths = ensure_trial_paths(session_id, trial_id)
+        session_ref_candidate = os.path.join('sessions', f"{session_id}_session", 'meta', 'sample_voice.wav')
+        voice_id, ref_path = _determine_voice_and_ref(
+            request.form.get('voice_id', ''), request.form.get('ref_path', ''), session_ref_candidate, paths
+        )
+
+        resp = requests.get(
+            f"{TTS_URL}/api/v1/tts/fillers",
+            params={'session_id': session_id, 'ref_path': ref_path},
+            timeout=5,
+        )
+        fillers = resp.json().get('fillers', []) if resp.status_code == 200 else []
+        if not fillers:
+            requests.post(f"{TTS_URL}/api/v1/tts/fillers", json={'session_id': session_id, 'ref_path': ref_path}, timeout=5)
+            return '', 204
+
+        # Rotate through the clips across trials so participants do not hear the same one every time
+        filler = fillers[trial_id % len(fillers)]
+        file_path = os.path.join('/workspace/data', filler['audio_path'])
+        if request.form.get('stream', '').strip() in ('1', 'true', 'yes'):
+            return send_file(file_path, mimetype='audio/wav')
+        return jsonify({
+            "status": "success",
+            "voice_id": voice_id,
+            "filler_text": filler['text'],
+            "filler_audio_path": filler['audio_path'],
+        }), 200
+    except Exception as e:
+        log.error(f"Filler lookup error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/prerender', methods=['POST'])
+def prerender_session():
+    """
+    Pre-render a session's scripted NPC lines so their trials skip TTS inference.
+
+    Form fields:
+    - session_id: required
+    - voice_id, ref_path, tts_profile: same meaning as /api/v1/process (must match the trials)
+    - texts: one line per trial, starting at first_trial (default 0)
+    - scenes_csv: optional file; one row per trial, text from text_column (default 'question')
+
+    Returns 202 with a job id; poll GET /api/v1/prerender/<job_id>.
+    """
+    try:
+        session_id = request.form.get('session_id', '').strip()
+        if not session_id:
+            return jsonify({"error": "session_id is required"}), 400
+        paths = ensure_trial_paths(session_id, int(request.form.get('first_trial', '0') or 0))
+        session_ref_candidate = os.path.join('sessions', f"{session_id}_session", 'meta', 'sample_voice.wav')
+        voice_id, ref_path = _determine_voice_and_ref(
+            request.form.get('voice_id', ''), request.form.get('ref_path', ''), session_ref_candidate, paths
+        )
+        data = {'session_id': session_id, 'voice_id': voice_id, 'ref_path': ref_path}
+        for field in ('texts', 'first_trial', 'text_column'):
+            if request.form.get(field):
+                data[field] = request.form[field]
+        if request.form.get('tts_profile'):
+            data['profile'] = request.form['tts_profile'].strip()
+        files = None
+        scenes = request.files.get('scenes_csv')
+        if scenes:
+            files = {'scenes_csv': (scenes.filename or 'scenes.csv', scenes.read(), 'text/csv')}
+        resp = requests.post(f"{TTS_URL}/api/v1/tts/prerender", data=data, files=files, timeout=30)
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        log.error(f"Pre-render request error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/prerender/<job_id>', methods=['GET'])
+def prerender_status(job_id):
+    try:
+        resp = requests.get(f"{TTS_URL}/api/v1/tts/prerender/{job_id}", timeout=5)
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/trace/<session_id>/<int:trial_id>', methods=['GET'])
+def trial_waterfall(session_id, trial_id):
+    """
+    Merged waterfall of one pipeline run across orchestrator, STT, LLM and TTS.
+
+    Query: trace_id (optional, defaults to the latest run of the trial).
+    Returns spans and events in milliseconds from the start of the run, plus `network`
+    entries with the untimed gap before and after each service call.
+    """
+    try:
+        timelines = [p['timeline_path'] for p in trial_locations(session_id, trial_id) if os.path.isfile(p['timeline_path'])]
+        records = [rec for path in timelines for rec in read_timeline(path)]
+        if not timelines:
+            archived = read_archived(os.path.relpath(trial_paths(session_id, trial_id, durable=True)['timeline_path'], 'data'))
+            if archived is None:
+                return jsonify({"error": "no timeline for this trial"}), 404
+            records = [json.loads(line) for line in archived.decode('utf-8').splitlines() if line.strip()]
+        result = build_waterfall(records, request.args.get('trace_id') or None)
+        if not result['spans'] and not result['events']:
+            return jsonify({"error": "trace not found"}), 404
+        return jsonify({"session_id": session_id, "trial_id": trial_id, **result}), 200
+    except Exception as e:
+        log.error(f"Waterfall error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/calls', methods=['GET'])
+def list_calls():
+    """
+    Query call records from the session store.
+
+    Query: session_id, trial_id, status, since, until (epoch seconds or ISO date), limit (default 100)
+    """
+    if _session_store is None:
+        return jsonify({"error": "session store unavailable"}), 503
+    try:
+        trial_id = request.args.get('trial_id')
+        calls = _session_store.query(
+            session_id=request.args.get('session_id') or None,
+            trial_id=int(trial_id) if trial_id else None,
+            status=request.args.get('status') or None,
+            since=parse_time(request.args.get('since')),
+            until=parse_time(request.args.get('until')),
+            limit=int(request.args.get('limit', 100)),
+        )
+        return jsonify({"count": len(calls), "calls": calls}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route('/api/v1/calls/stats', methods=['GET'])
+def call_stats():
+    """
+    Latency statistics per stage from the session store.
+
+    Query: stage (stt, llm, tts, total; default all), session_id, status (default success), since, until
+    """
+    if _session_store is None:
+        return jsonify({"error": "session store unavailable"}), 503
+    try:
+        stages = [request.args['stage']] if request.args.get('stage') else list(STAGES)
+        kwargs = dict(
+            session_id=request.args.get('session_id') or None,
+            status=request.args.get('status', 'success') or None,
+            since=parse_time(request.args.get('since')),
+            until=parse_time(request.args.get('until')),
+        )
+        return jsonify({stage: _session_store.stage_stats(stage, **kwargs) for stage in stages}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @app.route('/api/v1/download/<path:filename>', methods=['GET'])
 def download_file(filename):
     """
@@ -471,9 +768,13 @@ def download_file(filename):
     Usage: GET /api/v1/download/sessions/session_id/trial_id/output.wav
     """
     try:
-        file_path = os.path.join('/workspace/data', filename)
+        file_path = resolve_data_path(filename, '/workspace/data')
         
         if not os.path.exists(file_path):
+            # Old trials are served from their session archive, decompressed on the fly
+            archived = archived_response(os.path.relpath(file_path, '/workspace/data'), '/workspace/data')
+            if archived is not None:
+                return archived
             return jsonify({"error": "File not found"}), 404
             
         if not os.path.isfile(file_path):
@@ -525,20 +826,21 @@ def upload_file():
         elif dest_choice == 'session':
             dest_dir = paths['base']
 
-        os.makedirs(dest_dir, exist_ok=True)
-
         desired_name = request.form.get('filename', '').strip()
         safe_name = secure_filename(desired_name) if desired_name else secure_filename(upload.filename)
         if not safe_name:
             return jsonify({"error": "Could not derive a safe filename"}), 400
 
         abs_path = os.path.join(dest_dir, safe_name)
-        upload.save(abs_path)
+        with atomic_output(abs_path) as tmp:
+            upload.save(tmp)
 
         # Build relative path from /workspace/data for convenience
         rel_path = os.path.relpath(abs_path, start='/workspace/data')
 
         log.info("Uploaded file saved: session=%s trial=%s dest=%s path=%s", session_id, trial_id, dest_choice, abs_path)
+        if dest_choice == 'meta' and safe_name.lower().endswith(REF_AUDIO_EXTENSIONS):
+            _prime_tts_reference(session_id, abs_path)
         return jsonify({
             "status": "success",
             "session_id": session_id,
@@ -559,16 +861,19 @@ def get_processing_status(session_id, trial_id):
     Get processing status and results for a specific session/trial
     """
     try:
-        paths = ensure_trial_paths(session_id, trial_id)
-        
-        # Check if files exist to determine processing status
+        # Answered from the trial manifests (hot and durable directory): no directory creation,
+        # at most one scan per rescan interval
         status = {
             "session_id": session_id,
             "trial_id": trial_id,
-            "stt_completed": os.path.exists(os.path.join(paths['trial_dir'], 'user_1B_asr.txt')),
-            "llm_completed": os.path.exists(os.path.join(paths['trial_dir'], 'user_2B_llm.txt')),
-            "tts_completed": os.path.exists(os.path.join(paths['trial_dir'], 'user_2B_tts.wav')),
+            "stt_completed": trial_has(session_id, trial_id, 'user_1B_asr.txt'),
+            "llm_completed": trial_has(session_id, trial_id, 'user_2B_llm.txt'),
+            "tts_completed": trial_has(session_id, trial_id, 'user_2B_tts.wav'),
         }
+        if request.args.get('artifacts'):
+            # Durable entries first so a newer hot copy wins
+            status["artifacts"] = {name: info for durable in (True, False)
+                                   for name, info in trial_manifest(session_id, trial_id, durable).artifacts().items()}
         
         return jsonify(status), 200
         
@@ -577,6 +882,7 @@ def get_processing_status(session_id, trial_id):
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    install_signal_flush()
     log.info("Starting Orchestra service...")
     log.info("This service orchestrates STT -> LLM -> TTS pipeline")
     
@@ -1,8 +1,11 @@
 from flask import Flask, request, jsonify, send_from_directory
-import os, time, hashlib, yaml
-from common.io_paths import ensure_trial_paths
-from common.timeline import Timeline
-from common.logging_conf import setup_logging
+import os, time, hashlib, yaml, contextlib
+from common.io_paths import atomic_output, atomic_write, ensure_trial_paths, resolve_data_path
+from common.timeline import Timeline, flush_timelines, incoming_trace, install_signal_flush
+from common.logging_conf import bind_context, clear_context, setup_logging
+from common.archive import archived_response
+from common.gpu_lock import INTERACTIVE, arbiter_from_config
+from common.metrics import QUEUE_DEPTH, install as install_metrics
 
 import whisper
 
@@ -12,33 +15,43 @@ cfg = yaml.safe_load(open(CFG_PATH, "r", encoding="utf-8"))
 
 MODEL_NAME = os.environ.get("WHISPER_MODEL", cfg.get("stt", {}).get("model_size", "base.en"))
 REQUESTED_DEVICE = os.environ.get("WHISPER_DEVICE", cfg.get("stt", {}).get("device", "cpu")) # cpu or cuda
+log = setup_logging("stt")
+
 MODELS_DIR = cfg["paths"]["models_root"] if "paths" in cfg else "models"
 STT_MODELS_DIR = os.path.join(MODELS_DIR, "whisper")
 
 
 def _load_model_with_fallback():
     requested = (REQUESTED_DEVICE or "cpu").strip().lower()
-    print(f"[stt] loading whisper model='{MODEL_NAME}' on device='{requested}'...")
+    log.info(f"Loading whisper model='{MODEL_NAME}' on device='{requested}'...")
     try:
         model = whisper.load_model(MODEL_NAME, download_root=STT_MODELS_DIR).to(requested)
-        print(f"[stt] model ready on device='{requested}'")
+        log.info(f"Model ready on device='{requested}'")
         return model, requested
     except Exception as e:
         if requested == "cpu":
             raise
         fallback = "cpu"
-        print(f"[stt] failed to initialize on device='{requested}': {e}")
-        print(f"[stt] retrying whisper model='{MODEL_NAME}' on device='{fallback}'...")
+        log.warning(f"Failed to initialize on device='{requested}': {e}")
+        log.info(f"Retrying whisper model='{MODEL_NAME}' on device='{fallback}'...")
         model = whisper.load_model(MODEL_NAME, download_root=STT_MODELS_DIR).to(fallback)
-        print(f"[stt] model ready on device='{fallback}'")
+        log.info(f"Model ready on device='{fallback}'")
         return model, fallback
 
 
 _model, ACTIVE_DEVICE = _load_model_with_fallback()
 
+# GPU arbitration shared with the TTS service (no-op when Whisper runs on CPU)
+_GPU = arbiter_from_config(cfg) if ACTIVE_DEVICE != "cpu" else None
+if _GPU is not None:
+    QUEUE_DEPTH.set_function(lambda: sum(_GPU.stats()['waiting'].values()), service='stt', queue='gpu')
+
 # create the Flask app
 app = Flask(__name__)
-log = setup_logging("stt")
+# Timeline events are buffered; make sure a request's events are on disk when it ends
+app.teardown_request(flush_timelines)
+app.teardown_request(clear_context)
+install_metrics(app, 'stt')
 
 # constants
 DATA_ROOT = cfg["paths"]["data_root"] if "paths" in cfg else "data"
@@ -66,10 +79,12 @@ def stt():
         # save the audio file
         paths = ensure_trial_paths(session_id, trial_id)
         wav_path = os.path.join(paths['trial_dir'], 'user_1B_mic.wav')
-        audio.save(wav_path)
+        with atomic_output(wav_path) as tmp:
+            audio.save(tmp)
 
         # log the request
-        tl = Timeline(paths['timeline_path'])
+        tl = Timeline(paths['timeline_path'], 'stt', **incoming_trace(request.headers))
+        bind_context(session=session_id, trial=trial_id, trace=tl.trace_id)
         tl.add('recv_start', lang=lang)
 
         # TODO load Whisper and transcribe the wav_path
@@ -78,12 +93,16 @@ def stt():
         if lang != "auto":
             transcribe_kwargs["language"] = lang
 
-        result = _model.transcribe(wav_path, **transcribe_kwargs)
+        with tl.span('asr', device=ACTIVE_DEVICE):
+            with (_GPU.acquire(INTERACTIVE) if _GPU else contextlib.nullcontext({})) as lease:
+                if lease:
+                    tl.add('gpu_acquired', wait_sec=lease['wait_sec'])
+                with tl.span('transcribe'):
+                    result = _model.transcribe(wav_path, **transcribe_kwargs)
         text = result.get("text", "").strip()
 
         asr_text_path = os.path.join(paths['trial_dir'], 'user_1B_asr.txt')
-        with open(asr_text_path, 'w', encoding='utf-8') as f:
-            f.write(text + "\n")
+        atomic_write(asr_text_path, text + "\n")
 
         tl.add('asr_end')
 
@@ -93,7 +112,7 @@ def stt():
             'asr_text_path': os.path.relpath(asr_text_path, start='data'),
             'asr_confidence': 0.90,
             'duration_sec': 0.0,
-            'timeline': tl.snapshot(),
+            'timeline': tl.summary(),
         })
     except Exception as e:
         import traceback
@@ -102,12 +121,19 @@ def stt():
 
 @app.get('/healthz')
 def healthz():
-    return jsonify({"service":"stt","ts":time.time()})
+    return jsonify({"service":"stt","ts":time.time(),"gpu":_GPU.stats() if _GPU else None})
 
 @app.get('/files/<path:p>')
 def fileserve(p):
-    return send_from_directory('data', p, as_attachment=True)
+    path = resolve_data_path(p)
+    if not os.path.exists(path):
+        # Trials older than storage.archive.after_days are served from their session archive
+        archived = archived_response(os.path.relpath(path, 'data'))
+        if archived is not None:
+            return archived
+    return send_from_directory('data', os.path.relpath(path, 'data'), as_attachment=True)
 
 if __name__ == '__main__':
+    install_signal_flush()
     port = cfg.get("http", {}).get("stt_port", 7001)
     app.run(host='0.0.0.0', port=port)
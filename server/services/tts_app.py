@@ -1,15 +1,28 @@
-from flask import Flask, request, jsonify, send_from_directory
-import os, yaml, time, traceback
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+import os, re, csv, io, uuid, wave, yaml, time, hashlib, itertools, threading, traceback, contextlib
+import numpy as np
 from typing import Optional
-from common.io_paths import ensure_trial_paths
-from common.timeline import Timeline
-from common.logging_conf import setup_logging
+from common.io_paths import atomic_output, ensure_trial_paths, resolve_data_path, trial_dirs, trial_paths
+from common.timeline import Timeline, flush_timelines, incoming_trace, install_signal_flush
+from common.logging_conf import bind_context, clear_context, setup_logging
+from common.audio_io import AUDIO_FORMATS, StreamEncoder, ffmpeg_available, transcode_file, wav_header
+from common.ref_cache import LRUCache, file_digest
+from common.output_cache import DiskLRUCache, cache_key, link_or_copy
+from common.inference_queue import InferenceQueue
+from common.archive import archived_response
+from common.gpu_lock import BATCH, INTERACTIVE, PRIORITIES, arbiter_from_config
+from common.metrics import QUEUE_DEPTH, STAGE_LATENCY, install as install_metrics
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 
 CFG_PATH = "config/app.yml"
 cfg = yaml.safe_load(open(CFG_PATH, "r", encoding="utf-8"))
 
 app = Flask(__name__)
+# Timeline events are buffered; make sure a request's events are on disk when it ends
+app.teardown_request(flush_timelines)
+app.teardown_request(clear_context)
+install_metrics(app, 'tts')
 log = setup_logging("tts")
 
 
@@ -26,8 +39,8 @@ def _save_uploaded_file(file_storage, dest_dir: str, fallback: str) -> Optional[
     filename = secure_filename(file_storage.filename) or fallback
     rel_path = os.path.join(dest_dir, filename)
     abs_path = os.path.abspath(rel_path)
-    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-    file_storage.save(abs_path)
+    with atomic_output(abs_path) as tmp:
+        file_storage.save(tmp)
     return abs_path
 
 # Ensure local IndexTTS package is importable when running from repo
@@ -96,8 +109,8 @@ def _resolve_text(paths: dict, payload: dict) -> str:
     if text_path:
         candidates = [text_path]
         if not os.path.isabs(text_path):
-            candidates.append(os.path.join('data', text_path))
-            candidates.append(os.path.join(paths['trial_dir'], os.path.basename(text_path)))
+            candidates.append(resolve_data_path(text_path))
+            candidates.extend(os.path.join(d, os.path.basename(text_path)) for d in trial_dirs(paths))
         for p in candidates:
             if os.path.isfile(p):
                 try:
@@ -108,15 +121,16 @@ def _resolve_text(paths: dict, payload: dict) -> str:
                 except Exception:
                     pass
 
-    llm_path = os.path.join(paths['trial_dir'], 'llama_output.txt')
-    if os.path.isfile(llm_path):
-        try:
-            with open(llm_path, 'r', encoding='utf-8') as f:
-                txt = f.read().strip()
-                if txt:
-                    return txt
-        except Exception:
-            pass
+    for trial_dir in trial_dirs(paths):
+        llm_path = os.path.join(trial_dir, 'llama_output.txt')
+        if os.path.isfile(llm_path):
+            try:
+                with open(llm_path, 'r', encoding='utf-8') as f:
+                    txt = f.read().strip()
+                    if txt:
+                        return txt
+            except Exception:
+                pass
     return "Hello, this is a test."
 
 def _resolve_ref_path(paths: dict, payload: dict) -> str:
@@ -134,11 +148,10 @@ def _resolve_ref_path(paths: dict, payload: dict) -> str:
         candidates = [ref]
         if ref.startswith('data' + os.sep):
             candidates.append(ref)
-        candidates.extend([
-            os.path.join(paths['trial_dir'], ref),
-            os.path.join(paths['base'], ref),
-            os.path.join('data', ref),
-        ])
+        if paths:
+            candidates.extend(os.path.join(d, ref) for d in trial_dirs(paths))
+            candidates.append(os.path.join(paths['base'], ref))
+        candidates.append(resolve_data_path(ref))
         for p in candidates:
             if os.path.isfile(p):
                 return p
@@ -163,97 +176,836 @@ def _derive_output_name(paths: dict, payload: dict) -> str:
         return os.path.join(paths['trial_dir'], out_name)
     return os.path.join(paths['trial_dir'], 'npc_1A_tts.wav')
 
-@app.post('/api/v1/tts')
-def tts():
+# infer_fast parameters (batch-friendly settings from sample); profiles override these
+INFER_KWARGS = dict(
+    max_text_tokens_per_sentence=120,
+    sentences_bucket_max_size=4,
+    do_sample=True,
+    top_p=0.8,
+    top_k=30,
+    temperature=1.0,
+    length_penalty=0.0,
+    num_beams=3,
+    repetition_penalty=10.0,
+    max_mel_tokens=600,
+)
+
+# Named latency/quality presets (tts.profiles in app.yml), selectable per request
+# (`profile`) or per voice (`profile` under the voice in voices.yml)
+VOICES_PATH = "config/voices.yml"
+try:
+    voices_cfg = yaml.safe_load(open(VOICES_PATH, "r", encoding="utf-8")) or {}
+except Exception:
+    voices_cfg = {}
+TTS_PROFILES = cfg.get('tts', {}).get('profiles', {}) or {}
+DEFAULT_PROFILE = cfg.get('tts', {}).get('profile') or 'balanced'
+
+
+def _resolve_profile(payload: dict):
+    """Return (profile_name, infer_fast kwargs): request profile > voice profile > tts.profile."""
+    payload = payload or {}
+    voice = (voices_cfg.get('voices', {}) or {}).get(payload.get('voice_id') or '') or {}
+    name = payload.get('profile') or voice.get('profile') or DEFAULT_PROFILE
+    if name not in TTS_PROFILES:
+        if payload.get('profile'):
+            log.warning(f"[tts] Unknown profile '{name}', using '{DEFAULT_PROFILE}'")
+        name = DEFAULT_PROFILE
+    kwargs = dict(INFER_KWARGS)
+    kwargs.update(TTS_PROFILES.get(name) or {})
+    return name, kwargs
+
+
+# --- Reference conditioning cache ---
+# IndexTTS keeps the conditioning mel of the last reference on the model
+# (cache_audio_prompt / cache_cond_mel) and recomputes it whenever the path changes.
+# Keep an LRU of those tensors keyed by the reference file's content hash so
+# alternating voices skip audio decoding and feature extraction.
+_REF_CACHE = LRUCache(int(cfg.get('tts', {}).get('ref_cache_size', 16)))
+_infer_lock = threading.RLock()
+
+# Shared with the STT service; interactive trials preempt batch work (fillers, warm-up)
+_GPU = arbiter_from_config(cfg)
+
+
+if _GPU is not None:
+    QUEUE_DEPTH.set_function(lambda: sum(_GPU.stats()['waiting'].values()), service='tts', queue='gpu')
+
+
+def _gpu(priority: str = INTERACTIVE, admission: dict = None):
+    return _GPU.acquire(priority, admission=admission) if _GPU is not None else contextlib.nullcontext()
+
+
+def _supports_ref_cache() -> bool:
+    return _tts_model is not None and hasattr(_tts_model, 'cache_cond_mel') and hasattr(_tts_model, 'cache_audio_prompt')
+
+
+def _infer_direct(ref_path: str, text: str, output_path, priority: str = INTERACTIVE, admission: dict = None,
+                  **kwargs):
+    """infer_fast with the reference conditioning served from the LRU cache when possible.
+    `admission` is a GPU barrier pass from _GPU.admit() taken before the job was queued."""
+    if not _supports_ref_cache():
+        with _gpu(priority, admission), STAGE_LATENCY.time(service='tts', stage='inference'):
+            return _tts_model.infer_fast(ref_path, text, output_path, **kwargs)
     try:
-        payload = _get_request_payload() or {}
-        session_id = payload.get('session_id') or 'demo-session'
-        trial_id = int(payload.get('trial_id') or 0)
+        digest = file_digest(ref_path)
+    except OSError:
+        digest = None
+    # GPU lease first: waiting for it under _infer_lock would let a queued batch call block
+    # later interactive calls in this process
+    with _gpu(priority, admission), _infer_lock:
+        cached = _REF_CACHE.get(digest) if digest else None
+        if cached is not None:
+            _tts_model.cache_audio_prompt = ref_path
+            _tts_model.cache_cond_mel = cached
+        else:
+            # Unknown content: force a recompute even if the path matches (file may have been replaced)
+            _tts_model.cache_audio_prompt = None
+        with STAGE_LATENCY.time(service='tts', stage='inference'):
+            result = _tts_model.infer_fast(ref_path, text, output_path, **kwargs)
+        if digest and cached is None and _tts_model.cache_cond_mel is not None:
+            _REF_CACHE.put(digest, _tts_model.cache_cond_mel)
+    return result
+
+
+# --- Cross-request scheduler ---
+# One worker thread owns the model. Concurrent requests queue here (interactive before batch
+# work, FIFO within each) instead of contending on the GPU, and run one at a time.
+# infer_fast takes a single text per call and returns one concatenated waveform, so requests
+# cannot share an inference call; infer_fast still batches the sentences within each request,
+# and the reference LRU above skips conditioning for a repeated voice.
+# Batch jobs pass the cross-service GPU barrier before they are queued, on the caller's
+# thread, so the worker never waits there for another service's interactive stage while
+# interactive TTS jobs queue behind it.
+_SCHED_CFG = cfg.get('tts', {}).get('scheduler', {}) or {}
+
+
+def _run_tts_job(item):
+    ref_path, text, output_path, priority, admission, kwargs = item
+    return _infer_direct(ref_path, text, output_path, priority, admission, **kwargs)
+
+
+_scheduler = None
+if _SCHED_CFG.get('enabled', True):
+    _scheduler = InferenceQueue(_run_tts_job, name='tts-scheduler')
+    QUEUE_DEPTH.set_function(lambda: _scheduler.stats()['queue_depth'], service='tts', queue='scheduler')
+
+
+def _infer(ref_path: str, text: str, output_path, priority: str = INTERACTIVE, **kwargs):
+    if _scheduler is None or _tts_model is None:
+        return _infer_direct(ref_path, text, output_path, priority, **kwargs)
+    admission = _GPU.admit(priority) if _GPU is not None and priority != INTERACTIVE else None
+    return _scheduler.run((ref_path, text, output_path, priority, admission, kwargs), priority=PRIORITIES[priority])
+
+
+def _prime_reference(ref_path: str) -> dict:
+    """Compute and cache conditioning for a reference ahead of the first trial."""
+    digest = file_digest(ref_path)
+    if digest in _REF_CACHE:
+        return {'digest': digest, 'cached': True}
+    if not _supports_ref_cache():
+        return {'digest': digest, 'cached': False}
+    t0 = time.time()
+    # A very short synthesis is the supported way to make IndexTTS build the conditioning
+    _infer(ref_path, "Hello.", None, BATCH, **dict(INFER_KWARGS, max_mel_tokens=50, num_beams=1))
+    return {'digest': digest, 'cached': digest in _REF_CACHE, 'prime_sec': round(time.time() - t0, 3)}
 
-        paths = ensure_trial_paths(session_id, trial_id)
-        audio_path = _derive_output_name(paths, payload)
 
-        tl = Timeline(paths['timeline_path'])
+# --- Content-addressed output cache ---
+# Identical (text, reference content, inference parameters) requests reuse a previously
+# synthesized WAV, linked into the trial directory instead of running inference.
+_OUT_CACHE_CFG = cfg.get('tts', {}).get('output_cache', {}) or {}
+_OUT_CACHE = None
+if _OUT_CACHE_CFG.get('enabled', True):
+    try:
+        _OUT_CACHE = DiskLRUCache(
+            _OUT_CACHE_CFG.get('dir') or os.path.join('data', 'cache', 'tts'),
+            int(float(_OUT_CACHE_CFG.get('max_mb', 2048)) * 1024 * 1024),
+        )
+    except OSError:
+        log.warning("[tts] Output cache unavailable:\n" + traceback.format_exc())
+
+
+def _flag(value, default=True) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def _content_key(text: str, ref_path: str, params: dict):
+    """Content address of a synthesis: text, reference content, parameters and model."""
+    try:
+        ref_digest = file_digest(ref_path)
+    except OSError:
+        return None
+    return cache_key(text=text, ref=ref_digest, params=params, model=_MODEL_DIR)
+
+
+def _output_cache_key(req: dict, params: dict):
+    """Cache key for a request, or None when caching is off for it."""
+    if _OUT_CACHE is None or not _flag(req['payload'].get('cache')):
+        return None
+    return _content_key(req['text'], req['ref_path'], params)
 
-        ref_upload = request.files.get('ref_audio') if request.files else None
-        if ref_upload:
-            saved_ref = _save_uploaded_file(ref_upload, paths['meta_dir'], 'uploaded_ref.wav')
-            if saved_ref:
-                payload['ref_path'] = saved_ref
 
-        text_upload = request.files.get('text_file') if request.files else None
-        if text_upload:
-            saved_text = _save_uploaded_file(text_upload, paths['trial_dir'], 'uploaded_text.txt')
-            if saved_text:
-                payload['text_path'] = saved_text
+def _prerender_path(session_id: str, trial_id: int, key: str) -> str:
+    # Always on durable storage: pre-rendered trials may run long after the job (hot trial storage)
+    return os.path.join(trial_paths(session_id, trial_id, durable=True)['trial_dir'], 'prerender', f"{key[:32]}.wav")
 
-        text = _resolve_text(paths, payload)
-        ref_path = _resolve_ref_path(paths, payload)
-        tl.add('tts_start', text_len=len(text), ref=os.path.basename(ref_path), ref_uploaded=bool(ref_upload))
 
+def _pickup_rendered(req: dict, key: Optional[str]) -> Optional[str]:
+    """Place an already rendered WAV for this request at audio_path.
+    Returns 'prerender' or 'cache' for the source used, None when it must be synthesized."""
+    content_key = key or _content_key(req['text'], req['ref_path'], req['infer_kwargs'])
+    if content_key:
+        rendered = _prerender_path(req['session_id'], req['trial_id'], content_key)
+        if os.path.isfile(rendered):
+            try:
+                link_or_copy(rendered, req['audio_path'])
+                return 'prerender'
+            except OSError:
+                pass
+    if key and _OUT_CACHE.materialize(key, req['audio_path']):
+        return 'cache'
+    return None
+
+
+# --- Output encoding ---
+# IndexTTS writes 16-bit WAV at its native rate. tts.format / tts.sample_rate (or per-request
+# `format` / `sample_rate`) select a smaller delivery encoding, produced with ffmpeg next to
+# the WAV so the original stays available for analysis.
+OUTPUT_FORMAT = str(cfg.get('tts', {}).get('format') or 'wav').lower()
+OUTPUT_SAMPLE_RATE = int(cfg.get('tts', {}).get('sample_rate') or 0)
+OPUS_BITRATE = cfg.get('tts', {}).get('opus_bitrate') or '32k'
+_FFMPEG = ffmpeg_available()
+if not _FFMPEG:
+    log.warning("[tts] ffmpeg not found; audio is delivered as native WAV only")
+# File encodes for /tts run here, not on the request thread; bounds concurrent ffmpeg processes
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=max(1, int(cfg.get('tts', {}).get('encode_workers', 2))),
+                                  thread_name_prefix='tts-encode')
+
+
+def _resolve_output_format(payload: dict, streaming: bool = False):
+    """Return (format, sample_rate or 0) for a request, falling back to native WAV when unsupported."""
+    fmt = str((payload or {}).get('format') or OUTPUT_FORMAT).lower()
+    try:
+        out_rate = int((payload or {}).get('sample_rate') or OUTPUT_SAMPLE_RATE)
+    except (TypeError, ValueError):
+        out_rate = OUTPUT_SAMPLE_RATE
+    if fmt not in AUDIO_FORMATS or (fmt == 'pcm' and not streaming):
+        log.warning(f"[tts] Unsupported output format '{fmt}', using wav")
+        fmt = 'wav'
+    needs_ffmpeg = fmt not in ('wav', 'pcm') or bool(out_rate)
+    if needs_ffmpeg and not _FFMPEG:
+        # Without ffmpeg only the untouched model output can be served
+        return ('pcm' if fmt == 'pcm' else 'wav'), 0
+    return fmt, out_rate
+
+
+def _encode_output(wav_path: str, fmt: str, out_rate: int) -> str:
+    """Encode the trial WAV into the delivery format; returns the path to serve."""
+    if fmt == 'wav' and not out_rate:
+        return wav_path
+    dest = os.path.splitext(wav_path)[0] + (AUDIO_FORMATS[fmt]['ext'] if fmt != 'wav' else f'_{out_rate}.wav')
+    transcode_file(wav_path, dest, fmt, out_rate or None, bitrate=OPUS_BITRATE)
+    return dest
+
+
+def _prepare_tts_request():
+    """Parse the request, save uploads and resolve text/reference. Shared by /tts and /tts/stream."""
+    payload = _get_request_payload() or {}
+    session_id = payload.get('session_id') or 'demo-session'
+    trial_id = int(payload.get('trial_id') or 0)
+
+    paths = ensure_trial_paths(session_id, trial_id)
+    audio_path = _derive_output_name(paths, payload)
+
+    tl = Timeline(paths['timeline_path'], 'tts', **incoming_trace(request.headers))
+    bind_context(session=session_id, trial=trial_id, trace=tl.trace_id)
+
+    ref_upload = request.files.get('ref_audio') if request.files else None
+    if ref_upload:
+        saved_ref = _save_uploaded_file(ref_upload, paths['meta_dir'], 'uploaded_ref.wav')
+        if saved_ref:
+            payload['ref_path'] = saved_ref
+
+    text_upload = request.files.get('text_file') if request.files else None
+    if text_upload:
+        saved_text = _save_uploaded_file(text_upload, paths['trial_dir'], 'uploaded_text.txt')
+        if saved_text:
+            payload['text_path'] = saved_text
+
+    text = _resolve_text(paths, payload)
+    ref_path = _resolve_ref_path(paths, payload)
+    profile, infer_kwargs = _resolve_profile(payload)
+    tl.add('tts_start', text_len=len(text), ref=os.path.basename(ref_path), ref_uploaded=bool(ref_upload),
+           profile=profile)
+    return {
+        'payload': payload,
+        'session_id': session_id,
+        'trial_id': trial_id,
+        'paths': paths,
+        'audio_path': audio_path,
+        'tl': tl,
+        'text': text,
+        'ref_path': ref_path,
+        'profile': profile,
+        'infer_kwargs': infer_kwargs,
+    }
+
+
+@app.post('/api/v1/tts')
+def tts():
+    try:
+        req = _prepare_tts_request()
+        payload, tl, audio_path = req['payload'], req['tl'], req['audio_path']
+        text, ref_path = req['text'], req['ref_path']
+
+        key = _output_cache_key(req, req['infer_kwargs'])
+        source = _pickup_rendered(req, key)
+        cached = source is not None
         did_fallback = False
-        try:
-            if _tts_model is None:
-                raise RuntimeError("IndexTTS model is not initialized")
-            # Perform inference (batch-friendly settings from sample)
-            _ = _tts_model.infer_fast(
-                ref_path,
-                text,
-                audio_path,
-                verbose=bool(payload.get('verbose', False)),
-                max_text_tokens_per_sentence=120,
-                sentences_bucket_max_size=4,
-                do_sample=True,
-                top_p=0.8,
-                top_k=30,
-                temperature=1.0,
-                length_penalty=0.0,
-                num_beams=3,
-                repetition_penalty=10.0,
-                max_mel_tokens=600,
-            )
-        except Exception:
-            # Fallback: generate a short silent wav to keep pipeline flowing
-            log.error("[tts] Inference failed, writing fallback WAV:\n" + traceback.format_exc())
+        if source == 'prerender':
+            tl.add('tts_prerendered')
+        elif cached:
+            tl.add('tts_cache_hit', key=key[:16])
+        else:
+            # Written under a temp name and renamed, so a hard link shared with a cache
+            # entry is replaced rather than written through
             try:
-                import wave, struct
-                sr = int(cfg.get('tts', {}).get('sample_rate', 48000))
-                n_channels = 1
-                sampwidth = 2  # 16-bit
-                duration_sec = 0.2
-                n_frames = int(sr * duration_sec)
-                with wave.open(audio_path, 'wb') as wf:
-                    wf.setnchannels(n_channels)
-                    wf.setsampwidth(sampwidth)
-                    wf.setframerate(sr)
-                    silence_frame = struct.pack('<h', 0)
-                    wf.writeframes(silence_frame * n_frames)
-                did_fallback = True
-                tl.add('tts_fallback')
+                if _tts_model is None:
+                    raise RuntimeError("IndexTTS model is not initialized")
+                with tl.span('synthesize', profile=req['profile']), atomic_output(audio_path) as tmp:
+                    _ = _infer(
+                        ref_path,
+                        text,
+                        tmp,
+                        verbose=bool(payload.get('verbose', False)),
+                        **req['infer_kwargs'],
+                    )
             except Exception:
-                raise
+                # Fallback: generate a short silent wav to keep pipeline flowing
+                log.error("[tts] Inference failed, writing fallback WAV:\n" + traceback.format_exc())
+                try:
+                    import wave, struct
+                    sr = int(cfg.get('tts', {}).get('sample_rate') or 24000)
+                    n_channels = 1
+                    sampwidth = 2  # 16-bit
+                    duration_sec = 0.2
+                    n_frames = int(sr * duration_sec)
+                    with atomic_output(audio_path) as tmp, wave.open(tmp, 'wb') as wf:
+                        wf.setnchannels(n_channels)
+                        wf.setsampwidth(sampwidth)
+                        wf.setframerate(sr)
+                        silence_frame = struct.pack('<h', 0)
+                        wf.writeframes(silence_frame * n_frames)
+                    did_fallback = True
+                    tl.add('tts_fallback')
+                except Exception:
+                    raise
+
+            if key and not did_fallback:
+                try:
+                    _OUT_CACHE.store(key, audio_path)
+                except OSError as e:
+                    log.warning(f"[tts] Could not store output in cache: {e}")
+
+        fmt, out_rate = _resolve_output_format(payload)
+        serve_path = audio_path
+        if not did_fallback:
+            try:
+                with tl.span('encode', format=fmt):
+                    serve_path = _ENCODE_POOL.submit(_encode_output, audio_path, fmt, out_rate).result()
+                if serve_path != audio_path:
+                    tl.add('tts_encoded', format=fmt, sample_rate=out_rate or None,
+                           wav_bytes=os.path.getsize(audio_path), bytes=os.path.getsize(serve_path))
+            except Exception:
+                log.warning("[tts] Encoding failed, serving WAV:\n" + traceback.format_exc())
+                serve_path = audio_path
 
         tl.add('tts_end')
 
         return jsonify({
-            'session_id': session_id,
-            'trial_id': trial_id,
-            'audio_path': os.path.relpath(audio_path, start='data'),
-            'timeline': tl.snapshot(),
-            'fallback': did_fallback
+            'session_id': req['session_id'],
+            'trial_id': req['trial_id'],
+            'audio_path': os.path.relpath(serve_path, start='data'),
+            'wav_path': os.path.relpath(audio_path, start='data'),
+            'format': fmt if serve_path != audio_path else 'wav',
+            'timeline': tl.summary(),
+            'fallback': did_fallback,
+            'cached': cached,
+            'profile': req['profile'],
         })
     except Exception as e:
         log.error(f"[tts] Error: {traceback.format_exc()}")
         return jsonify({"error": str(e)}), 500
 
+
+# Sentence boundaries for streaming: ., ! or ? (optionally closed by a quote/bracket) followed by
+# whitespace, or CJK full-stop punctuation
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?]["\'\)\]])\s+|(?<=[.!?])\s+|(?<=[。！？])')
+
+
+def _split_sentences(text: str):
+    return [part.strip() for part in _SENTENCE_SPLIT_RE.split(text or '') if part and part.strip()]
+
+
+def _stream_chunks(text: str, bucket_size: int):
+    """First sentence alone (fast first audio), then the rest in groups of `bucket_size`
+    so infer_fast can still batch them internally."""
+    sentences = _split_sentences(text) or [text]
+    chunks = [sentences[0]]
+    rest = sentences[1:]
+    step = max(1, int(bucket_size))
+    for i in range(0, len(rest), step):
+        chunks.append(' '.join(rest[i:i + step]))
+    return chunks
+
+
+def _as_pcm16(wav) -> bytes:
+    """Convert infer_fast's in-memory output (int16 array, frames x channels) to little-endian PCM."""
+    arr = np.asarray(wav)
+    if arr.dtype != np.int16:
+        arr = arr.astype(np.int16)
+    return np.ascontiguousarray(arr).astype('<i2', copy=False).tobytes()
+
+
+def _encode_pcm_stream(pcm_chunks, fmt: str, out_rate):
+    """Turn (sample_rate, channels, pcm16 bytes) chunks into the requested encoding.
+    WAV/PCM at the native rate pass straight through; anything else goes through an
+    ffmpeg StreamEncoder running on its own threads."""
+    encoder = None
+    passthrough = None
+    try:
+        for sr, n_channels, pcm in pcm_chunks:
+            if passthrough is None:
+                passthrough = fmt in ('wav', 'pcm') and (not out_rate or int(out_rate) == int(sr))
+                if passthrough and fmt == 'wav':
+                    yield wav_header(sr, n_channels, data_size=None)
+                elif not passthrough:
+                    encoder = StreamEncoder(fmt, sr, n_channels, out_rate, bitrate=OPUS_BITRATE)
+            if passthrough:
+                yield pcm
+            else:
+                encoder.write(pcm)
+                yield from encoder.drain()
+        if encoder is not None:
+            yield from encoder.finish()
+            encoder = None
+    finally:
+        if encoder is not None:
+            encoder.abort()
+
+
+@app.post('/api/v1/tts/stream')
+def tts_stream():
+    """Same inputs as /api/v1/tts. Streams audio as each sentence group finishes, in the
+    requested `format` (wav, pcm, flac, opus, vorbis) and `sample_rate`; the complete WAV
+    is still written to the trial directory."""
+    try:
+        req = _prepare_tts_request()
+    except Exception as e:
+        log.error(f"[tts] Error: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+    payload, tl, audio_path = req['payload'], req['tl'], req['audio_path']
+    fmt, out_rate = _resolve_output_format(payload, streaming=True)
+    rel_audio_path = os.path.relpath(audio_path, start='data')
+    mimetype = AUDIO_FORMATS[fmt]['mimetype']
+
+    key = _output_cache_key(req, req['infer_kwargs'])
+    source = _pickup_rendered(req, key)
+    if source is not None:
+        if source == 'prerender':
+            tl.add('tts_prerendered')
+        else:
+            tl.add('tts_cache_hit', key=key[:16])
+
+        def replay():
+            with wave.open(audio_path, 'rb') as wf:
+                sr, n_channels = wf.getframerate(), wf.getnchannels()
+                while True:
+                    frames = wf.readframes(8192)
+                    if not frames:
+                        break
+                    yield sr, n_channels, frames
+            tl.add('tts_end', streamed=True, cached=True)
+
+        return Response(stream_with_context(_encode_pcm_stream(replay(), fmt, out_rate)), mimetype=mimetype, headers={
+            'X-Audio-Path': rel_audio_path,
+            'X-Cache': 'prerender' if source == 'prerender' else 'hit',
+        })
+
+    if _tts_model is None:
+        return jsonify({"error": "IndexTTS model is not initialized"}), 503
+    chunks = _stream_chunks(req['text'], req['infer_kwargs']['sentences_bucket_max_size'])
+
+    def synthesize():
+        pcm_parts = []
+        sr, n_channels = None, 1
+        try:
+            for idx, chunk_text in enumerate(chunks):
+                with tl.span('synthesize_chunk', index=idx):
+                    sr, wav = _infer(
+                        req['ref_path'],
+                        chunk_text,
+                        None,  # return (sampling_rate, int16 frames) instead of writing a file
+                        verbose=bool(payload.get('verbose', False)),
+                        **req['infer_kwargs'],
+                    )
+                n_channels = wav.shape[1] if getattr(wav, 'ndim', 1) > 1 else 1
+                pcm = _as_pcm16(wav)
+                pcm_parts.append(pcm)
+                if idx == 0:
+                    tl.add('tts_first_chunk', chunks=len(chunks), sample_rate=sr, format=fmt)
+                yield sr, n_channels, pcm
+        except Exception:
+            log.error("[tts] Streaming inference failed:\n" + traceback.format_exc())
+            tl.add('tts_stream_error', after_chunks=len(pcm_parts))
+            if not pcm_parts:
+                raise
+            return
+        with atomic_output(audio_path) as tmp, wave.open(tmp, 'wb') as wf:
+            wf.setnchannels(n_channels)
+            wf.setsampwidth(2)
+            wf.setframerate(sr)
+            wf.writeframes(b''.join(pcm_parts))
+        if key:
+            try:
+                _OUT_CACHE.store(key, audio_path)
+            except OSError as e:
+                log.warning(f"[tts] Could not store output in cache: {e}")
+        tl.add('tts_end', streamed=True)
+
+    # Synthesize the first chunk before committing to a 200, so a failure still gets a JSON error
+    pcm_chunks = synthesize()
+    try:
+        first = next(pcm_chunks)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    body = _encode_pcm_stream(itertools.chain([first], pcm_chunks), fmt, out_rate)
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'X-Audio-Path': rel_audio_path,
+        'X-Chunk-Count': str(len(chunks)),
+        'X-Cache': 'miss',
+    })
+
+
+def _resolve_session_ref():
+    """Resolve the reference for /tts/ref and /tts/fillers from `ref_path` or an uploaded `ref_audio`."""
+    payload = _get_request_payload() or {}
+    if request.method == 'GET':
+        payload.update(request.args.to_dict())
+    session_id = payload.get('session_id') or 'demo-session'
+    trial_id = int(payload.get('trial_id') or 0)
+    paths = ensure_trial_paths(session_id, trial_id)
+    ref_upload = request.files.get('ref_audio') if request.files else None
+    if ref_upload:
+        saved_ref = _save_uploaded_file(ref_upload, paths['meta_dir'], 'uploaded_ref.wav')
+        if saved_ref:
+            payload['ref_path'] = saved_ref
+    return payload, _resolve_ref_path(paths, payload)
+
+
+# --- Filler / backchannel cache ---
+# Short phrases ("Hmm.", "Let me think.") pre-synthesized per reference voice so the
+# orchestrator can play one while STT/LLM run. Stored under tts.fillers.dir/<ref digest>/.
+_FILLER_CFG = cfg.get('tts', {}).get('fillers', {}) or {}
+FILLERS_ENABLED = bool(_FILLER_CFG.get('enabled', True))
+FILLER_PHRASES = list(_FILLER_CFG.get('phrases') or ["Hmm.", "Let me think.", "Okay, so.", "Right."])
+FILLER_DIR = _FILLER_CFG.get('dir') or os.path.join('data', 'cache', 'fillers')
+FILLER_PROFILE = _FILLER_CFG.get('profile') or 'realtime'
+_filler_jobs = set()
+_filler_jobs_lock = threading.Lock()
+
+
+def _filler_files(ref_path: str):
+    """[(phrase, path)] for the configured phrases of this reference voice."""
+    voice_dir = os.path.join(FILLER_DIR, file_digest(ref_path)[:16])
+    return [
+        (phrase, os.path.join(voice_dir, f"filler_{hashlib.sha1(phrase.encode('utf-8')).hexdigest()[:10]}.wav"))
+        for phrase in FILLER_PHRASES
+    ]
+
+
+def _ready_fillers(ref_path: str):
+    return [{'text': phrase, 'audio_path': os.path.relpath(path, start='data')}
+            for phrase, path in _filler_files(ref_path) if os.path.isfile(path)]
+
+
+def _generate_fillers(ref_path: str, digest: str):
+    try:
+        _, kwargs = _resolve_profile({'profile': FILLER_PROFILE})
+        for phrase, dest in _filler_files(ref_path):
+            if os.path.isfile(dest):
+                continue
+            t0 = time.time()
+            with atomic_output(dest) as tmp:
+                _infer(ref_path, phrase, tmp, BATCH, **kwargs)
+            log.info(f"[tts] Filler ready: '{phrase}' -> {dest} ({time.time() - t0:.2f}s)")
+    except Exception:
+        log.error("[tts] Filler generation failed:\n" + traceback.format_exc())
+    finally:
+        with _filler_jobs_lock:
+            _filler_jobs.discard(digest)
+
+
+def _schedule_fillers(ref_path: str) -> bool:
+    """Start background filler synthesis for a voice unless it is complete or already running."""
+    if not FILLERS_ENABLED or _tts_model is None:
+        return False
+    if all(os.path.isfile(path) for _, path in _filler_files(ref_path)):
+        return False
+    digest = file_digest(ref_path)
+    with _filler_jobs_lock:
+        if digest in _filler_jobs:
+            return True
+        _filler_jobs.add(digest)
+    threading.Thread(target=_generate_fillers, args=(ref_path, digest), name='tts-fillers', daemon=True).start()
+    return True
+
+
+@app.post('/api/v1/tts/ref')
+def tts_ref():
+    """Pre-compute reference conditioning for a session voice.
+    Accepts `ref_path` (same resolution rules as /api/v1/tts) or an uploaded `ref_audio`.
+    Also starts filler synthesis for the voice."""
+    try:
+        _payload, ref_path = _resolve_session_ref()
+        if not os.path.isfile(ref_path):
+            return jsonify({"error": f"reference not found: {ref_path}"}), 404
+        result = _prime_reference(ref_path)
+        fillers_pending = _schedule_fillers(ref_path)
+        return jsonify({'ref_path': ref_path, **result, 'cache': _REF_CACHE.stats(), 'fillers_pending': fillers_pending})
+    except Exception as e:
+        log.error(f"[tts] Reference priming failed: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/tts/fillers', methods=['GET', 'POST'])
+def tts_fillers():
+    """List ready filler clips for a voice (GET) or start generating them (POST).
+    Same reference inputs as /api/v1/tts/ref."""
+    try:
+        _payload, ref_path = _resolve_session_ref()
+        if not os.path.isfile(ref_path):
+            return jsonify({"error": f"reference not found: {ref_path}"}), 404
+        pending = _schedule_fillers(ref_path) if request.method == 'POST' else False
+        return jsonify({'ref_path': ref_path, 'fillers': _ready_fillers(ref_path), 'pending': pending})
+    except Exception as e:
+        log.error(f"[tts] Filler lookup failed: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Session pre-render ---
+# Scripted lines (fixed NPC text per scene) are known before the session starts. A
+# pre-render job synthesizes them at batch priority into
+# trial_XXX/prerender/<content key>.wav; /api/v1/tts and /tts/stream link that file
+# instead of synthesizing when text, reference and profile match.
+_prerender_jobs = {}
+_prerender_lock = threading.Lock()
+
+
+def _data_file(rel_path: str) -> str:
+    """Path of a client-named file under data/; raises ValueError for anything outside it."""
+    rel_path = str(rel_path)
+    if rel_path.startswith('data' + os.sep):
+        rel_path = rel_path[len('data' + os.sep):]
+    root = os.path.abspath('data')
+    path = os.path.abspath(resolve_data_path(rel_path))
+    if os.path.isabs(rel_path) or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"path must be relative to data/: {rel_path}")
+    return path
+
+
+def _prerender_items(payload: dict):
+    """[(trial_id, text)] from `texts` (strings or {trial_id, text}) or a scenes CSV."""
+    first_trial = int(payload.get('first_trial') or 0)
+    items = []
+    texts = payload.get('texts') or []
+    if isinstance(texts, str):
+        texts = texts.splitlines()  # form field: one line per trial
+    for i, entry in enumerate(texts):
+        if isinstance(entry, dict):
+            items.append((int(entry.get('trial_id', first_trial + i)), str(entry.get('text') or '').strip()))
+        else:
+            items.append((first_trial + i, str(entry).strip()))
+
+    csv_upload = request.files.get('scenes_csv') if request.files else None
+    csv_text = None
+    if csv_upload:
+        csv_text = csv_upload.read().decode('utf-8-sig')
+    elif payload.get('scenes_csv'):
+        with open(_data_file(payload['scenes_csv']), 'r', encoding='utf-8-sig') as f:
+            csv_text = f.read()
+    if csv_text is not None:
+        column = payload.get('text_column') or 'question'
+        for i, row in enumerate(csv.DictReader(io.StringIO(csv_text))):
+            if column not in row:
+                raise ValueError(f"scenes CSV has no '{column}' column")
+            trial = row.get('trial') or row.get('index')
+            trial_id = int(trial) if str(trial or '').strip().isdigit() else i
+            items.append((first_trial + trial_id, (row[column] or '').strip()))
+    return [(trial_id, text) for trial_id, text in items if text]
+
+
+def _run_prerender(job: dict, ref_path: str, kwargs: dict, items):
+    job['state'] = 'running'
+    for trial_id, text in items:
+        try:
+            key = _content_key(text, ref_path, kwargs)
+            dest = _prerender_path(job['session_id'], trial_id, key)
+            if not os.path.isfile(dest):
+                with atomic_output(dest) as tmp:
+                    _infer(ref_path, text, tmp, BATCH, **kwargs)
+                if _OUT_CACHE is not None:
+                    _OUT_CACHE.store(key, dest)
+            job['done'] += 1
+        except Exception:
+            job['failed'] += 1
+            log.error(f"[tts] Pre-render failed for trial {trial_id}:\n" + traceback.format_exc())
+    job['state'] = 'finished'
+    job['finished'] = time.time()
+    log.info(f"[tts] Pre-render {job['job_id']} finished: {job['done']}/{job['total']} rendered, "
+             f"{job['failed']} failed ({job['finished'] - job['started']:.1f}s)")
+
+
+@app.post('/api/v1/tts/prerender')
+def tts_prerender():
+    """Render a session's scripted lines in the background.
+    JSON or form: session_id, voice_id / profile, ref_path (or uploaded ref_audio), and
+    `texts` (list of strings or {trial_id, text}) and/or `scenes_csv` (uploaded file or a
+    path relative to data/; `text_column` default 'question', trial from 'trial'/'index')."""
+    try:
+        payload, ref_path = _resolve_session_ref()
+        if not os.path.isfile(ref_path):
+            return jsonify({"error": f"reference not found: {ref_path}"}), 404
+        if _tts_model is None:
+            return jsonify({"error": "IndexTTS model is not initialized"}), 503
+        try:
+            items = _prerender_items(payload)
+        except (ValueError, OSError) as e:
+            return jsonify({"error": str(e)}), 400
+        if not items:
+            return jsonify({"error": "no texts to render"}), 400
+        profile, kwargs = _resolve_profile(payload)
+        job = {
+            'job_id': uuid.uuid4().hex[:12],
+            'session_id': payload.get('session_id') or 'demo-session',
+            'profile': profile,
+            'total': len(items),
+            'done': 0,
+            'failed': 0,
+            'state': 'queued',
+            'started': time.time(),
+            'finished': None,
+        }
+        with _prerender_lock:
+            _prerender_jobs[job['job_id']] = job
+        threading.Thread(target=_run_prerender, args=(job, ref_path, kwargs, items),
+                         name='tts-prerender', daemon=True).start()
+        return jsonify(job), 202
+    except Exception as e:
+        log.error(f"[tts] Pre-render request failed: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get('/api/v1/tts/prerender/<job_id>')
+def tts_prerender_status(job_id):
+    with _prerender_lock:
+        job = _prerender_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job)
+
+
+# --- Warm-up ---
+# The first inference after start pays for lazy initialization, allocator growth and
+# first-call compilation inside IndexTTS. Run representative sentence lengths with the
+# default reference before reporting ready, so no participant trial pays for it.
+_WARMUP_CFG = cfg.get('tts', {}).get('warmup', {}) or {}
+_DEFAULT_WARMUP_TEXTS = [
+    "Hello.",
+    "Sure, I can help with that. Let me think about it for a second.",
+    "That is an interesting question. I think there are good arguments on both sides, "
+    "but on balance I would choose the first option. It seems fairer to everyone involved.",
+]
+# state: warming -> ready once every warm-up synthesis succeeded, or failed (with `error`)
+_warmup_state = {'state': 'warming', 'ready': False, 'timings': [], 'error': None}
+
+
+def _finish_warmup(error: str = None):
+    _warmup_state['error'] = error
+    _warmup_state['state'] = 'failed' if error else 'ready'
+    _warmup_state['ready'] = error is None
+
+
+def _run_warmup():
+    try:
+        ref_path = _WARMUP_CFG.get('ref_path') or _resolve_ref_path({}, {})
+        if _tts_model is None:
+            _finish_warmup('model not initialized')
+            return
+        if not os.path.isfile(ref_path):
+            log.warning(f"[tts] Warm-up skipped: reference not found at {ref_path}")
+            _finish_warmup(f'reference not found: {ref_path}')
+            return
+        texts = _WARMUP_CFG.get('texts') or _DEFAULT_WARMUP_TEXTS
+        profiles = _WARMUP_CFG.get('profiles') or [DEFAULT_PROFILE]
+        for profile in profiles:
+            _, kwargs = _resolve_profile({'profile': profile})
+            for text in texts:
+                t0 = time.time()
+                _infer(ref_path, text, None, BATCH, **kwargs)
+                elapsed = round(time.time() - t0, 3)
+                _warmup_state['timings'].append({'profile': profile, 'chars': len(text), 'sec': elapsed})
+                log.info(f"[tts] Warm-up profile={profile} chars={len(text)}: {elapsed}s")
+        _finish_warmup()
+    except Exception as e:
+        log.error("[tts] Warm-up failed:\n" + traceback.format_exc())
+        _finish_warmup(f'warm-up failed: {e}')
+
+
+if _WARMUP_CFG.get('enabled', True):
+    threading.Thread(target=_run_warmup, name='tts-warmup', daemon=True).start()
+else:
+    _finish_warmup(None if _tts_model is not None else 'model not initialized')
+
+
+@app.get('/readyz')
+def readyz():
+    """200 once warm-up has completed; 503 while warming up or when it failed (`state`, `error`).
+    Orchestrators and load balancers should gate on this."""
+    code = 200 if _warmup_state['ready'] else 503
+    return jsonify({"service": "tts", "ready": _warmup_state['ready'], "state": _warmup_state['state'],
+                    "error": _warmup_state['error'], "warmup": _warmup_state}), code
+
 @app.get('/healthz')
 def healthz():
-    return jsonify({"service":"tts","ts":time.time()})
+    return jsonify({
+        "service": "tts",
+        "ts": time.time(),
+        "ready": _warmup_state['ready'],
+        "warmup_state": _warmup_state['state'],
+        "ref_cache": _REF_CACHE.stats(),
+        "output_cache": _OUT_CACHE.stats() if _OUT_CACHE else None,
+        "scheduler": _scheduler.stats() if _scheduler else None,
+        "gpu": _GPU.stats() if _GPU else None,
+    })
 
 @app.get('/files/<path:p>')
 def fileserve(p):
-    return send_from_directory('data', p, as_attachment=True)
+    path = resolve_data_path(p)
+    if not os.path.exists(path):
+        # Trials older than storage.archive.after_days are served from their session archive
+        archived = archived_response(os.path.relpath(path, 'data'))
+        if archived is not None:
+            return archived
+    return send_from_directory('data', os.path.relpath(path, 'data'), as_attachment=True)
 
 if __name__ == '__main__':
+    install_signal_flush()
     port = cfg.get("http", {}).get("tts_port", 7003)
     app.run(host='0.0.0.0', port=port)
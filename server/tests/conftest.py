@@ -0,0 +1,9 @@
+import os, sys
+
+# Unit tests import the shared modules as `services.common.*`, run from server/
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# These drive the Flask apps or the running containers (models, GPU, Ollama); run them directly
+collect_ignore = ['1_test_stt.py', '2_test_llm.py', '3_test_tts.py', 'test_3app.py', 'test_outside.py', 'tts_random.py']
@@ -0,0 +1,109 @@
+import os
+import time
+import wave
+
+import pytest
+
+from services.common import archive
+from services.common.archive import Archiver, SessionArchive, read_archived
+from services.common.io_paths import trial_lock
+
+OLD = 30 * 86400
+
+
+@pytest.fixture(autouse=True)
+def gzip_only(monkeypatch):
+    """Use the codecs that need nothing beyond the standard library."""
+    monkeypatch.setattr(archive, 'zstandard', None)
+    monkeypatch.setattr(archive.shutil, 'which', lambda _name: None)
+
+
+@pytest.fixture
+def data(tmp_path):
+    return str(tmp_path / 'data')
+
+
+def _trial(data, session='s', trial=1, age=OLD):
+    trial_dir = os.path.join(data, 'sessions', f'{session}_session', f'trial_{trial:03d}')
+    os.makedirs(trial_dir)
+    files = {
+        'user_2B_llm.txt': 'Hello there.\n'.encode(),
+        'timeline.jsonl': b'{"event":"asr_end"}\n' * 20,
+        'blob.bin': bytes(range(256)),
+    }
+    for name, payload in files.items():
+        with open(os.path.join(trial_dir, name), 'wb') as f:
+            f.write(payload)
+    with wave.open(os.path.join(trial_dir, 'user_1B_mic.wav'), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b'\x01\x00' * 1600)
+    with open(os.path.join(trial_dir, 'user_1B_mic.wav'), 'rb') as f:
+        files['user_1B_mic.wav'] = f.read()
+    t = time.time() - age
+    for name in list(files) + ['.']:
+        os.utime(os.path.join(trial_dir, name), (t, t))
+    return trial_dir, files
+
+
+def _archiver(data, **kwargs):
+    return Archiver(data, pause_sec=0.0, **kwargs)
+
+
+def test_old_trial_round_trips(data):
+    trial_dir, files = _trial(data)
+    done = _archiver(data).run_once()
+    assert [d['files'] for d in done] == [4]
+    assert not os.path.exists(trial_dir)
+    for name, payload in files.items():
+        assert read_archived(f'sessions/s_session/trial_001/{name}', data) == payload
+    members = SessionArchive(os.path.join(data, 'archive'), 's_session').members()
+    assert members['trial_001/blob.bin']['codec'] == 'store'
+    assert members['trial_001/timeline.jsonl']['codec'] == 'gzip'
+    assert members['trial_001/timeline.jsonl']['length'] < len(files['timeline.jsonl'])
+
+
+def test_second_trial_appends_to_session_archive(data):
+    _trial(data, trial=1)
+    _archiver(data).run_once()
+    _, files = _trial(data, trial=2)
+    _archiver(data).run_once()
+    assert read_archived('sessions/s_session/trial_001/blob.bin', data) == files['blob.bin']
+    assert read_archived('sessions/s_session/trial_002/user_2B_llm.txt', data) == files['user_2B_llm.txt']
+
+
+def test_recent_trials_are_kept(data):
+    recent, _ = _trial(data, trial=1, age=86400)
+    live, _ = _trial(data, trial=2, age=0)
+    archiver = _archiver(data)
+    assert archiver.run_once() == []
+    # Even with no age threshold, a trial written within idle_sec is left alone
+    assert [d['trial'] for d in archiver.run_once(older_than_days=0)] == [recent]
+    assert os.path.isdir(live)
+
+
+def test_locked_trial_is_skipped(data):
+    trial_dir, _ = _trial(data)
+    archiver = _archiver(data)
+    with trial_lock(trial_dir):
+        assert archiver.run_once() == []
+    assert os.path.isdir(trial_dir)
+    assert archiver.stats()['skipped_busy'] == 1
+    assert len(archiver.run_once()) == 1
+
+
+def test_dry_run_leaves_trial(data):
+    trial_dir, _ = _trial(data)
+    assert _archiver(data).run_once(dry_run=True) == [{'trial': trial_dir}]
+    assert os.path.isdir(trial_dir)
+    assert read_archived('sessions/s_session/trial_001/blob.bin', data) is None
+
+
+def test_read_archived_rejects_other_paths(data):
+    _trial(data)
+    _archiver(data).run_once()
+    assert read_archived('sessions/s_session/trial_001/missing.txt', data) is None
+    assert read_archived('sessions/../../s_session/trial_001/blob.bin', data) is None
+    assert read_archived('archive/s_session.arc', data) is None
+    assert read_archived('sessions/s_session', data) is None
@@ -0,0 +1,39 @@
+import os
+import subprocess
+
+import pytest
+
+from services.common import audio_io
+from services.common.audio_io import transcode_file, wav_header
+
+
+def test_wav_header_sizes():
+    header = wav_header(24000, data_size=100)
+    assert header[:4] == b'RIFF' and header[8:12] == b'WAVE'
+    assert int.from_bytes(header[4:8], 'little') == 36 + 100
+    assert int.from_bytes(header[40:44], 'little') == 100
+
+
+def test_failed_transcode_leaves_no_file(tmp_path, monkeypatch):
+    def fail(cmd, **_kwargs):
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'partial')
+        raise subprocess.CalledProcessError(1, cmd)
+
+    monkeypatch.setattr(audio_io.subprocess, 'run', fail)
+    dest = str(tmp_path / 'user_2B_tts.ogg')
+    with pytest.raises(subprocess.CalledProcessError):
+        transcode_file(str(tmp_path / 'in.wav'), dest, 'opus')
+    assert os.listdir(tmp_path) == []
+
+
+def test_transcode_writes_dest(tmp_path, monkeypatch):
+    def encode(cmd, **_kwargs):
+        assert cmd[-1].endswith('.ogg') and '-ar' in cmd
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'OggS')
+
+    monkeypatch.setattr(audio_io.subprocess, 'run', encode)
+    dest = str(tmp_path / 'user_2B_tts.ogg')
+    transcode_file(str(tmp_path / 'in.wav'), dest, 'opus', out_rate=16000)
+    assert os.listdir(tmp_path) == ['user_2B_tts.ogg']
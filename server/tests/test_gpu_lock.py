@@ -0,0 +1,183 @@
+import fcntl, os, threading, time
+
+import pytest
+
+from services.common.gpu_lock import BATCH, INTERACTIVE, GpuArbiter
+
+
+def _holder(arbiter, priority=INTERACTIVE):
+    """Hold the GPU on a thread until the returned event is set."""
+    held, release = threading.Event(), threading.Event()
+
+    def run():
+        with arbiter.acquire(priority):
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    assert held.wait(2)
+    return release, t
+
+
+def _waiter(arbiter, priority, order, name, timeout=None):
+    def run():
+        with arbiter.acquire(priority, timeout=timeout):
+            order.append(name)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def _wait_queued(arbiter, n):
+    deadline = time.monotonic() + 2
+    while sum(arbiter.stats()['waiting'].values()) < n:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_lease_reports_wait_and_hold(tmp_path):
+    arbiter = GpuArbiter(str(tmp_path / 'gpu.lock'))
+    with arbiter.acquire(INTERACTIVE) as lease:
+        assert lease['priority'] == INTERACTIVE and lease['wait_sec'] >= 0
+    assert 'hold_sec' in lease
+    assert arbiter.stats()[INTERACTIVE]['acquired'] == 1
+
+
+def test_unknown_priority(tmp_path):
+    arbiter = GpuArbiter(str(tmp_path / 'gpu.lock'))
+    with pytest.raises(ValueError):
+        with arbiter.acquire('urgent'):
+            pass
+
+
+def test_interactive_before_queued_batch_and_fifo(tmp_path):
+    arbiter = GpuArbiter(str(tmp_path / 'gpu.lock'), batch_max_wait=None)
+    release, holder = _holder(arbiter, BATCH)
+    order = []
+    threads = [_waiter(arbiter, BATCH, order, 'b1')]
+    _wait_queued(arbiter, 1)
+    for name in ('i1', 'i2'):
+        threads.append(_waiter(arbiter, INTERACTIVE, order, name))
+        _wait_queued(arbiter, len(threads))
+    release.set()
+    for t in threads + [holder]:
+        t.join(2)
+    assert order == ['i1', 'i2', 'b1']
+
+
+def test_timeout_leaves_queue_clean(tmp_path):
+    arbiter = GpuArbiter(str(tmp_path / 'gpu.lock'))
+    release, holder = _holder(arbiter)
+    with pytest.raises(TimeoutError):
+        with arbiter.acquire(INTERACTIVE, timeout=0.05):
+            pass
+    release.set()
+    holder.join(2)
+    stats = arbiter.stats()
+    assert stats[INTERACTIVE]['timeouts'] == 1 and sum(stats['waiting'].values()) == 0
+    with arbiter.acquire(INTERACTIVE, timeout=1):
+        pass
+
+
+def test_batch_waits_for_interactive_in_other_process(tmp_path):
+    path = str(tmp_path / 'gpu.lock')
+    # A shared flock on the intent file is what another service's queued interactive stage holds
+    fd = os.open(path + '.interactive', os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        arbiter = GpuArbiter(path, batch_max_wait=0.3)
+        t0 = time.monotonic()
+        with arbiter.acquire(BATCH):
+            waited = time.monotonic() - t0
+        assert 0.25 <= waited < 2
+        assert arbiter.stats()[BATCH]['aged'] == 1
+    finally:
+        os.close(fd)
+
+
+def test_batch_proceeds_when_barrier_clears(tmp_path):
+    path = str(tmp_path / 'gpu.lock')
+    fd = os.open(path + '.interactive', os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    threading.Timer(0.1, lambda: fcntl.flock(fd, fcntl.LOCK_UN)).start()
+    try:
+        arbiter = GpuArbiter(path, batch_max_wait=5)
+        t0 = time.monotonic()
+        with arbiter.acquire(BATCH):
+            assert time.monotonic() - t0 < 1
+        assert arbiter.stats()[BATCH]['aged'] == 0
+    finally:
+        os.close(fd)
+
+
+def test_aged_batch_goes_before_later_interactive(tmp_path):
+    arbiter = GpuArbiter(str(tmp_path / 'gpu.lock'), batch_max_wait=0.2)
+    release, holder = _holder(arbiter)
+    order = []
+    batch = _waiter(arbiter, BATCH, order, 'batch')
+    _wait_queued(arbiter, 1)
+    time.sleep(0.05)
+    late = _waiter(arbiter, INTERACTIVE, order, 'interactive')
+    _wait_queued(arbiter, 2)
+    release.set()
+    for t in (batch, late, holder):
+        t.join(2)
+    assert order == ['batch', 'interactive']
+
+
+def test_barrier_waiters_share_one_blocking_thread(tmp_path):
+    path = str(tmp_path / 'gpu.lock')
+    fd = os.open(path + '.interactive', os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        arbiter = GpuArbiter(path, batch_max_wait=5)
+        order = []
+        waiters = [_waiter(arbiter, BATCH, order, f'b{i}') for i in range(3)]
+        deadline = time.monotonic() + 2
+        while arbiter._barrier_pending < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        assert [t.name for t in threading.enumerate()].count('gpu-barrier') == 1
+        assert order == []
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        for t in waiters:
+            t.join(2)
+        assert sorted(order) == ['b0', 'b1', 'b2']
+        assert arbiter.stats()[BATCH]['aged'] == 0
+    finally:
+        os.close(fd)
+
+
+def test_admitted_batch_does_not_wait_at_barrier_again(tmp_path):
+    path = str(tmp_path / 'gpu.lock')
+    arbiter = GpuArbiter(path, batch_max_wait=5)
+    admission = arbiter.admit(BATCH)
+    assert admission['aged'] is False
+    # An interactive stage starts elsewhere after admission; the queued job still runs
+    fd = os.open(path + '.interactive', os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        t0 = time.monotonic()
+        with arbiter.acquire(BATCH, admission=admission) as lease:
+            assert time.monotonic() - t0 < 0.5
+            assert lease['wait_sec'] >= 0
+    finally:
+        os.close(fd)
+
+
+def test_admit_ages_at_barrier(tmp_path):
+    path = str(tmp_path / 'gpu.lock')
+    fd = os.open(path + '.interactive', os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        arbiter = GpuArbiter(path, batch_max_wait=0.2)
+        t0 = time.monotonic()
+        admission = arbiter.admit(BATCH)
+        assert admission['aged'] is True and 0.15 <= time.monotonic() - t0 < 1
+        with arbiter.acquire(BATCH, admission=admission):
+            pass
+        assert arbiter.stats()[BATCH]['aged'] == 1
+    finally:
+        os.close(fd)
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from services.common.inference_queue import InferenceQueue
+
+INTERACTIVE, BATCH = 0, 1
+
+
+class Recorder:
+    """run_job that records items and can hold the worker on an event."""
+
+    def __init__(self):
+        self.items = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, item):
+        self.started.set()
+        self.gate.wait(5)
+        self.items.append(item)
+        return f'done:{item}'
+
+
+def _block(rec, queue):
+    """Occupy the worker so later submissions queue up."""
+    rec.gate.clear()
+    rec.started.clear()
+    fut = queue.submit('blocker')
+    assert rec.started.wait(2)
+    return fut
+
+
+def test_runs_one_job_per_call():
+    rec = Recorder()
+    queue = InferenceQueue(rec)
+    assert queue.run('a', timeout=2) == 'done:a'
+    assert rec.items == ['a']
+
+
+def test_priority_then_fifo():
+    rec = Recorder()
+    queue = InferenceQueue(rec)
+    blocker = _block(rec, queue)
+    futs = [
+        queue.submit('b1', priority=BATCH),
+        queue.submit('i1', priority=INTERACTIVE),
+        queue.submit('b2', priority=BATCH),
+        queue.submit('i2', priority=INTERACTIVE),
+    ]
+    assert queue.stats()['queue_depth'] == 4
+    rec.gate.set()
+    for f in futs + [blocker]:
+        f.result(2)
+    assert rec.items == ['blocker', 'i1', 'i2', 'b1', 'b2']
+
+
+def test_exception_fails_only_its_job():
+    def run_job(item):
+        if item == 'bad':
+            raise ValueError(item)
+        return item
+
+    queue = InferenceQueue(run_job)
+    with pytest.raises(ValueError):
+        queue.run('bad', timeout=1)
+    assert queue.run('ok', timeout=1) == 'ok'
+    stats = queue.stats()
+    assert stats['jobs'] == 2 and stats['queue_depth'] == 0 and stats['avg_wait_sec'] is not None
@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from services.common import io_paths
+from services.common.io_paths import (atomic_output, atomic_write, ensure_trial_paths, forget_trial, record_artifact,
+                                      resolve_data_path, trial_dirs, trial_has, trial_locations, trial_manifest,
+                                      trial_paths)
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory with fresh caches and hot trials off."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(io_paths, 'HOT_TRIALS', False)
+    monkeypatch.setattr(io_paths, '_created', set())
+    monkeypatch.setattr(io_paths, '_manifests', {})
+    return tmp_path
+
+
+def test_trial_paths_layout():
+    paths = trial_paths('abc', 7)
+    assert paths['trial_dir'] == os.path.join('data', 'sessions', 'abc_session', 'trial_007')
+    assert paths['timeline_path'].endswith(os.path.join('trial_007', 'timeline.jsonl'))
+    assert not os.path.exists('data')
+
+
+def test_hot_layout_keeps_meta_durable(monkeypatch):
+    monkeypatch.setattr(io_paths, 'HOT_TRIALS', True)
+    hot = trial_paths('abc', 1)
+    assert hot['trial_dir'] == os.path.join('data', '.hot', 'sessions', 'abc_session', 'trial_001')
+    assert hot['meta_dir'] == os.path.join('data', 'sessions', 'abc_session', 'meta')
+    assert [p['trial_dir'] for p in trial_locations('abc', 1)] == [
+        hot['trial_dir'], trial_paths('abc', 1, durable=True)['trial_dir']]
+
+
+def test_ensure_recreates_removed_directory():
+    paths = ensure_trial_paths('s', 1)
+    assert os.path.isdir(paths['trial_dir']) and os.path.isdir(paths['meta_dir'])
+    atomic_write(os.path.join(paths['trial_dir'], 'a.txt'), 'x')
+    os.rename(paths['trial_dir'], 'moved')
+    paths = ensure_trial_paths('s', 1)
+    assert os.path.isdir(paths['trial_dir'])
+    # A plain write after the move works and the old listing is gone
+    with open(os.path.join(paths['trial_dir'], 'call_log.jsonl'), 'a') as f:
+        f.write('{}\n')
+    assert not trial_manifest('s', 1).has('a.txt')
+
+
+def test_atomic_write_replaces_and_leaves_no_temp():
+    path = os.path.join('data', 'sessions', 's_session', 'trial_001', 'user_2B_llm.txt')
+    atomic_write(path, 'first')
+    atomic_write(path, b'second')
+    with open(path, 'rb') as f:
+        assert f.read() == b'second'
+    assert os.listdir(os.path.dirname(path)) == ['user_2B_llm.txt']
+
+
+def test_atomic_output_failure_keeps_old_file():
+    path = os.path.join('data', 'out.wav')
+    atomic_write(path, b'old')
+    with pytest.raises(RuntimeError):
+        with atomic_output(path) as tmp:
+            assert tmp.endswith('.wav') and os.path.basename(tmp).startswith('.out.')
+            with open(tmp, 'wb') as f:
+                f.write(b'partial')
+            raise RuntimeError('encoder crashed')
+    with open(path, 'rb') as f:
+        assert f.read() == b'old'
+    assert os.listdir('data') == ['out.wav']
+
+
+def test_manifest_sees_own_and_foreign_writes(monkeypatch):
+    monkeypatch.setattr(io_paths, 'MANIFEST_RESCAN_SEC', 0.0)
+    paths = ensure_trial_paths('s', 2)
+    atomic_write(os.path.join(paths['trial_dir'], 'user_1B_mic.wav'), b'RIFF')
+    manifest = trial_manifest('s', 2)
+    assert manifest.get('user_1B_mic.wav')['size'] == 4
+    # Written by another service: found on the next rescan
+    with open(os.path.join(paths['trial_dir'], 'user_2B_tts.wav'), 'wb') as f:
+        f.write(b'12345')
+    assert trial_has('s', 2, 'user_2B_tts.wav')
+    assert not trial_has('s', 2, 'missing.wav')
+    record_artifact(os.path.join(paths['trial_dir'], 'reported.txt'), size=3)
+    assert set(manifest.artifacts()) == {'user_1B_mic.wav', 'user_2B_tts.wav', 'reported.txt'}
+
+
+def test_manifest_miss_rescan_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(io_paths, 'MANIFEST_RESCAN_SEC', 3600.0)
+    paths = ensure_trial_paths('s', 3)
+    assert not trial_has('s', 3, 'late.txt')
+    with open(os.path.join(paths['trial_dir'], 'late.txt'), 'w') as f:
+        f.write('x')
+    assert not trial_has('s', 3, 'late.txt')
+
+
+def test_trial_has_checks_durable_copy(monkeypatch):
+    monkeypatch.setattr(io_paths, 'HOT_TRIALS', True)
+    durable = trial_paths('s', 4, durable=True)['trial_dir']
+    os.makedirs(durable)
+    with open(os.path.join(durable, 'user_2B_llm.txt'), 'w') as f:
+        f.write('moved')
+    assert trial_has('s', 4, 'user_2B_llm.txt')
+
+
+def test_resolve_data_path_falls_back_to_durable():
+    rel = os.path.join('.hot', 'sessions', 's_session', 'trial_001', 'a.wav')
+    assert resolve_data_path(rel) == os.path.join('data', 'sessions', 's_session', 'trial_001', 'a.wav')
+    os.makedirs(os.path.join('data', os.path.dirname(rel)))
+    open(os.path.join('data', rel), 'w').close()
+    assert resolve_data_path(rel) == os.path.join('data', rel)
+    assert resolve_data_path('sessions/x.txt') == os.path.join('data', 'sessions', 'x.txt')
+
+
+def test_forget_trial_drops_caches():
+    paths = ensure_trial_paths('s', 5)
+    trial_manifest('s', 5).record('a.txt', 1)
+    forget_trial('s', 5)
+    assert paths['trial_dir'] not in io_paths._created
+    assert not trial_manifest('s', 5).has('a.txt')
+
+
+def test_trial_dirs_include_durable_location_when_hot(monkeypatch):
+    assert trial_dirs(trial_paths('s', 6)) == [trial_paths('s', 6)['trial_dir']]
+    monkeypatch.setattr(io_paths, 'HOT_TRIALS', True)
+    assert trial_dirs(trial_paths('s', 6)) == [trial_paths('s', 6)['trial_dir'],
+                                                        trial_paths('s', 6, durable=True)['trial_dir']]
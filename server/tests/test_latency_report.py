@@ -0,0 +1,95 @@
+import importlib.util, json, os, sys
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'latency_report.py')
+_spec = importlib.util.spec_from_file_location('latency_report', _PATH)
+latency_report = importlib.util.module_from_spec(_spec)
+# Registered so ProcessPoolExecutor workers can unpickle scan_session
+sys.modules['latency_report'] = latency_report
+_spec.loader.exec_module(latency_report)
+
+
+def _trial(root, session, trial):
+    path = root / 'sessions' / f'{session}_session' / f'trial_{trial:03d}'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _write(path, records):
+    with open(path, 'a', encoding='utf-8') as f:
+        for rec in records:
+            f.write(json.dumps(rec) + '\n')
+
+
+def _span(ts, path, dur_ms, trace='t1', svc='tts'):
+    return {'ts': ts, 'trace': trace, 'svc': svc, 'event': path.rsplit('/', 1)[-1], 'payload': {},
+            'span': {'id': 'x', 'parent': None, 'path': path, 'dur_ms': dur_ms}}
+
+
+def _call(ts, total, trace='t1', condition='1', status='success'):
+    return {'ts': ts, 'trace_id': trace, 'status': status, 'request': {'condition': condition},
+            'timing': {'stt': total * 0.2, 'llm': total * 0.3, 'tts': total * 0.4, 'total': total}}
+
+
+def _run(monkeypatch, capsys, *argv):
+    monkeypatch.setattr(sys, 'argv', ['latency_report.py', *argv])
+    code = latency_report.main()
+    return code, capsys.readouterr()
+
+
+def test_timelines_without_call_logs(tmp_path, monkeypatch, capsys):
+    _write(_trial(tmp_path, 's1', 1) / 'timeline.jsonl', [_span(100.0, 'synthesize', 120.0)])
+    out_json = tmp_path / 'report.json'
+    code, out = _run(monkeypatch, capsys, '--data', str(tmp_path), '--workers', '1', '--json', str(out_json),
+                     '--baseline', '0:50', '--compare', '50:200')
+    assert code == 0
+    assert 'tts:synthesize' in out.out
+    report = json.loads(out_json.read_text())
+    assert report['slowest_sessions'] == [] and report['regressions'] == []
+    assert len(report['span_stages']) == 1
+
+
+def test_empty_data_dir(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'sessions').mkdir()
+    code, out = _run(monkeypatch, capsys, '--data', str(tmp_path), '--workers', '1')
+    assert code == 1 and 'No timing records' in out.err
+
+
+def test_empty_selections_keep_columns():
+    empty = pd.DataFrame({'source': [], 'session': [], 'stage': [], 'status': [], 'sec': [], 'ts': []})
+    dist = latency_report.distributions(empty, ['session'])
+    assert list(dist.columns) == latency_report.DIST_COLUMNS
+    assert dist.sort_values('p95').empty
+    assert list(latency_report.distributions(empty, ['condition', 'stage']).index.names) == ['condition', 'stage']
+    assert latency_report.time_share(empty).empty
+    assert latency_report.regressions(empty, (0, 1), (1, 2), 0.1).sort_values('p95_change').empty
+
+
+def test_report_tables_and_regressions(tmp_path, monkeypatch, capsys):
+    for i in range(10):
+        trace = f'a{i}'
+        t = _trial(tmp_path, 'fast', i)
+        _write(t / 'call_log.jsonl', [_call(100.0 + i, 1.0, trace)])
+        _write(t / 'timeline.jsonl', [_span(100.0 + i, 'synthesize', 400.0, trace)])
+        trace = f'b{i}'
+        t = _trial(tmp_path, 'slow', i)
+        _write(t / 'call_log.jsonl', [_call(300.0 + i, 2.0, trace, condition='2')])
+    _write(_trial(tmp_path, 'slow', 0) / 'call_log.jsonl', [_call(305.0, 50.0, 'err', status='error')])
+    df = latency_report.load_frame(str(tmp_path), workers=2)
+    assert set(df['session']) == {'fast', 'slow'}
+
+    calls = df[(df['source'] == 'call') & (df['status'] == 'success')]
+    slowest = latency_report.distributions(calls[calls['stage'] == 'total'], ['session']).sort_values('p95', ascending=False)
+    assert list(slowest.index) == ['slow', 'fast']
+    share = latency_report.time_share(df)
+    assert share.loc['other (overhead)', 'share'] == pytest.approx(0.1)
+    reg = latency_report.regressions(df, (0, 200), (200, 400), 0.1)
+    assert bool(reg.loc['total', 'regressed']) and reg.loc['total', 'p50_change'] == pytest.approx(1.0)
+    counts = latency_report.status_counts(df)
+    assert counts.loc['total', 'error'] == 1
+
+    code, out = _run(monkeypatch, capsys, '--data', str(tmp_path), '--workers', '1', '--since', '250')
+    assert code == 0 and '1 sessions' in out.out
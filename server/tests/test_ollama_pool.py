@@ -0,0 +1,147 @@
+import asyncio, threading, time
+
+import pytest
+
+from services.common.ollama_pool import OllamaPool, normalize_host
+
+
+def test_normalize_host():
+    assert normalize_host('gpu-box:11434/') == 'http://gpu-box:11434'
+    assert normalize_host(' https://a:1 ') == 'https://a:1'
+
+
+def test_needs_a_host():
+    with pytest.raises(ValueError):
+        OllamaPool(['', '  '])
+
+
+def test_duplicate_hosts_collapse():
+    pool = OllamaPool(['a:1', 'http://a:1', 'b:1'])
+    assert pool.urls == ['http://a:1', 'http://b:1']
+
+
+def test_routes_to_least_outstanding():
+    pool = OllamaPool(['a', 'b', 'c'])
+    first = pool._acquire()
+    second = pool._acquire()
+    third = pool._acquire()
+    assert {first.url, second.url, third.url} == set(pool.urls)
+    pool._release(second, 0.1, True)
+    # b is the only idle host now
+    assert pool._acquire() is second
+
+
+def test_ties_spread_by_dispatch_count():
+    pool = OllamaPool(['a', 'b'])
+    seen = [pool.call(lambda url: url) for _ in range(4)]
+    assert seen == ['http://a', 'http://b', 'http://a', 'http://b']
+
+
+def test_ejects_after_consecutive_failures():
+    pool = OllamaPool(['a', 'b'], eject_after=2, eject_seconds=60)
+
+    def fail_on_a(url):
+        if url == 'http://a':
+            raise ConnectionError(url)
+        return url
+
+    for _ in range(4):
+        try:
+            pool.call(fail_on_a)
+        except ConnectionError:
+            pass
+    stats = {s['url']: s for s in pool.stats()}
+    assert not stats['http://a']['healthy']
+    assert all(pool.call(fail_on_a) == 'http://b' for _ in range(5))
+
+
+def test_success_clears_failures():
+    pool = OllamaPool(['a'], eject_after=3)
+    ep = pool.endpoints[0]
+    for _ in range(2):
+        pool._acquire()
+        pool._release(ep, 0.0, False)
+    pool._acquire()
+    pool._release(ep, 0.0, True)
+    assert ep.failures == 0 and ep.healthy(time.time())
+
+
+def test_all_ejected_probes_earliest_expiry():
+    pool = OllamaPool(['a', 'b'], eject_after=1, eject_seconds=60)
+    a, b = pool.endpoints
+    a.ejected_until = time.time() + 50
+    b.ejected_until = time.time() + 10
+    assert pool._acquire() is b
+
+
+def _seed(pool, latency=0.01, n=5):
+    for ep in pool.endpoints:
+        ep.latencies.extend([latency] * n)
+
+
+def test_hedge_returns_faster_backup():
+    pool = OllamaPool(['slow', 'fast'], hedge=True, hedge_min_samples=5)
+    _seed(pool)
+    release = threading.Event()
+
+    def fn(url):
+        if url == 'http://slow':
+            release.wait(2)
+            return 'slow'
+        return 'fast'
+
+    t0 = time.monotonic()
+    assert pool.call(fn) == 'fast'
+    assert time.monotonic() - t0 < 1
+    release.set()
+
+
+def test_no_hedge_without_latency_samples():
+    pool = OllamaPool(['a', 'b'], hedge=True, hedge_min_samples=5)
+    calls = []
+
+    def fn(url):
+        calls.append(url)
+        time.sleep(0.05)
+        return url
+
+    assert pool.call(fn) == 'http://a'
+    assert calls == ['http://a']
+
+
+def test_hedge_raises_when_both_fail():
+    pool = OllamaPool(['a', 'b'], hedge=True, hedge_min_samples=1)
+    _seed(pool, n=1)
+
+    def fn(url):
+        time.sleep(0.05)
+        raise ConnectionError(url)
+
+    with pytest.raises(ConnectionError):
+        pool.call(fn)
+
+
+def test_single_host_never_hedges():
+    assert not OllamaPool(['a'], hedge=True).hedge
+
+
+def test_acall_hedge_cancels_loser():
+    pool = OllamaPool(['slow', 'fast'], hedge=True, hedge_min_samples=5)
+    _seed(pool)
+    cancelled = []
+
+    async def afn(url):
+        if url == 'http://slow':
+            try:
+                await asyncio.sleep(2)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+            return 'slow'
+        return 'fast'
+
+    assert asyncio.run(pool.acall(afn)) == 'fast'
+    assert cancelled == ['http://slow']
+    # The cancelled attempt is neither a failure nor a latency sample
+    slow = pool.endpoints[0]
+    assert slow.outstanding == 0 and slow.failures == 0 and len(slow.latencies) == 5
@@ -0,0 +1,74 @@
+import os, time
+
+from services.common.output_cache import DiskLRUCache, cache_key, link_or_copy
+
+
+def _src(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def test_cache_key_is_order_independent():
+    assert cache_key(text='hi', ref='a', seed=1) == cache_key(seed=1, ref='a', text='hi')
+    assert cache_key(text='hi') != cache_key(text='hi ')
+
+
+def test_store_and_materialize(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'cache'), max_bytes=1000)
+    cache.store('k1', _src(tmp_path, 'a.wav', 10))
+    dest = tmp_path / 'out.wav'
+    assert cache.materialize('k1', str(dest))
+    assert dest.read_bytes() == b'x' * 10
+    assert not cache.materialize('missing', str(tmp_path / 'none.wav'))
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_store_ignores_missing_source(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'cache'), max_bytes=1000)
+    cache.store('k', str(tmp_path / 'nope.wav'))
+    assert cache.stats()['entries'] == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'cache'), max_bytes=250)
+    for key in ('a', 'b'):
+        cache.store(key, _src(tmp_path, key + '.wav', 100))
+        time.sleep(0.01)
+    # Touch 'a' so 'b' becomes the oldest
+    assert cache.lookup('a')
+    time.sleep(0.01)
+    cache.store('c', _src(tmp_path, 'c.wav', 100))
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') and cache.lookup('c')
+    assert cache.total_bytes <= 250
+    assert not os.path.exists(os.path.join(cache.root, 'b.wav'))
+
+
+def test_oversized_entry_is_evicted_immediately(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'cache'), max_bytes=50)
+    cache.store('big', _src(tmp_path, 'big.wav', 100))
+    assert cache.stats()['entries'] == 0 and cache.total_bytes == 0
+
+
+def test_index_and_recency_survive_restart(tmp_path):
+    root = str(tmp_path / 'cache')
+    cache = DiskLRUCache(root, max_bytes=250)
+    cache.store('old', _src(tmp_path, 'old.wav', 100))
+    cache.store('new', _src(tmp_path, 'new.wav', 100))
+    past = time.time() - 100
+    os.utime(os.path.join(root, 'old.wav'), (past, past))
+    (tmp_path / 'cache' / 'stray.txt').write_text('ignored')
+
+    reopened = DiskLRUCache(root, max_bytes=250)
+    assert reopened.stats()['entries'] == 2
+    reopened.store('third', _src(tmp_path, 'third.wav', 100))
+    assert reopened.lookup('old') is None and reopened.lookup('new')
+
+
+def test_lookup_drops_entry_deleted_on_disk(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'cache'), max_bytes=1000)
+    cache.store('k', _src(tmp_path, 'k.wav', 10))
+    os.unlink(os.path.join(cache.root, 'k.wav'))
+    assert cache.lookup('k') is None
+    assert cache.stats()['entries'] == 0
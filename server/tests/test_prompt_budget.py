@@ -0,0 +1,93 @@
+import pytest
+
+from services.common.prompt_budget import ELLIPSIS, TokenEstimator, build_prompt, truncate_middle
+
+
+def test_estimator_keeps_default_until_min_samples():
+    est = TokenEstimator(chars_per_token=4.0, smoothing=0.5, min_samples=3)
+    est.observe('x' * 100, 50)  # ratio 2.0
+    est.observe('x' * 100, 50)
+    assert est.chars_per_token == 4.0
+    est.observe('x' * 100, 50)
+    # EWMA seeded with the default: 4 -> 3 -> 2.5 -> 2.25
+    assert est.chars_per_token == pytest.approx(2.25)
+
+
+def test_single_odd_sample_does_not_set_ratio():
+    est = TokenEstimator(chars_per_token=3.5, smoothing=0.2, min_samples=1)
+    est.observe('x' * 20, 10)  # ratio 2.0 from a tiny prompt
+    assert est.chars_per_token == pytest.approx(3.5 + 0.2 * (2.0 - 3.5))
+
+
+def test_prefix_cache_hits_are_ignored():
+    est = TokenEstimator(chars_per_token=3.5, smoothing=0.5, min_samples=1)
+    # Ollama evaluated only the uncached tail: 4000 chars over 100 tokens
+    for _ in range(10):
+        est.observe('x' * 4000, 100)
+    est.observe('x' * 10, 10)
+    assert est.rejected == 11 and est.samples == 0
+    assert est.chars_per_token == 3.5
+
+
+def test_observed_ratio_is_clamped_to_band():
+    est = TokenEstimator(chars_per_token=5.0, smoothing=1.0, min_samples=1, ratio_band=(1.5, 6.0))
+    est.observe('x' * 900, 100)  # ratio 9.0, within 2x of the default
+    assert est.chars_per_token == 6.0
+
+
+def test_estimator_ignores_missing_counts():
+    est = TokenEstimator(chars_per_token=3.5, min_samples=1)
+    est.observe('hello', None)
+    est.observe('hello', 0)
+    est.observe('', 10)
+    assert est.samples == 0 and est.chars_per_token == 3.5
+
+
+def test_count_and_chars_for():
+    est = TokenEstimator(chars_per_token=4.0)
+    assert est.count('') == 0
+    assert est.count('abcde') == 2
+    assert est.chars_for(3) == 12
+    assert est.chars_for(-1) == 0
+
+
+def test_truncate_middle_keeps_head_and_tail():
+    text = ' '.join(f'w{i}' for i in range(200))
+    out = truncate_middle(text, 120)
+    assert len(out) <= 120
+    assert out.startswith('w0 ') and out.endswith('w199')
+    assert ELLIPSIS.strip() in out
+    assert truncate_middle('short', 100) == 'short'
+    assert truncate_middle(text, 3) == ''
+
+
+def test_build_prompt_without_budget_joins_everything():
+    est = TokenEstimator(chars_per_token=1.0)
+    prompt, info = build_prompt(est, 'TMPL', 'scene', 'asr')
+    assert prompt == 'TMPL\n\nscene\n\nasr'
+    assert info['truncated'] == [] and info['budget'] is None
+
+
+def test_build_prompt_trims_scene_before_asr():
+    est = TokenEstimator(chars_per_token=1.0)
+    tmpl, asr = 'T' * 20, 'a ' * 20
+    scene = 'scene ' * 100
+    prompt, info = build_prompt(est, tmpl, scene, asr, budget=150)
+    assert info['truncated'] == ['scene']
+    assert prompt.startswith(tmpl) and prompt.endswith(asr.strip())
+    assert est.count(prompt) <= 150
+
+
+def test_build_prompt_trims_asr_when_template_and_asr_exceed_budget():
+    est = TokenEstimator(chars_per_token=1.0)
+    tmpl = 'T' * 50
+    prompt, info = build_prompt(est, tmpl, 'scene text', 'word ' * 100, budget=100)
+    assert info['truncated'] == ['asr', 'scene']
+    assert prompt.startswith(tmpl)
+    assert est.count(prompt) <= 100
+
+
+def test_shared_first_layout():
+    est = TokenEstimator()
+    prompt, _ = build_prompt(est, 'TMPL', 'scene', 'asr', shared_first=True)
+    assert prompt == 'scene\n\nasr\n\nTMPL'
@@ -0,0 +1,68 @@
+from services.common.sentences import sentence_cut
+
+
+def cut(text, n):
+    return sentence_cut(text, n)[0]
+
+
+def stream(chunks, n):
+    """Feed chunks the way _generate_on does; return the text at the cut, or None."""
+    text, scan, count = '', 0, 0
+    for chunk in chunks:
+        text += chunk
+        at, scan, count = sentence_cut(text, n, scan, count)
+        if at is not None:
+            return text[:at]
+    return None
+
+
+def test_cuts_after_max_sentences():
+    text = "Hello there. How are you? I am fine! Bye now. "
+    assert text[:cut(text, 3)] == "Hello there. How are you? I am fine!"
+
+
+def test_closing_quotes_stay_with_sentence():
+    text = 'He said "stop." Then he left. '
+    assert text[:cut(text, 1)] == 'He said "stop."'
+
+
+def test_abbreviations_do_not_end_sentences():
+    text = "Dr. Smith will see you. Mr. Jones too. Bye. "
+    assert text[:cut(text, 2)] == "Dr. Smith will see you. Mr. Jones too."
+
+
+def test_lowercase_continuation_is_not_an_end():
+    text = "Bring snacks, e.g. chips or nuts. Also water. "
+    assert text[:cut(text, 1)] == "Bring snacks, e.g. chips or nuts."
+    text = "Pick option 3. item two is worse. Fine. "
+    assert text[:cut(text, 1)] == "Pick option 3. item two is worse."
+
+
+def test_initials_do_not_end_sentences():
+    text = "Ask J. Doe about it. Thanks. "
+    assert text[:cut(text, 1)] == "Ask J. Doe about it."
+
+
+def test_decimals_are_not_ends():
+    text = "It costs 3.50 today. Come back. "
+    assert text[:cut(text, 1)] == "It costs 3.50 today."
+
+
+def test_list_markers_are_skipped():
+    text = "1. Buy milk. 2. Buy eggs. Done."
+    assert text[:cut(text, 2)] == "1. Buy milk. 2. Buy eggs."
+
+
+def test_period_waits_for_next_word():
+    # The period after "Dr" must not count before " Smith" arrives
+    assert stream(["Please see Dr.", " ", "Smith today. ", "Then rest."], 1) == "Please see Dr. Smith today."
+    assert stream(["One. ", "Two. ", "Three"], 2) == "One. Two."
+
+
+def test_no_cut_when_short():
+    assert cut("Just one sentence. ", 3) is None
+    assert stream(["Only ", "this."], 1) is None
+
+
+def test_question_and_exclamation_end_immediately():
+    assert cut("Really? ", 1) == len("Really?")
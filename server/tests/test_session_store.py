@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from services.common.session_store import SessionStore, find_call_logs, parse_time, record_uid
+
+
+def _record(ts, trace_id=None, total=1.0, session='s1', trial=1, status='success'):
+    rec = {'ts': ts, 'session_id': session, 'trial_id': trial, 'status': status,
+           'request': {'condition': '1', 'voice_id': 'v'},
+           'timing': {'stt': 0.2, 'llm': 0.3, 'tts': 0.5, 'total': total}}
+    if trace_id:
+        rec['trace_id'] = trace_id
+    return rec
+
+
+def _write_log(path, records, **dump_kwargs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for rec in records:
+            f.write(json.dumps(rec, **dump_kwargs) + '\n')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / 'sessions.db'), flush_interval=0.01)
+
+
+def test_uid_ignores_key_order_and_spacing():
+    rec = _record(1.0)
+    reordered = json.loads(json.dumps(dict(reversed(list(rec.items())))))
+    assert record_uid(rec) == record_uid(reordered)
+    assert record_uid(_record(1.0, trace_id='abc')) == 'abc'
+
+
+def test_reimport_after_live_ingestion_does_not_duplicate(store, tmp_path):
+    records = [_record(1.0), _record(2.0, trace_id='t2'), _record(3.0)]
+    for rec in records:
+        store.record(rec)
+    store.flush()
+    # The orchestrator writes call_log.jsonl without sort_keys
+    log_path = tmp_path / 'sessions' / 's1_session' / 'trial_001' / 'call_log.jsonl'
+    _write_log(log_path, records, ensure_ascii=False)
+    result = store.import_jsonl(find_call_logs(str(tmp_path / 'sessions')))
+    assert result == {'files': 1, 'records': 3, 'inserted': 0}
+    assert len(store.query(limit=100)) == 3
+
+
+def test_import_skips_bad_lines_and_is_idempotent(store, tmp_path):
+    log_path = tmp_path / 'call_log.jsonl'
+    _write_log(log_path, [_record(1.0), _record(2.0)])
+    with open(log_path, 'a') as f:
+        f.write('{"truncated": \n\n')
+    assert store.import_jsonl([str(log_path)])['inserted'] == 2
+    assert store.import_jsonl([str(log_path)])['inserted'] == 0
+
+
+def test_query_filters_and_stage_stats(store):
+    for i in range(10):
+        store.record(_record(100.0 + i, total=float(i + 1), trial=i % 2))
+    store.record(_record(200.0, status='error', total=99.0, trial=7))
+    store.flush()
+    assert len(store.query(trial_id=1)) == 5
+    assert len(store.query(since=105, until=108)) == 3
+    assert store.query(status='error')[0]['record']['timing']['total'] == 99.0
+    stats = store.stage_stats('total')
+    assert stats['count'] == 10 and stats['p50'] == 5.0 and stats['p95'] == 10.0
+    with pytest.raises(ValueError):
+        store.stage_stats('nope')
+
+
+def test_parse_time():
+    assert parse_time(None) is None and parse_time('') is None
+    assert parse_time('12.5') == 12.5
+    assert parse_time('2025-01-01') > 0
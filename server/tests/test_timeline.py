@@ -0,0 +1,147 @@
+import json, os, signal, subprocess, sys, threading, time
+
+from services.common import timeline
+from services.common.timeline import Timeline, TimelineSink, build_waterfall, read_timeline
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sink_batches_until_flush(tmp_path):
+    sink = TimelineSink(interval=60)
+    path = str(tmp_path / 'timeline.jsonl')
+    sink.write(path, '{"a": 1}\n')
+    sink.write(path, '{"a": 2}\n')
+    assert not (tmp_path / 'timeline.jsonl').exists()
+    sink.flush()
+    assert _lines(path) == [{'a': 1}, {'a': 2}]
+    sink.close()
+
+
+def test_sink_recreates_moved_directory(tmp_path):
+    sink = TimelineSink(interval=60)
+    path = str(tmp_path / 'gone' / 'timeline.jsonl')
+    sink.write(path, '{}\n')
+    sink.close()
+    assert _lines(path) == [{}]
+
+
+def test_close_timeout_does_not_block_on_slow_disk(tmp_path):
+    sink = TimelineSink(interval=60)
+    sink.write(str(tmp_path / 't.jsonl'), '{}\n')
+    # A flush stuck in I/O holds _io_lock
+    sink._io_lock.acquire()
+    try:
+        t0 = time.monotonic()
+        assert sink.close(timeout=0.1) is False
+        assert time.monotonic() - t0 < 1
+    finally:
+        sink._io_lock.release()
+
+
+def test_writes_after_close_go_straight_to_disk(tmp_path):
+    sink = TimelineSink(interval=60)
+    assert sink.close(timeout=1)
+    path = str(tmp_path / 'late.jsonl')
+    sink.write(path, '{"late": true}\n')
+    assert _lines(path) == [{'late': True}]
+
+
+def test_import_leaves_sigterm_alone():
+    code = ('import signal; import services.common.timeline as t; '
+            'assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL; '
+            't.install_signal_flush(); assert signal.getsignal(signal.SIGTERM) is t._on_sigterm')
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=SERVER_DIR)
+
+
+def test_install_keeps_existing_handler():
+    previous = signal.getsignal(signal.SIGTERM)
+    handler = lambda *_: None
+    signal.signal(signal.SIGTERM, handler)
+    try:
+        timeline.install_signal_flush()
+        assert signal.getsignal(signal.SIGTERM) is handler
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def test_spans_nest_per_thread_and_summarize(tmp_path):
+    path = str(tmp_path / 'timeline.jsonl')
+    tl = Timeline(path, 'tts', trace_id='t1', parent_id='caller')
+    with tl.span('tts'):
+        tl.add('tts_start')
+        with tl.span('synthesize'):
+            pass
+        other = []
+        th = threading.Thread(target=lambda: other.append(tl.begin('worker')))
+        th.start()
+        th.join()
+        other[0].end()
+    durations = tl.durations()
+    assert set(durations) == {'tts', 'tts/synthesize', 'worker'}
+    summary = tl.summary()
+    assert summary['marks'][0][0] == 'tts_start'
+    records = read_timeline(path)
+    by_path = {r['span']['path']: r for r in records if 'span' in r}
+    assert by_path['tts']['span']['parent'] == 'caller'
+    assert by_path['tts/synthesize']['span']['parent'] == by_path['tts']['span']['id']
+    assert all(r['trace'] == 't1' and r['svc'] == 'tts' for r in records)
+
+
+def test_span_records_error(tmp_path):
+    tl = Timeline(str(tmp_path / 'timeline.jsonl'))
+    try:
+        with tl.span('boom'):
+            raise KeyError('x')
+    except KeyError:
+        pass
+    assert tl.spans[0].payload == {'error': 'KeyError'}
+
+
+def _span(svc, name, span_id, parent, ts, dur_ms, trace='tr'):
+    return {'ts': ts, 't': 0, 'event': name, 'payload': {}, 'trace': trace, 'svc': svc,
+            'span': {'id': span_id, 'parent': parent, 'path': name, 'dur_ms': dur_ms}}
+
+
+def test_waterfall_network_gaps():
+    records = [
+        _span('orchestra', 'call_tts', 'o1', None, 100.0, 500.0),
+        {'ts': 100.1, 't': 0, 'event': 'tts_start', 'payload': {}, 'trace': 'tr', 'svc': 'tts'},
+        _span('tts', 'tts', 't1', 'o1', 100.1, 300.0),
+    ]
+    wf = build_waterfall(records)
+    assert wf['trace_id'] == 'tr' and wf['total_ms'] == 500.0
+    net, = wf['network']
+    assert net['callee'] == 'tts'
+    assert net['before_ms'] == 100.0
+    assert net['server_ms'] == 300.0
+    assert net['after_ms'] == 100.0
+
+
+def test_waterfall_picks_latest_trace_and_handles_none():
+    old = _span('orchestra', 'x', 'a', None, 1.0, 1.0, trace='old')
+    new = _span('orchestra', 'x', 'b', None, 2.0, 1.0, trace='new')
+    assert build_waterfall([old, new])['trace_id'] == 'new'
+    assert build_waterfall([{'ts': 1.0, 'event': 'untraced'}])['spans'] == []
+
+
+def test_waterfall_with_truncated_timeline(tmp_path):
+    path = tmp_path / 'timeline.jsonl'
+    records = [
+        _span('orchestra', 'call_llm', 'o1', None, 100.0, 200.0),
+        # Callee span stamped just before the caller (clock skew): nothing of the callee
+        # falls inside the caller's window
+        _span('llm', 'generate', 'l2', 'o1', 99.99, 150.0),
+    ]
+    text = ''.join(json.dumps(r) + '\n' for r in records)
+    # A crash mid-write leaves half a line at the end
+    path.write_text(text + json.dumps(_span('llm', 'llm', 'l1', 'o1', 100.01, 180.0))[:40])
+    recs = read_timeline(str(path))
+    assert len(recs) == 2
+    wf = build_waterfall(recs)
+    net, = wf['network']
+    assert net['callee'] == 'llm' and net['server_ms'] == 150.0
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+import pytest
+
+from services.common.trial_spill import TrialSpiller
+
+KEY = os.path.join('sessions', 's_session', 'trial_001')
+
+
+@pytest.fixture
+def spiller(tmp_path):
+    return TrialSpiller(hot_dir=str(tmp_path / 'hot'), durable_dir=str(tmp_path / 'data'), idle_sec=10.0,
+                        max_lag_sec=120.0)
+
+
+def _write(path, data, age=0.0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if age:
+        t = time.time() - age
+        os.utime(path, (t, t))
+    return path
+
+
+def _hot(spiller, name):
+    return os.path.join(spiller.hot_dir, KEY, name)
+
+
+def _durable(spiller, name):
+    return os.path.join(spiller.durable_dir, KEY, name)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_idle_trial_is_moved(spiller):
+    _write(_hot(spiller, 'user_1B_mic.wav'), b'RIFF', age=60)
+    _write(_hot(spiller, 'timeline.jsonl'), b'{"a":1}\n', age=60)
+    assert spiller.run_once() == 1
+    assert _read(_durable(spiller, 'user_1B_mic.wav')) == b'RIFF'
+    assert _read(_durable(spiller, 'timeline.jsonl')) == b'{"a":1}\n'
+    assert not os.path.exists(os.path.join(spiller.hot_dir, KEY))
+    assert os.listdir(spiller.staging_dir) == []
+    assert spiller.stats()['spilled_trials'] == 1
+
+
+def test_recent_trial_waits_unless_forced(spiller):
+    _write(_hot(spiller, 'a.txt'), b'x')
+    assert spiller.run_once() == 0
+    assert spiller.run_once(force=True) == 1
+    assert os.path.exists(_durable(spiller, 'a.txt'))
+
+
+def test_busy_trial_moved_after_max_lag(spiller):
+    _write(_hot(spiller, 'old.txt'), b'x', age=300)
+    _write(_hot(spiller, 'new.txt'), b'y')
+    assert spiller.run_once() == 1
+    assert spiller.stats()['last_lag_sec'] >= 300
+
+
+def test_held_trial_is_skipped(spiller):
+    _write(_hot(spiller, 'a.txt'), b'x', age=60)
+    spiller.hold('s', 1)
+    spiller.hold('s', 1)
+    assert spiller.run_once(force=True) == 0
+    spiller.release('s', 1)
+    assert spiller.run_once(force=True) == 0
+    spiller.release('s', 1)
+    assert spiller.run_once(force=True) == 1
+
+
+def test_write_in_progress_is_skipped(spiller):
+    _write(_hot(spiller, 'a.txt'), b'x', age=60)
+    _write(_hot(spiller, '.user_2B_tts.1234abcd.tmp.wav'), b'partial')
+    assert spiller.run_once(force=True) == 0
+    os.unlink(_hot(spiller, '.user_2B_tts.1234abcd.tmp.wav'))
+    assert spiller.run_once(force=True) == 1
+
+
+def test_logs_are_appended_to_durable_copy(spiller):
+    _write(_durable(spiller, 'call_log.jsonl'), b'{"n":1}\n')
+    _write(_hot(spiller, 'call_log.jsonl'), b'{"n":2}\n', age=60)
+    spiller.run_once()
+    assert _read(_durable(spiller, 'call_log.jsonl')) == b'{"n":1}\n{"n":2}\n'
+
+
+def test_interrupted_append_is_not_duplicated(spiller):
+    # A crash after part of the staged log was appended: the journal holds the size before
+    staged = os.path.join(spiller.staging_dir, 'abc')
+    _write(_durable(spiller, 'call_log.jsonl'), b'{"n":1}\n{"n":2')
+    _write(os.path.join(staged, KEY, 'call_log.jsonl'), b'{"n":2}\n')
+    with open(os.path.join(staged, '.spill.json'), 'w') as f:
+        json.dump({os.path.join(KEY, 'call_log.jsonl'): len(b'{"n":1}\n')}, f)
+    assert spiller.run_once() == 0
+    assert _read(_durable(spiller, 'call_log.jsonl')) == b'{"n":1}\n{"n":2}\n'
+    assert not os.path.exists(staged)
+
+
+def test_empty_trial_directory_is_removed_once_idle(spiller):
+    path = os.path.join(spiller.hot_dir, KEY)
+    os.makedirs(path)
+    assert spiller.run_once() == 0
+    assert os.path.isdir(path)
+    t = time.time() - 60
+    os.utime(path, (t, t))
+    spiller.run_once()
+    assert not os.path.exists(path)
+    assert spiller.pending() == 0
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Offline latency report over historical trials.
+
+Streams every `sessions/*_session/trial_*/call_log.jsonl` and `timeline.jsonl` under the
+data root (line by line, sessions parsed in parallel; archived trials are read from
+`archive/<session>.arc`), collects stage timings into flat
+columns and aggregates them with pandas:
+
+  - per-stage latency distributions (call-log stages stt/llm/tts/total, and every
+    timeline span path such as asr/transcribe, llm/generate_cond1, synthesize)
+  - share of pipeline time per stage
+  - per-session and per-condition breakdowns
+  - regressions between two date ranges (--baseline / --compare)
+
+Usage:
+  python3 tools/latency_report.py --data /workspace/data
+  python3 tools/latency_report.py --data /workspace/data --since 2025-03-01 --json report.json
+  python3 tools/latency_report.py --baseline 2025-02-01:2025-03-01 --compare 2025-03-01:2025-04-01
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "services"))
+from common.archive import SessionArchive  # noqa: E402
+
+CALL_STAGES = ("stt", "llm", "tts", "total")
+PERCENTILES = [0.5, 0.9, 0.95, 0.99]
+_COLUMNS = ("source", "session", "trial", "condition", "status", "stage", "ts", "sec")
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return dt.datetime.fromisoformat(value).timestamp()
+
+
+def parse_range(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    """'2025-01-01:2025-02-01' -> (start, end) epoch seconds, end exclusive."""
+    if not value:
+        return None
+    start, _, end = value.partition(":")
+    return parse_time(start) or 0.0, parse_time(end) or float("inf")
+
+
+def iter_session_dirs(data_root: str) -> Iterator[str]:
+    sessions = os.path.join(data_root, "sessions")
+    with os.scandir(sessions) as it:
+        for entry in it:
+            if entry.is_dir() and entry.name.endswith("_session"):
+                yield entry.path
+
+
+def _lines(path: str, archive: Optional[SessionArchive], key: str) -> Iterator[str]:
+    if archive is not None:
+        data = archive.read(key)
+        yield from (data.decode("utf-8").splitlines() if data else [])
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from f
+
+
+def _iter_jsonl(path: str, archive: Optional[SessionArchive] = None, key: str = "") -> Iterator[dict]:
+    try:
+        for line in _lines(path, archive, key):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+    except OSError:
+        return
+
+
+def scan_session(session_dir: str) -> Dict[str, list]:
+    """Flatten one session's call logs and timeline spans into columns."""
+    cols: Dict[str, list] = {c: [] for c in _COLUMNS}
+    session = os.path.basename(session_dir)[: -len("_session")]
+
+    def emit(source, trial, condition, status, stage, ts, sec):
+        cols["source"].append(source)
+        cols["session"].append(session)
+        cols["trial"].append(trial)
+        cols["condition"].append(condition)
+        cols["status"].append(status)
+        cols["stage"].append(stage)
+        cols["ts"].append(ts)
+        cols["sec"].append(sec)
+
+    with os.scandir(session_dir) as it:
+        trial_dirs = [e.path for e in it if e.is_dir() and e.name.startswith("trial_")]
+    # Trials moved into the session archive are read from there
+    archive = SessionArchive(os.path.join(os.path.dirname(os.path.dirname(session_dir)), "archive"),
+                             os.path.basename(session_dir))
+    on_disk = {os.path.basename(d) for d in trial_dirs}
+    archived = sorted({k.split("/", 1)[0] for k in archive.members()} - on_disk)
+    sources = [(d, None) for d in trial_dirs] + [(os.path.join(session_dir, t), archive) for t in archived]
+    for trial_dir, arc in sources:
+        trial_name = os.path.basename(trial_dir)
+        try:
+            trial = int(trial_name[len("trial_"):])
+        except ValueError:
+            continue
+        conditions = {}
+        for rec in _iter_jsonl(os.path.join(trial_dir, "call_log.jsonl"), arc, f"{trial_name}/call_log.jsonl"):
+            timing = rec.get("timing") or {}
+            condition = str((rec.get("request") or {}).get("condition") or "")
+            if rec.get("trace_id"):
+                conditions[rec["trace_id"]] = condition
+            for stage in CALL_STAGES:
+                value = timing.get(stage)
+                if isinstance(value, (int, float)):
+                    emit("call", trial, condition, rec.get("status") or "", stage, float(rec.get("ts") or 0.0), float(value))
+        for rec in _iter_jsonl(os.path.join(trial_dir, "timeline.jsonl"), arc, f"{trial_name}/timeline.jsonl"):
+            span = rec.get("span")
+            if not span or span.get("dur_ms") is None:
+                continue
+            stage = f"{rec.get('svc') or '?'}:{span.get('path') or rec.get('event')}"
+            status = "error" if (rec.get("payload") or {}).get("error") else "success"
+            emit("span", trial, conditions.get(rec.get("trace"), ""), status, stage,
+                 float(rec.get("ts") or 0.0), float(span["dur_ms"]) / 1000.0)
+    return cols
+
+
+def load_frame(data_root: str, workers: int) -> pd.DataFrame:
+    dirs = list(iter_session_dirs(data_root))
+    merged: Dict[str, list] = {c: [] for c in _COLUMNS}
+    if workers > 1 and len(dirs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = ex.map(scan_session, dirs, chunksize=16)
+            for part in parts:
+                for c in _COLUMNS:
+                    merged[c].extend(part[c])
+    else:
+        for d in dirs:
+            part = scan_session(d)
+            for c in _COLUMNS:
+                merged[c].extend(part[c])
+    df = pd.DataFrame({
+        "source": pd.Categorical(merged["source"]),
+        "session": pd.Categorical(merged["session"]),
+        "trial": np.asarray(merged["trial"], dtype=np.int32),
+        "condition": pd.Categorical(merged["condition"]),
+        "status": pd.Categorical(merged["status"]),
+        "stage": pd.Categorical(merged["stage"]),
+        "ts": np.asarray(merged["ts"], dtype=np.float64),
+        "sec": np.asarray(merged["sec"], dtype=np.float64),
+    })
+    return df
+
+
+DIST_COLUMNS = ["count", "mean"] + [f"p{int(q * 100)}" for q in PERCENTILES] + ["max"]
+
+
+def _empty(columns: List[str], index: List[str]) -> pd.DataFrame:
+    """A frame with no rows but the usual columns, so sorting and export still work."""
+    return pd.DataFrame(columns=list(index) + list(columns)).set_index(list(index))
+
+
+def distributions(df: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+    if df.empty:
+        return _empty(DIST_COLUMNS, by)
+    g = df.groupby(by, observed=True)["sec"]
+    out = g.quantile(PERCENTILES).unstack()
+    out.columns = [f"p{int(q * 100)}" for q in PERCENTILES]
+    out.insert(0, "mean", g.mean())
+    out.insert(0, "count", g.size())
+    out["max"] = g.max()
+    return out.round(4)
+
+
+def time_share(df: pd.DataFrame) -> pd.DataFrame:
+    """Mean seconds per call-log stage and its share of the mean total."""
+    calls = df[(df["source"] == "call") & (df["status"] == "success")]
+    if calls.empty:
+        return _empty(["mean_sec", "share"], ["stage"])
+    means = calls.groupby("stage", observed=True)["sec"].mean()
+    total = means.get("total", np.nan)
+    share = pd.DataFrame({"mean_sec": means, "share": means / total})
+    if "total" in means.index:
+        parts = means.drop("total").sum()
+        share.loc["other (overhead)"] = [total - parts, (total - parts) / total]
+    return share.round(4)
+
+
+REGRESSION_COLUMNS = ["n_base", "n_cmp", "p50_base", "p50_cmp", "p95_base", "p95_cmp",
+                      "p50_change", "p95_change", "regressed"]
+
+
+def regressions(df: pd.DataFrame, baseline: Tuple[float, float], compare: Tuple[float, float],
+                threshold: float) -> pd.DataFrame:
+    ok = df[df["status"] == "success"]
+    a = ok[(ok["ts"] >= baseline[0]) & (ok["ts"] < baseline[1])]
+    b = ok[(ok["ts"] >= compare[0]) & (ok["ts"] < compare[1])]
+    if a.empty or b.empty:
+        return _empty(REGRESSION_COLUMNS, ["stage"])
+    qa = a.groupby("stage", observed=True)["sec"].quantile([0.5, 0.95]).unstack()
+    qb = b.groupby("stage", observed=True)["sec"].quantile([0.5, 0.95]).unstack()
+    out = pd.DataFrame({
+        "n_base": a.groupby("stage", observed=True).size(),
+        "n_cmp": b.groupby("stage", observed=True).size(),
+        "p50_base": qa.get(0.5), "p50_cmp": qb.get(0.5),
+        "p95_base": qa.get(0.95), "p95_cmp": qb.get(0.95),
+    }).dropna(subset=["p50_base", "p50_cmp"])
+    out["p50_change"] = out["p50_cmp"] / out["p50_base"] - 1.0
+    out["p95_change"] = out["p95_cmp"] / out["p95_base"] - 1.0
+    out["regressed"] = (out["p50_change"] > threshold) | (out["p95_change"] > threshold)
+    return out.sort_values("p95_change", ascending=False).round(4)
+
+
+def status_counts(df: pd.DataFrame) -> pd.DataFrame:
+    calls = df[df["source"] == "call"]
+    if calls.empty:
+        return _empty([], ["stage"])
+    return calls.groupby(["stage", "status"], observed=True).size().unstack(fill_value=0)
+
+
+def _section(title: str, frame: pd.DataFrame) -> str:
+    body = frame.to_string() if len(frame) else "(no data)"
+    return f"\n## {title}\n\n{body}\n"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latency report over historical timelines and call logs")
+    parser.add_argument("--data", default=os.environ.get("DATA_ROOT", "/workspace/data"), help="data root containing sessions/")
+    parser.add_argument("--since", help="only records at or after this time (ISO date or epoch)")
+    parser.add_argument("--until", help="only records before this time")
+    parser.add_argument("--baseline", help="date range START:END for the regression baseline")
+    parser.add_argument("--compare", help="date range START:END compared against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative p50/p95 increase flagged as regression")
+    parser.add_argument("--top-sessions", type=int, default=20, help="slowest sessions to list (by total p95)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", help="also write all tables to this JSON file")
+    args = parser.parse_args()
+
+    df = load_frame(args.data, args.workers)
+    since, until = parse_time(args.since), parse_time(args.until)
+    if since is not None:
+        df = df[df["ts"] >= since]
+    if until is not None:
+        df = df[df["ts"] < until]
+    if df.empty:
+        print("No timing records found.", file=sys.stderr)
+        return 1
+
+    ok = df[df["status"] == "success"]
+    calls = ok[ok["source"] == "call"]
+    spans = ok[ok["source"] == "span"]
+    tables = {
+        "call_stages": distributions(calls, ["stage"]),
+        "time_share": time_share(df),
+        "span_stages": distributions(spans, ["stage"]),
+        "by_condition": distributions(calls, ["condition", "stage"]),
+        "slowest_sessions": distributions(calls[calls["stage"] == "total"], ["session"])
+        .sort_values("p95", ascending=False).head(args.top_sessions),
+        "status_counts": status_counts(df),
+    }
+    baseline, compare = parse_range(args.baseline), parse_range(args.compare)
+    if baseline and compare:
+        tables["regressions"] = regressions(df, baseline, compare, args.threshold)
+
+    n_trials = df.groupby(["session", "trial"], observed=True).ngroups
+    print(f"# Latency report: {df['session'].nunique()} sessions, {n_trials} trials, {len(df)} timings")
+    for name, frame in tables.items():
+        print(_section(name.replace("_", " "), frame), end="")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({name: json.loads(frame.reset_index().to_json(orient="records")) for name, frame in tables.items()},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())